@@ -0,0 +1,68 @@
+import asyncio
+
+from vidhubcontrol.backends import DummyBackend
+
+from benchmarks.runner import benchmark, timed_async, median
+from benchmarks.utils import EmulatedVidhub
+
+NUM_CHANGES = 200
+
+async def set_routes(backend, num_changes, pipelined):
+    num_outputs = backend.num_outputs
+    num_inputs = backend.num_inputs
+    args = [(i % num_outputs, (i + 1) % num_inputs) for i in range(num_changes)]
+    if not pipelined:
+        for out_idx, in_idx in args:
+            await backend.set_crosspoint(out_idx, in_idx)
+        return
+    tasks = [
+        asyncio.ensure_future(backend.set_crosspoint(out_idx, in_idx))
+        for out_idx, in_idx in args
+    ]
+    await asyncio.gather(*tasks)
+
+async def measure_routes(backend, opts, pipelined):
+    values = []
+    for i in range(opts.repeat):
+        t = await timed_async(lambda: set_routes(backend, NUM_CHANGES, pipelined))
+        values.append(NUM_CHANGES / t)
+    return median(values)
+
+@benchmark('route_changes_dummy', unit='changes/s', higher_is_better=True)
+async def route_changes_dummy(param, opts):
+    backend = await DummyBackend.create_async()
+    return await measure_routes(backend, opts, False)
+
+@benchmark('route_changes_emulator', params=('sequential', 'pipelined'),
+           unit='changes/s', higher_is_better=True)
+async def route_changes_emulator(mode, opts):
+    async with EmulatedVidhub(num_inputs=40, num_outputs=40) as device:
+        backend = await device.create_backend()
+        r = await measure_routes(backend, opts, mode == 'pipelined')
+        await backend.disconnect()
+    return r
+
+@benchmark('route_changes_devices', params=(1, 8, 32),
+           unit='changes/s', higher_is_better=True)
+async def route_changes_devices(num_devices, opts):
+    '''Aggregate pipelined route changes per second across many devices
+    '''
+    devices = [EmulatedVidhub(num_inputs=40, num_outputs=40) for i in range(num_devices)]
+    for device in devices:
+        await device.__aenter__()
+    backends = []
+    for device in devices:
+        backends.append(await device.create_backend())
+    values = []
+    for i in range(opts.repeat):
+        async def run():
+            await asyncio.gather(*[
+                set_routes(backend, NUM_CHANGES, True) for backend in backends
+            ])
+        t = await timed_async(run)
+        values.append(NUM_CHANGES * num_devices / t)
+    for backend in backends:
+        await backend.disconnect()
+    for device in devices:
+        await device.__aexit__()
+    return median(values)
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from pydispatch import Dispatcher, Property
+from pythonosc import osc_packet
+
+from vidhubcontrol.interfaces.osc import PubSubOscNode, OSCUDPServer, OscDispatcher
+
+from benchmarks.runner import benchmark, median
+from benchmarks.utils import get_free_port
+
+NUM_UPDATES = 100
+
+class Source(Dispatcher):
+    value = Property()
+
+class SubscriberProtocol(asyncio.DatagramProtocol):
+    def __init__(self, counter):
+        self.counter = counter
+    def datagram_received(self, data, addr):
+        packet = osc_packet.OscPacket(data)
+        self.counter.add(len(packet.messages))
+
+class Counter(object):
+    def __init__(self):
+        self.count = 0
+        self.target = None
+        self.event = asyncio.Event()
+    def reset(self, target):
+        self.count = 0
+        self.target = target
+        self.event.clear()
+    def add(self, n):
+        self.count += n
+        if self.count >= self.target:
+            self.event.set()
+
+@benchmark('osc_fanout', params=(1, 8, 32), unit='msgs/s', higher_is_better=True)
+async def osc_fanout(num_subscribers, opts):
+    '''OSC messages delivered per second from a published property
+    '''
+    loop = asyncio.get_event_loop()
+    source = Source()
+    dispatcher = OscDispatcher()
+    server = OSCUDPServer(('127.0.0.1', get_free_port()), dispatcher)
+    node = PubSubOscNode('bench', osc_dispatcher=dispatcher, published_property=(source, 'value'))
+    await server.start()
+
+    counter = Counter()
+    transports = []
+    for i in range(num_subscribers):
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: SubscriberProtocol(counter), local_addr=('127.0.0.1', 0),
+        )
+        transports.append(transport)
+        node.subscribers.add(transport.get_extra_info('sockname'))
+
+    values = []
+    for i in range(opts.repeat):
+        counter.reset(NUM_UPDATES * num_subscribers)
+        start = time.perf_counter()
+        for j in range(NUM_UPDATES):
+            source.value = i * NUM_UPDATES + j
+        try:
+            await asyncio.wait_for(counter.event.wait(), 10)
+        except asyncio.TimeoutError:
+            pass
+        values.append(counter.count / (time.perf_counter() - start))
+
+    for transport in transports:
+        transport.close()
+    await server.stop()
+    return median(values)
@@ -0,0 +1,71 @@
+from vidhubcontrol.backends.parser import BlockParser
+from vidhubcontrol.emulator import VidhubEmulator
+from vidhubcontrol.backends import TelnetBackend
+from vidhubcontrol.backends.trace import ReplayClient, read_trace, split_sessions, RX
+
+from benchmarks.runner import benchmark, timed, timed_async, median
+from benchmarks.utils import EmulatedVidhub
+
+MATRIX_SIZES = (12, 40, 288)
+
+@benchmark('prelude_parse', params=MATRIX_SIZES)
+async def prelude_parse(size, opts):
+    '''Time to frame a prelude into blocks (fed in 1460 byte segments)
+    '''
+    data = VidhubEmulator(num_inputs=size, num_outputs=size).build_preamble()
+    chunks = [data[i:i+1460] for i in range(0, len(data), 1460)]
+    def run():
+        parser = BlockParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+    return median([timed(run) for i in range(opts.repeat)])
+
+@benchmark('prelude_connect', params=MATRIX_SIZES)
+async def prelude_connect(size, opts):
+    '''Time from connect to a fully parsed prelude against the emulator
+    '''
+    values = []
+    async with EmulatedVidhub(num_inputs=size, num_outputs=size) as device:
+        for i in range(opts.repeat):
+            backend = None
+            async def run():
+                nonlocal backend
+                backend = await device.create_backend()
+            values.append(await timed_async(run))
+            await backend.disconnect()
+    return median(values)
+
+@benchmark('trace_parse')
+async def trace_parse(param, opts):
+    '''Time to frame all received data in a recorded trace (``--trace``)
+    '''
+    if opts.trace_filename is None:
+        return None
+    start_time, frames = read_trace(opts.trace_filename)
+    chunks = [data for t, direction, data in frames if direction == RX]
+    def run():
+        parser = BlockParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+    return median([timed(run) for i in range(opts.repeat)])
+
+@benchmark('trace_replay')
+async def trace_replay(param, opts):
+    '''Time to replay the first session of a recorded trace (``--trace``)
+    through a backend as fast as possible
+    '''
+    if opts.trace_filename is None:
+        return None
+    values = []
+    for i in range(opts.repeat):
+        factory = ReplayClient.factory(opts.trace_filename, speed=None)
+        backend = None
+        async def run():
+            nonlocal backend
+            backend = await TelnetBackend.create_async(
+                hostaddr='replay', client_factory=factory, keepalive_interval=None,
+            )
+            await factory.clients[0].play_task
+        values.append(await timed_async(run))
+        await backend.disconnect()
+    return median(values)
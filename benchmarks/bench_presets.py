@@ -0,0 +1,49 @@
+from vidhubcontrol.backends import DummyBackend
+
+from benchmarks.runner import benchmark, timed, timed_async, median
+from benchmarks.utils import EmulatedVidhub
+
+async def build_presets(backend, num_presets):
+    num_inputs = backend.num_inputs
+    for i in range(num_presets):
+        await backend.set_crosspoints(*[
+            (out_idx, (out_idx + i) % num_inputs)
+            for out_idx in range(backend.num_outputs)
+        ])
+        await backend.store_preset(index=i)
+    return backend.presets
+
+async def measure_recall(backend, opts):
+    presets = await build_presets(backend, 2)
+    values = []
+    for i in range(opts.repeat):
+        for preset in presets:
+            values.append(await timed_async(preset.recall))
+    return median(values)
+
+@benchmark('preset_recall_dummy')
+async def preset_recall_dummy(param, opts):
+    backend = await DummyBackend.create_async()
+    return await measure_recall(backend, opts)
+
+@benchmark('preset_recall_emulator', params=(40, 288))
+async def preset_recall_emulator(size, opts):
+    async with EmulatedVidhub(num_inputs=size, num_outputs=size) as device:
+        backend = await device.create_backend()
+        r = await measure_recall(backend, opts)
+        await backend.disconnect()
+    return r
+
+@benchmark('preset_check_active', params=(10, 100))
+async def preset_check_active(num_presets, opts):
+    '''Time for all presets to process a single route change
+    '''
+    backend = await DummyBackend.create_async()
+    await build_presets(backend, num_presets)
+    values = []
+    for i in range(opts.repeat):
+        in_idx = (backend.crosspoints[0] + 1) % backend.num_inputs
+        values.append(timed(
+            lambda: backend.update_list_property('crosspoints', [(0, in_idx)])
+        ))
+    return median(values)
@@ -0,0 +1,142 @@
+'''Benchmark runner
+
+Usage::
+
+    python -m benchmarks [-k PATTERN] [--save FILE] [--compare FILE]
+
+Results are printed and may be saved as JSON. With ``--compare``, results are
+checked against a saved baseline and the exit status is nonzero if any
+benchmark regressed by more than ``--threshold``.
+'''
+
+import sys
+import time
+import json
+import asyncio
+import argparse
+import statistics
+
+BENCHMARKS = []
+
+class Benchmark(object):
+    '''A registered benchmark function
+
+    Attributes:
+        func: A coroutine function called with ``(param, opts)``. It returns
+            the measured value (or ``None`` to skip)
+        name (str): Name of the benchmark
+        params: Iterable of parameters to run the benchmark with
+        unit (str): Unit of the result
+        higher_is_better (bool): ``True`` for rates, ``False`` for durations
+    '''
+    def __init__(self, func, name, params, unit, higher_is_better):
+        self.func = func
+        self.name = name
+        self.params = params
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+    def iter_keys(self):
+        for param in self.params:
+            if param is None:
+                yield param, self.name
+            else:
+                yield param, '{}[{}]'.format(self.name, param)
+
+def benchmark(name, params=(None,), unit='s', higher_is_better=False):
+    def decorator(func):
+        BENCHMARKS.append(Benchmark(func, name, params, unit, higher_is_better))
+        return func
+    return decorator
+
+def timed(func):
+    '''Call ``func`` and return the elapsed time in seconds
+    '''
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+async def timed_async(coro_func):
+    start = time.perf_counter()
+    await coro_func()
+    return time.perf_counter() - start
+
+def median(values):
+    return statistics.median(values)
+
+async def run_benchmarks(opts):
+    import benchmarks.bench_parser
+    import benchmarks.bench_commands
+    import benchmarks.bench_presets
+    import benchmarks.bench_osc
+    results = {}
+    for bench in BENCHMARKS:
+        for param, key in bench.iter_keys():
+            if opts.pattern and opts.pattern not in key:
+                continue
+            value = await bench.func(param, opts)
+            if value is None:
+                continue
+            results[key] = {
+                'value':value,
+                'unit':bench.unit,
+                'higher_is_better':bench.higher_is_better,
+            }
+            print('{:<40}{:>16.6g} {}'.format(key, value, bench.unit))
+            sys.stdout.flush()
+    return results
+
+def compare_results(results, baseline, threshold):
+    '''Compare results to a baseline
+
+    Returns:
+        list: ``(key, baseline_value, value, change)`` for each regression,
+        where ``change`` is the relative change in the "worse" direction
+    '''
+    regressions = []
+    for key, d in results.items():
+        base = baseline.get(key)
+        if base is None or not base['value']:
+            continue
+        if d['higher_is_better']:
+            change = (base['value'] - d['value']) / base['value']
+        else:
+            change = (d['value'] - base['value']) / base['value']
+        if change > threshold:
+            regressions.append((key, base['value'], d['value'], change))
+    return regressions
+
+def parse_args(args=None):
+    p = argparse.ArgumentParser(description='Run vidhubcontrol benchmarks')
+    p.add_argument('-k', dest='pattern',
+        help='Only run benchmarks containing this string')
+    p.add_argument('--save', dest='save_filename',
+        help='Save results to this file (JSON)')
+    p.add_argument('--compare', dest='compare_filename',
+        help='Compare results with a baseline file saved with --save')
+    p.add_argument('--threshold', dest='threshold', type=float, default=.1,
+        help='Relative change considered a regression (default: %(default)s)')
+    p.add_argument('--trace', dest='trace_filename',
+        help='A recorded session trace to replay (see TelnetBackendBase.start_recording)')
+    p.add_argument('--repeat', dest='repeat', type=int, default=5,
+        help='Number of repetitions for each measurement (default: %(default)s)')
+    return p.parse_args(args)
+
+def main(args=None):
+    opts = parse_args(args)
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run_benchmarks(opts))
+    if opts.save_filename is not None:
+        with open(opts.save_filename, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if opts.compare_filename is None:
+        return
+    with open(opts.compare_filename, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare_results(results, baseline, opts.threshold)
+    if not len(regressions):
+        print('No regressions')
+        return
+    print('Regressions:')
+    for key, base, value, change in regressions:
+        print('{:<40}{:>16.6g} -> {:<16.6g} ({:+.1%})'.format(key, base, value, change))
+    sys.exit(1)
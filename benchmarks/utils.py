@@ -0,0 +1,29 @@
+import socket
+import asyncio
+import contextlib
+
+from vidhubcontrol.emulator import VidhubEmulator
+
+def get_free_port():
+    with contextlib.closing(socket.socket()) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class EmulatedVidhub(object):
+    '''Async context manager running a :class:`VidhubEmulator` on a free port
+    '''
+    def __init__(self, **kwargs):
+        self.emulator = VidhubEmulator(**kwargs)
+        self.port = None
+    async def __aenter__(self):
+        self.port = get_free_port()
+        await self.emulator.start('127.0.0.1', self.port)
+        return self
+    async def __aexit__(self, *args):
+        await self.emulator.stop()
+    async def create_backend(self, **kwargs):
+        from vidhubcontrol.backends import TelnetBackend
+        kwargs.setdefault('keepalive_interval', None)
+        return await TelnetBackend.create_async(
+            hostaddr='127.0.0.1', hostport=self.port, **kwargs
+        )
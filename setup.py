@@ -6,7 +6,7 @@ setup(
     author = "Matthew Reid",
     author_email = "matt@nomadic-recording.com",
     description = "Control Smart Videohub Devices",
-    packages=find_packages(exclude=['tests*']),
+    packages=find_packages(exclude=['tests*', 'benchmarks*']),
     include_package_data=True,
     install_requires=[
         'python-dispatch>=0.0.8',
@@ -19,6 +19,7 @@ setup(
         'console_scripts':[
             'vidhubcontrol-web = vidhubcontrol.sofi_ui.main:run_app',
             'vidhubcontrol-server = vidhubcontrol.runserver:main',
+            'vidhubcontrol-emulator = vidhubcontrol.emulator:main',
         ],
         'gui_scripts':[
             'vidhubcontrol-ui = vidhubcontrol.kivyui.main:main',
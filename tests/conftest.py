@@ -133,9 +133,10 @@ def smartscope_zeroconf_info():
 
 @pytest.fixture
 def mocked_vidhub_telnet_device(monkeypatch, vidhub_telnet_responses):
-    class Telnet(object):
+    class Client(object):
         preamble = 'vidhub'
-        def __init__(self, host=None, port=None, timeout=None, loop=None):
+        eof = False
+        def __init__(self, host=None, port=None, loop=None):
             self.port = port
             self.loop = loop
             self.rx_bfr = b''
@@ -154,17 +155,18 @@ def mocked_vidhub_telnet_device(monkeypatch, vidhub_telnet_responses):
                 self.preamble = 'smartview'
             elif value == SMARTSCOPE_PORT:
                 self.preamble = 'smartscope'
-        async def open(self, host, port=0, timeout=0, loop=None):
+        async def open(self, host=None, port=None):
             if self.port is None:
                 self.port = port
-            self.port
-            if not loop and not self.loop:
-                loop = self.loop = asyncio.get_event_loop()
+            if not self.loop:
+                self.loop = asyncio.get_event_loop()
             async with self.tx_lock:
                 self.tx_bfr = PREAMBLES[self.preamble]
                 self.read_ready_event.set()
         def close(self):
             self.read_ready_event.set()
+        def abort(self):
+            self.close()
         async def close_async(self):
             self.close()
         async def wait_for_data(self):
@@ -184,16 +186,65 @@ def mocked_vidhub_telnet_device(monkeypatch, vidhub_telnet_responses):
                 self.tx_bfr = b''.join([self.tx_bfr, tx_bfr])
                 if len(self.tx_bfr):
                     self.read_ready_event.set()
-        async def read_very_eager(self):
-            async with self.tx_lock:
-                bfr = self.tx_bfr
-                self.tx_bfr = b''
-                self.read_ready_event.clear()
-                return bfr
-
-    monkeypatch.setattr('vidhubcontrol.aiotelnetlib._Telnet', Telnet)
-    monkeypatch.setattr('vidhubcontrol.backends.telnet.aiotelnetlib._Telnet', Telnet)
-    return Telnet
+        def read_nowait(self):
+            bfr = self.tx_bfr
+            self.tx_bfr = b''
+            self.read_ready_event.clear()
+            return bfr
+
+    monkeypatch.setattr('vidhubcontrol.aioclient.Client', Client)
+    return Client
+
+class DeviceServer(object):
+    '''A TCP server standing in for a device
+
+    Each client is sent the result of :meth:`get_preamble` (if not ``None``).
+    Received commands are added to :attr:`rx_commands` (without the blank
+    line terminator) and passed to :meth:`on_command`, which ACKs them and
+    echoes them back as a Videohub does. Tests replace either method to
+    change the behaviour.
+    '''
+    def __init__(self, port):
+        self.port = port
+        self.preamble = VIDHUB_PREAMBLE
+        self.chunk_size = None
+        self.server = None
+        self.sessions = []
+        self.rx_commands = []
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, '127.0.0.1', self.port)
+    async def stop(self):
+        self.server.close()
+        for writer in self.sessions:
+            writer.close()
+        await self.server.wait_closed()
+    def get_preamble(self):
+        return self.preamble
+    async def on_command(self, writer, cmd):
+        writer.write(b'ACK\n\n' + cmd + b'\n\n')
+    async def handle_client(self, reader, writer):
+        self.sessions.append(writer)
+        preamble = self.get_preamble()
+        if preamble is not None:
+            chunk_size = self.chunk_size or len(preamble)
+            for i in range(0, len(preamble), chunk_size):
+                writer.write(preamble[i:i+chunk_size])
+                await writer.drain()
+        bfr = b''
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            bfr += data
+            while b'\n\n' in bfr:
+                cmd, bfr = bfr.split(b'\n\n', 1)
+                self.rx_commands.append(cmd)
+                await self.on_command(writer, cmd)
+        writer.close()
+
+@pytest.fixture
+def device_server(unused_tcp_port):
+    return DeviceServer(unused_tcp_port)
 
 @pytest.fixture
 def tempconfig(tmpdir):
@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+
+@pytest.mark.asyncio
+async def test_coalesced_crosspoints():
+    from vidhubcontrol.backends import DummyBackend
+
+    vidhub = await DummyBackend.create_async(coalesce_window=.01)
+
+    calls = []
+    do_set_crosspoints = vidhub.do_set_crosspoints
+    async def wrapped(*args):
+        calls.append(args)
+        return await do_set_crosspoints(*args)
+    vidhub._coalescers['crosspoints'].send_func = wrapped
+
+    tasks = [
+        asyncio.ensure_future(vidhub.set_crosspoint(0, 1)),
+        asyncio.ensure_future(vidhub.set_crosspoints((1, 2), (2, 3))),
+        asyncio.ensure_future(vidhub.set_crosspoint(0, 4)),
+    ]
+    results = await asyncio.gather(*tasks)
+    assert results == [True, True, True]
+    assert calls == [((0, 4), (1, 2), (2, 3))]
+    assert vidhub.crosspoints[:3] == [4, 2, 3]
+
+    # A later call opens a new window
+    assert await vidhub.set_crosspoint(3, 5)
+    assert len(calls) == 2
+    assert calls[-1] == ((3, 5),)
+
+    tasks = [
+        asyncio.ensure_future(vidhub.set_output_label(0, 'foo')),
+        asyncio.ensure_future(vidhub.set_output_label(1, 'bar')),
+        asyncio.ensure_future(vidhub.set_input_label(0, 'baz')),
+    ]
+    await asyncio.gather(*tasks)
+    assert vidhub.output_labels[:2] == ['foo', 'bar']
+    assert vidhub.input_labels[0] == 'baz'
+
+    await vidhub.disconnect()
+
+@pytest.mark.asyncio
+async def test_coalesced_telnet(mocked_vidhub_telnet_device):
+    from vidhubcontrol.backends import TelnetBackend
+
+    backend = await TelnetBackend.create_async(hostaddr=True, coalesce_window=.005)
+
+    tx = []
+    send_command = backend.send_command
+    async def wrapped(data, *args):
+        tx.append(data)
+        return await send_command(data, *args)
+    backend.send_command = wrapped
+
+    tasks = [asyncio.ensure_future(backend.set_crosspoint(i, 3)) for i in range(backend.num_outputs)]
+    results = await asyncio.gather(*tasks)
+    assert all(results)
+    assert len(tx) == 1
+    assert backend.crosspoints == [3] * backend.num_outputs
+
+    await backend.disconnect()
@@ -38,6 +38,8 @@ async def test_config_basic(tempconfig, missing_netifaces):
         'crosspoints':{0:12},
     }
 
+    await config.storage.flush()
+
     config2 = Config.load(str(tempconfig))
     await config2.start()
 
@@ -148,6 +150,8 @@ async def test_config_devices(tempconfig, missing_netifaces):
     for smartscope in config.smartscopes.values():
         assert isinstance(smartscope.backend, SmartScopeDummyBackend)
 
+    await config.storage.flush()
+
     config2 = Config.load(str(tempconfig))
     await config2.start()
 
@@ -163,3 +167,300 @@ async def test_config_devices(tempconfig, missing_netifaces):
 
     await config.stop()
     await config2.stop()
+
+@pytest.mark.asyncio
+async def test_config_backend_kwargs(tempconfig, missing_netifaces, unused_tcp_port):
+    from vidhubcontrol.backends import TelnetBackend
+
+    config = Config.load(str(tempconfig), backend_kwargs={'trace_buffer_size':8})
+    await config.start()
+    backend = config.build_backend(
+        'vidhub', 'TelnetBackend',
+        hostaddr='127.0.0.1', hostport=unused_tcp_port, auto_connect=False,
+    )
+    assert backend.trace_buffer.maxlen == 8
+    await config.stop()
+
+    config2 = Config.load(str(tempconfig), backend_kwargs={'trace_buffer_size':4})
+    await config2.start()
+    key, vidhub_conf = list(config2.vidhubs.items())[0]
+    assert vidhub_conf.backend.trace_buffer.maxlen == 4
+    assert 'trace_buffer_size' not in config2.get_save_data()['vidhubs'][key]
+
+    # Not set on the class
+    assert TelnetBackend.TRACE_BUFFER_SIZE == 0
+    assert TelnetBackend(hostaddr='127.0.0.1', auto_connect=False).trace_buffer is None
+    await config2.stop()
+
+@pytest.mark.asyncio
+async def test_config_save_scheduling(tempconfig, missing_netifaces):
+    import json
+    import time
+    from vidhubcontrol.backends import DummyBackend
+    from vidhubcontrol.storage import copy_data
+
+    config = Config.load(str(tempconfig), save_delay=.1)
+    await config.start()
+    storage = config.storage
+
+    writes = []
+    write = storage.write
+    def wrapped(data):
+        writes.append(data)
+        write(data)
+    storage.write = wrapped
+
+    vidhub = await DummyBackend.create_async(device_id='dummy1')
+    config.add_vidhub(vidhub)
+    for i in range(10):
+        await vidhub.store_preset(name='preset{}'.format(i))
+
+    # Nothing is written until the delay has passed
+    assert not len(writes)
+    assert not tempconfig.exists()
+
+    await asyncio.sleep(.2)
+    await storage.flush()
+    assert len(writes) == 1
+    data = json.loads(tempconfig.read())
+    assert len(data['vidhubs']['dummy1']['presets']) == 10
+
+    # Changes made during a write are collapsed into one more write
+    def slow_write(data):
+        time.sleep(.1)
+        wrapped(data)
+    storage.write = slow_write
+    config.save_later()
+    flush_task = asyncio.ensure_future(storage.flush())
+    await asyncio.sleep(.05)
+    assert storage._save_task is not None
+    for i in range(5):
+        vidhub.presets[i].name = 'renamed{}'.format(i)
+    await flush_task
+    assert len(writes) == 3
+    data = json.loads(tempconfig.read())
+    assert data['vidhubs']['dummy1']['presets'][4]['name'] == 'renamed4'
+
+    # An immediate save waits for the write in progress rather than being
+    # overwritten by it
+    config.save_later()
+    flush_task = asyncio.ensure_future(storage.flush())
+    await asyncio.sleep(.05)
+    assert storage._save_task is not None
+    storage.write = wrapped
+    saved = copy_data(config.get_save_data())
+    saved['vidhubs']['dummy1']['presets'][0]['name'] = 'saved'
+    storage.save(saved)
+    await flush_task
+    data = json.loads(tempconfig.read())
+    assert data['vidhubs']['dummy1']['presets'][0]['name'] == 'saved'
+    assert len(writes) == 5
+
+    # Temporary files are not left behind
+    assert tempconfig.dirpath().listdir() == [tempconfig]
+
+    # Pending changes are written on stop
+    vidhub.presets[0].name = 'foo'
+    await config.stop()
+    assert len(writes) == 6
+    data = json.loads(tempconfig.read())
+    assert data['vidhubs']['dummy1']['presets'][0]['name'] == 'foo'
+
+@pytest.mark.asyncio
+async def test_config_journal(tempconfig, missing_netifaces):
+    import json
+    from vidhubcontrol.backends import DummyBackend
+    from vidhubcontrol.storage import JournalStorage
+
+    journal = tempconfig.dirpath().join('{}.journal'.format(tempconfig.basename))
+
+    config = Config.load(
+        str(tempconfig), storage_type='journal', save_delay=.01, compact_threshold=50,
+    )
+    await config.start()
+    assert isinstance(config.storage, JournalStorage)
+
+    vidhub = await DummyBackend.create_async(device_id=None)
+    config.add_vidhub(vidhub)
+    vidhub.device_id = 'dummy1'
+    await asyncio.sleep(.1)
+    preset1 = await vidhub.store_preset(name='PRESET1')
+    await vidhub.set_crosspoint(0, 12)
+    preset8 = await vidhub.store_preset(name='PRESET8', index=8, outputs_to_store=[0])
+    preset1.name = 'renamed'
+    await config.storage.flush()
+
+    # Only the journal has been written
+    assert not tempconfig.exists()
+    records = [json.loads(line) for line in journal.readlines()]
+    assert len(records) < 50
+    assert [r['seq'] for r in records] == list(range(1, len(records)+1))
+    assert records[-1]['path'] == ['vidhubs', 'dummy1', 'presets', 0, 'name']
+    assert records[-1]['value'] == 'renamed'
+
+    # Incomplete records are ignored
+    with open(str(journal), 'a') as f:
+        f.write('{"seq": 1000, "op": "set", "pa')
+
+    def check_loaded(config2):
+        assert list(config2.vidhubs.keys()) == ['dummy1']
+        vidhub2 = config2.vidhubs['dummy1'].backend
+        assert len(vidhub2.presets) == 9
+        for preset, preset2 in zip([preset1, preset8], [vidhub2.presets[0], vidhub2.presets[8]]):
+            for attr in ['name', 'index', 'crosspoints']:
+                assert getattr(preset, attr) == getattr(preset2, attr)
+
+    config2 = Config.load(str(tempconfig), storage_type='journal')
+    check_loaded(config2)
+    assert config2.storage.seq == len(records)
+    assert journal.read().endswith('\n')
+    assert len(journal.readlines()) == len(records)
+
+    # Compact into the snapshot once the threshold is reached
+    for i in range(50):
+        preset8.name = 'preset8_{}'.format(i)
+    await config.storage.flush()
+    assert tempconfig.exists()
+    assert journal.read() == ''
+    data = json.loads(tempconfig.read())
+    assert data['vidhubs']['dummy1']['presets'][8]['name'] == 'preset8_49'
+
+    config3 = Config.load(str(tempconfig), storage_type='journal')
+    check_loaded(config3)
+
+    # A full save writes a snapshot and clears the journal
+    preset8.name = 'foo'
+    config.save()
+    assert journal.read() == ''
+    config4 = Config.load(str(tempconfig), storage_type='journal')
+    assert config4.vidhubs['dummy1'].backend.presets[8].name == 'foo'
+
+    await config.stop()
+
+@pytest.mark.asyncio
+async def test_config_sqlite(tmpdir, missing_netifaces):
+    import sqlite3
+    from vidhubcontrol.backends import DummyBackend
+    from vidhubcontrol.storage import SqliteStorage
+
+    filename = str(tmpdir.join('vidhubcontrol.db'))
+
+    config = Config.load(filename, storage_type='sqlite', save_delay=.01)
+    await config.start()
+    assert isinstance(config.storage, SqliteStorage)
+
+    vidhubs = []
+    for i in range(3):
+        vidhub = await DummyBackend.create_async(
+            device_id='dummy{}'.format(i), device_name='vidhub{}'.format(i),
+        )
+        config.add_vidhub(vidhub)
+        vidhubs.append(vidhub)
+        for j in range(4):
+            await vidhub.set_crosspoints(*[(k, j) for k in range(vidhub.num_outputs)])
+            await vidhub.store_preset(
+                name='preset{}'.format(j), outputs_to_store=range(j, j+3),
+            )
+    vidhubs[1].presets[2].name = 'foo'
+    vidhubs[2].presets[0].crosspoints[11] = 5
+    vidhubs[0].device_name = 'renamed'
+    await config.storage.flush()
+
+    conn = sqlite3.connect(filename)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('SELECT COUNT(*) FROM presets').fetchone()[0] == 12
+    conn.close()
+
+    assert config.find_presets(name='foo') == [vidhubs[1].presets[2]]
+    assert config.find_presets(name='preset2') == [vidhubs[0].presets[2], vidhubs[2].presets[2]]
+    assert config.find_presets(output=0) == [vh.presets[0] for vh in vidhubs]
+    assert config.find_presets(output=11) == [vidhubs[2].presets[0]]
+    assert config.find_presets(output=3, device_id='dummy0') == vidhubs[0].presets[1:4]
+
+    config2 = Config.load(filename, storage_type='sqlite')
+    assert set(config2.vidhubs.keys()) == set(['dummy0', 'dummy1', 'dummy2'])
+    assert config2.vidhubs['dummy0'].device_name == 'renamed'
+
+    # Presets are not read until a device connects or they are searched for
+    for vidhub_conf in config2.vidhubs.values():
+        assert not len(vidhub_conf.backend.presets)
+        assert 'presets' not in vidhub_conf._get_conf_data()
+    # and saving before then leaves them in place
+    config2.save()
+    await config2.storage.flush()
+    assert len(config2.storage.read_presets('dummy0')) == 4
+
+    backend2 = config2.vidhubs['dummy1'].backend
+    assert config2.find_presets(name='foo') == [backend2.presets[2]]
+    assert len(backend2.presets) == 4
+    assert len(config2.vidhubs['dummy2'].backend.presets) == 0
+
+    # Loaded presets are saved as usual
+    backend2.presets[2].name = 'bar'
+    assert config2.vidhubs['dummy1'].presets[2]['name'] == 'bar'
+    await config2.storage.flush()
+    assert config2.storage.find_presets(name='bar') == [('dummy1', 2)]
+    backend2.presets[2].name = 'foo'
+
+    await config2.start()
+    await config2.startup_fut
+    for vidhub in vidhubs:
+        vidhub2 = config2.vidhubs[vidhub.device_id].backend
+        assert len(vidhub2.presets) == len(vidhub.presets)
+        for preset, preset2 in zip(vidhub.presets, vidhub2.presets):
+            for attr in ['name', 'index', 'crosspoints']:
+                assert getattr(preset, attr) == getattr(preset2, attr)
+
+    # Searching without an index gives the same results
+    json_config = Config(filename=str(tmpdir.join('vidhubcontrol.json')))
+    for vidhub in vidhubs:
+        json_config.add_vidhub(vidhub)
+    assert json_config.find_presets(name='preset2') == [vidhubs[0].presets[2], vidhubs[2].presets[2]]
+    assert json_config.find_presets(output=11) == [vidhubs[2].presets[0]]
+
+    await config.stop()
+    await config2.stop()
+    await json_config.stop()
+
+@pytest.mark.asyncio
+async def test_config_state_cache(tempconfig, missing_netifaces):
+    import json
+    from vidhubcontrol.backends import DummyBackend
+
+    state_file = tempconfig.dirpath().join('{}.state'.format(tempconfig.basename))
+
+    config = Config.load(str(tempconfig))
+    await config.start()
+    vidhub = await DummyBackend.create_async(device_id='dummy1')
+    config.add_vidhub(vidhub)
+    await vidhub.set_crosspoints(*[(i, 11 - i) for i in range(vidhub.num_outputs)])
+    await vidhub.set_output_label(3, 'Foo')
+    await config.stop()
+
+    assert '\n' not in state_file.read()
+    state = json.loads(state_file.read())
+    assert state['dummy1']['crosspoints'] == vidhub.crosspoints
+    assert state['dummy1']['output_labels'][3] == 'Foo'
+
+    # Cached state is available before the device connects
+    config2 = Config.load(str(tempconfig))
+    vidhub2 = config2.vidhubs['dummy1'].backend
+    assert not vidhub2.connected
+    assert vidhub2.state_stale
+    assert vidhub2.num_outputs == 12
+    assert vidhub2.crosspoints == vidhub.crosspoints
+    assert vidhub2.output_labels == vidhub.output_labels
+    assert vidhub2.input_labels == vidhub.input_labels
+
+    # Then confirmed or corrected by the device
+    await config2.start()
+    await config2.wait_ready()
+    assert vidhub2.prelude_parsed
+    assert not vidhub2.state_stale
+    assert vidhub2.stale_changes == {'output_labels':set([3])}
+    assert vidhub2.output_labels[3] == 'Output 4'
+    assert vidhub2.crosspoints == vidhub.crosspoints
+
+    await config2.stop()
+    state = json.loads(state_file.read())
+    assert state['dummy1']['output_labels'][3] == 'Output 4'
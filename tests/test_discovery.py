@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+import pytest
+
+SERVICE_TYPE = '_test-vidhub._tcp.local.'
+
+class FakeZeroconf(object):
+    def __init__(self, delay):
+        self.delay = delay
+        self.infos = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+    def add(self, info):
+        self.infos[info.name] = info
+    def get_service_info(self, type_, name):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        info = self.infos.get(name)
+        if info is None:
+            return None
+        return info.to_zc_info()
+
+@pytest.mark.asyncio
+async def test_service_resolve(monkeypatch):
+    from vidhubcontrol.discovery import Listener, ServiceInfo
+
+    monkeypatch.setattr('vidhubcontrol.discovery.ZEROCONF_AVAILABLE', False)
+
+    loop = asyncio.get_event_loop()
+    zc = FakeZeroconf(.2)
+    names = []
+    for i in range(4):
+        name = 'device{}.{}'.format(i, SERVICE_TYPE)
+        zc.add(ServiceInfo(
+            type=SERVICE_TYPE, name=name, server='device{}.local.'.format(i),
+            address='127.0.0.1', port=9990 + i,
+            properties={'unique id':'{:012x}'.format(i), 'name':'Device {}'.format(i)},
+        ))
+        names.append(name)
+
+    listener = Listener(loop, SERVICE_TYPE)
+    await listener.start()
+
+    added = asyncio.Queue()
+    def on_service_added(info, **kwargs):
+        added.put_nowait(info)
+    listener.bind(service_added=on_service_added)
+
+    # Announcements return without waiting for resolution
+    start = loop.time()
+    for name in names:
+        listener.add_service(zc, SERVICE_TYPE, name)
+    listener.add_service(zc, SERVICE_TYPE, names[0])
+    listener.add_service(zc, SERVICE_TYPE, 'missing.{}'.format(SERVICE_TYPE))
+    assert loop.time() - start < .1
+
+    for i in range(len(names)):
+        await asyncio.wait_for(added.get(), 1)
+    # Resolved concurrently rather than one after another
+    assert loop.time() - start < .6
+    assert zc.calls == 5
+    assert len(listener.services) == 4
+    info = listener.services[(SERVICE_TYPE, names[0])]
+    assert info.port == 9990
+    assert info.properties['name'] == 'Device 0'
+
+    # Services announced again within the TTL are not resolved again
+    listener.add_service(zc, SERVICE_TYPE, names[1])
+    await asyncio.sleep(.1)
+    assert zc.calls == 5
+    assert added.empty()
+
+    # Removal discards the cached entry so a returning service is resolved
+    # with its current address and port
+    listener.remove_service(zc, SERVICE_TYPE, names[0])
+    await asyncio.sleep(.1)
+    assert (SERVICE_TYPE, names[0]) not in listener.services
+    assert (SERVICE_TYPE, names[0]) not in listener.resolve_cache
+    zc.infos[names[0]].port = 9999
+    listener.add_service(zc, SERVICE_TYPE, names[0])
+    info = await asyncio.wait_for(added.get(), 1)
+    assert info.name == names[0]
+    assert info.port == 9999
+    assert zc.calls == 6
+
+    # Once expired, the service is resolved again and only the changed
+    # properties are updated
+    listener.RESOLVE_CACHE_TTL = 0
+    changes = []
+    def on_properties(instance, value, **kwargs):
+        changes.append(kwargs.get('keys'))
+    info.bind(properties=on_properties)
+    zc.infos[names[0]].properties['name'] = 'Renamed'
+    listener.add_service(zc, SERVICE_TYPE, names[0])
+    while zc.calls < 7:
+        await asyncio.sleep(.05)
+    await asyncio.sleep(.3)
+    assert listener.services[(SERVICE_TYPE, names[0])] is info
+    assert info.properties['name'] == 'Renamed'
+    assert info.properties['unique id'] == '{:012x}'.format(0)
+    assert len(changes) == 1
+    assert added.empty()
+
+    await listener.stop()
@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+
+from vidhubcontrol.backends.telnet import (
+    TelnetBackend, SmartViewTelnetBackend, SmartScopeTelnetBackend,
+)
+
+@pytest.mark.asyncio
+async def test_vidhub_emulator(unused_tcp_port):
+    from conftest import VIDHUB_PREAMBLE, VIDHUB_DEVICE_ID
+    from vidhubcontrol.emulator import VidhubEmulator
+
+    emulator = VidhubEmulator(preamble=VIDHUB_PREAMBLE)
+    assert emulator.build_preamble().rstrip() == VIDHUB_PREAMBLE.rstrip()
+
+    await emulator.start('127.0.0.1', unused_tcp_port)
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=unused_tcp_port,
+    )
+    other = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=unused_tcp_port,
+    )
+    assert backend.prelude_parsed
+    assert backend.device_id == VIDHUB_DEVICE_ID.upper()
+    assert backend.crosspoints == emulator.crosspoints
+    assert backend.input_labels == emulator.input_labels
+    assert backend.output_labels == emulator.output_labels
+
+    assert await backend.set_crosspoints((0, 5), (1, 6))
+    assert emulator.crosspoints[:2] == [5, 6]
+    assert await backend.set_output_label(3, 'Foo')
+    assert emulator.output_labels[3] == 'Foo'
+
+    # Changes are sent to other clients
+    await asyncio.sleep(.1)
+    assert other.crosspoints[:2] == [5, 6]
+    assert other.output_labels[3] == 'Foo'
+
+    # Invalid input index
+    assert not await backend.set_crosspoint(0, 100)
+    assert emulator.crosspoints[0] == 5
+
+    emulator.nak_rate = 1.
+    assert not await backend.set_crosspoint(0, 1)
+    assert emulator.crosspoints[0] == 5
+
+    await backend.disconnect()
+    await other.disconnect()
+    await emulator.stop()
+
+@pytest.mark.asyncio
+async def test_vidhub_emulator_large(unused_tcp_port):
+    from vidhubcontrol.emulator import VidhubEmulator
+
+    emulator = VidhubEmulator(
+        num_inputs=288, num_outputs=288, ack_latency=.01, ack_jitter=.005,
+        change_rate=50,
+    )
+    await emulator.start('127.0.0.1', unused_tcp_port)
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=unused_tcp_port,
+    )
+    assert backend.num_outputs == 288
+    assert backend.num_inputs == 288
+    assert backend.device_model == 'Smart Videohub 288x288'
+
+    args = [(i, 287 - i) for i in range(288)]
+    assert await backend.set_crosspoints(*args)
+
+    # Unsolicited changes are picked up
+    await asyncio.sleep(.3)
+    emulator.change_task.cancel()
+    for i in range(20):
+        await asyncio.sleep(.1)
+        if backend.crosspoints == emulator.crosspoints:
+            break
+    assert backend.crosspoints == emulator.crosspoints
+
+    await backend.disconnect()
+    await emulator.stop()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('device_type', ['smartview', 'smartscope'])
+async def test_smartview_emulator(unused_tcp_port, device_type):
+    from conftest import PREAMBLES
+    from vidhubcontrol.emulator import SmartViewEmulator, SmartScopeEmulator
+
+    if device_type == 'smartview':
+        emulator_cls, backend_cls = SmartViewEmulator, SmartViewTelnetBackend
+    else:
+        emulator_cls, backend_cls = SmartScopeEmulator, SmartScopeTelnetBackend
+
+    emulator = emulator_cls(preamble=PREAMBLES[device_type])
+    await emulator.start('127.0.0.1', unused_tcp_port)
+
+    backend = await backend_cls.create_async(
+        hostaddr='127.0.0.1', hostport=unused_tcp_port,
+    )
+    assert backend.prelude_parsed
+    assert backend.num_monitors == 2
+    assert backend.device_model == emulator.model_name
+
+    monitor = backend.monitors[0]
+    assert monitor.brightness == 255
+    await monitor.set_property('brightness', 10)
+    assert monitor.brightness == 10
+    assert ('Brightness', '10') in emulator.monitors[monitor.name]
+
+    await backend.disconnect()
+    await emulator.stop()
+
+def test_emulator_args():
+    from vidhubcontrol.emulator import parse_args, build_emulators, VidhubEmulator
+
+    opts = parse_args(['vidhub', '-n', '3', '--inputs', '40', '--outputs', '40', '--port', '10000'])
+    emulators = build_emulators(opts)
+    assert [port for emulator, port in emulators] == [10000, 10001, 10002]
+    for emulator, port in emulators:
+        assert isinstance(emulator, VidhubEmulator)
+        assert emulator.num_outputs == 40
+    assert len(set(emulator.device_id for emulator, port in emulators)) == 3
+
+    # Each emulator built from one preamble gets its own Unique ID
+    import os
+    from conftest import VIDHUB_DEVICE_ID
+    preamble_filename = os.path.join(os.path.dirname(__file__), 'vidhub-preamble.txt')
+    opts = parse_args(['vidhub', '-n', '3', '--preamble', preamble_filename])
+    emulators = build_emulators(opts)
+    device_ids = [emulator.device_id for emulator, port in emulators]
+    assert device_ids[0] == VIDHUB_DEVICE_ID
+    assert len(set(device_ids)) == 3
+    for device_id in device_ids:
+        assert len(device_id) == 12
+        int(device_id, 16)
@@ -373,6 +373,48 @@ async def test_interface(missing_netifaces):
     by_name_response = NodeResponse()
     await by_name_response.subscribe_to_node(client_node.add_child('vidhubs/by-name'), server_addr)
 
+    # Tracing is not supported by DummyBackend
+    cnode = client_node.add_child('vidhubs/by-id/dummy/trace/size')
+    node_response = NodeResponse(cnode)
+    await cnode.send_message(server_addr, 8)
+    msg = await node_response.wait_for_response()
+    assert list(msg['messages']) == [0]
+
+    # so give it a trace buffer that can be enabled while running
+    from vidhubcontrol.backends.trace import TraceBuffer
+    vidhub.trace_buffer = None
+    def enable_trace(maxlen):
+        vidhub.trace_buffer = TraceBuffer(maxlen)
+    def disable_trace():
+        vidhub.trace_buffer = None
+    vidhub.enable_trace = enable_trace
+    vidhub.disable_trace = disable_trace
+    await cnode.send_message(server_addr, 8)
+    msg = await node_response.wait_for_response()
+    assert list(msg['messages']) == [8]
+    assert vidhub.trace_buffer.maxlen == 8
+    await cnode.send_message(server_addr)
+    msg = await node_response.wait_for_response()
+    assert list(msg['messages']) == [8]
+    await cnode.send_message(server_addr, 0)
+    msg = await node_response.wait_for_response()
+    assert list(msg['messages']) == [0]
+    assert vidhub.trace_buffer is None
+
+    # and a protocol trace to dump
+    vidhub.dump_trace = lambda: ['frame {}'.format(i) for i in range(20)]
+    cnode = client_node.add_child('vidhubs/by-id/dummy/trace')
+    node_response = NodeResponse(cnode)
+    await cnode.send_message(server_addr)
+    msg = await node_response.wait_for_response()
+    assert list(msg['messages']) == ['frame {}'.format(i) for i in range(4, 20)]
+    await cnode.send_message(server_addr, 2)
+    msg = await node_response.wait_for_response()
+    assert list(msg['messages']) == ['frame 18', 'frame 19']
+    await cnode.send_message(server_addr, 0)
+    msg = await node_response.wait_for_response()
+    assert list(msg['messages']) == []
+
     cnode = client_node.add_child('vidhubs/by-id/dummy/labels/output/_list')
     node_response = NodeResponse(cnode)
     await cnode.send_message(server_addr)
@@ -435,6 +477,15 @@ async def test_interface(missing_netifaces):
     for xpt in vidhub.crosspoints:
         assert xpt == 2
 
+    cnode = client_node.add_child('vidhubs/by-id/dummy/routes-by-input')
+    routes_response = NodeResponse(cnode)
+    await cnode.send_message(server_addr, 2)
+    msg = await routes_response.wait_for_response()
+    assert list(msg['messages']) == [2] + list(range(vidhub.num_outputs))
+    await cnode.send_message(server_addr, 0)
+    msg = await routes_response.wait_for_response()
+    assert list(msg['messages']) == [0]
+
     expected = vidhub.crosspoints[:]
     await crosspoint_node.send_message(server_addr)
     msg = await crosspoint_response.wait_for_response()
@@ -537,6 +588,39 @@ async def test_interface(missing_netifaces):
     msg = await by_name_response.wait_for_response()
     assert set(msg['messages']) == set([vidhub.device_name, vidhub2.device_name])
 
+    # Recall presets on both devices with a salvo
+    await vidhub2.connect()
+    preset2 = await vidhub2.store_preset(outputs_to_store=[])
+    preset2.crosspoints.update({0:9, 1:9})
+    salvo_node = client_node.add_child('salvo')
+    salvo_response = NodeResponse(salvo_node)
+    await salvo_node.send_message(server_addr, 'dummy', 1, 'dummy2', 0, 'nonexistent', 0)
+    msg = await salvo_response.wait_for_response()
+    assert list(msg['messages'][:4]) == ['dummy', True, 'dummy2', True]
+    assert vidhub.presets[1].active
+    assert preset2.active
+    assert vidhub2.crosspoints[:2] == [9, 9]
+
+    # A salvo in a bundle is prepared on arrival and sent at its timetag
+    import time
+    from vidhubcontrol import salvo as salvo_module
+    prepare_times = []
+    prepare = salvo_module.Salvo.prepare
+    def timed_prepare(self):
+        prepare_times.append(time.time())
+        prepare(self)
+    salvo_module.Salvo.prepare = timed_prepare
+    try:
+        when = time.time() + .3
+        await salvo_node.send_message(server_addr, 'dummy', 0, 'dummy2', 0, when=when)
+        msg = await salvo_response.wait_for_response()
+    finally:
+        salvo_module.Salvo.prepare = prepare
+    assert time.time() >= when
+    assert prepare_times[0] < when - .1
+    assert list(msg['messages'][:4]) == ['dummy', True, 'dummy2', True]
+    assert vidhub.presets[0].active
+
     await client.stop()
     await interface.stop()
 
@@ -567,5 +651,31 @@ async def test_interface_config(tempconfig, missing_netifaces):
     for i in range(vidhub.num_inputs):
         assert vidhub_node.find('labels/input/{}'.format(i)) is not None
 
+    # Search the config presets
+    from vidhubcontrol.interfaces.osc import OscNode, OSCUDPServer, OscDispatcher
+    await vidhub.store_preset(name='a', outputs_to_store=[0, 1])
+    await vidhub.store_preset(name='b', outputs_to_store=[1, 2])
+
+    client_node = OscNode('vidhubcontrol')
+    client_node.osc_dispatcher = OscDispatcher()
+    client_addr = (str(interface.hostiface.ip), interface.hostport+1)
+    client = OSCUDPServer(client_addr, client_node.osc_dispatcher)
+    await client.start()
+    server_addr = interface.server._server_address
+
+    find_node = client_node.add_child('vidhubs/find-presets')
+    msg_queue = asyncio.Queue()
+    def on_message_received(node, client_address, *messages):
+        msg_queue.put_nowait(messages)
+    find_node.bind(on_message_received=on_message_received)
+
+    await find_node.send_message(server_addr, 'output', 1)
+    assert list(await msg_queue.get()) == ['foo', 0, 'foo', 1]
+    await find_node.send_message(server_addr, 'name', 'b', 'device_id', 'foo')
+    assert list(await msg_queue.get()) == ['foo', 1]
+    await find_node.send_message(server_addr, 'name', 'c')
+    assert list(await msg_queue.get()) == []
+
+    await client.stop()
     await interface.stop()
     await config.stop()
@@ -0,0 +1,53 @@
+import pytest
+
+from vidhubcontrol.backends.parser import Block, BlockParser
+
+from conftest import PREAMBLES
+
+
+def iter_chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i+size]
+
+@pytest.mark.parametrize('device_type', ['vidhub', 'smartview', 'smartscope'])
+def test_parser_chunk_sizes(device_type):
+    preamble = PREAMBLES[device_type]
+
+    parser = BlockParser()
+    expected = parser.feed(preamble)
+    assert len(expected)
+    assert expected[0].name == 'PROTOCOL PREAMBLE'
+    if device_type == 'vidhub':
+        assert expected[-1] == Block('END PRELUDE')
+
+    for chunk_size in [1, 2, 3, 7, 50, 1024]:
+        parser = BlockParser()
+        blocks = []
+        for chunk in iter_chunks(preamble, chunk_size):
+            blocks.extend(parser.feed(chunk))
+        assert blocks == expected
+
+def test_parser_blocks():
+    parser = BlockParser()
+
+    blocks = parser.feed(b'ACK\n\nVIDEO OUTPUT ROUTING:\n0 1\n1 ')
+    assert blocks == [Block('ACK')]
+
+    blocks = parser.feed(b'2\n')
+    assert blocks == []
+
+    blocks = parser.feed(b'\r\nNAK\n\n')
+    assert len(blocks) == 2
+    routing, nak = blocks
+    assert routing.name == 'VIDEO OUTPUT ROUTING'
+    assert list(routing.iter_indexed()) == [(0, '1'), (1, '2')]
+    assert nak.name == 'NAK'
+
+    blocks = parser.feed('INPUT LABELS:\n0 Caméra 1\n1 Foo: Bar\n\n'.encode('UTF-8'))
+    assert list(blocks[0].iter_indexed()) == [(0, 'Caméra 1'), (1, 'Foo: Bar')]
+
+    blocks = parser.feed(b'NETWORK:\nMac Address: 7c:2e:0d:00:00:00\nDynamic IP: true\n\n')
+    assert dict(blocks[0].iter_items()) == {
+        'Mac Address':'7c:2e:0d:00:00:00',
+        'Dynamic IP':'true',
+    }
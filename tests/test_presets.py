@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+
+@pytest.mark.asyncio
+async def test_preset_index():
+    from vidhubcontrol.backends import DummyBackend
+
+    vidhub = await DummyBackend.create_async()
+    index = vidhub.preset_index
+    await vidhub.set_crosspoints(*[(i, 0) for i in range(vidhub.num_outputs)])
+
+    # One preset per output, each routing it to input 1
+    presets = []
+    for out_idx in range(vidhub.num_outputs):
+        preset = await vidhub.store_preset(outputs_to_store=[out_idx])
+        preset.crosspoints[out_idx] = 1
+        presets.append(preset)
+    all_outputs = await vidhub.store_preset()
+    for preset in presets:
+        assert not preset.active
+        assert index.get_mismatch_count(preset) == 1
+        assert index.presets_by_output[preset.index] == {preset, all_outputs}
+    assert all_outputs.active
+
+    transitions = []
+    def on_preset_active(backend, preset, value, **kwargs):
+        transitions.append((preset, value))
+    vidhub.bind(on_preset_active=on_preset_active)
+
+    # Only the presets containing the changed output are affected
+    await vidhub.set_crosspoint(3, 1)
+    assert transitions == [(presets[3], True), (all_outputs, False)] or \
+        transitions == [(all_outputs, False), (presets[3], True)]
+    assert index.get_mismatch_count(all_outputs) == 1
+    assert len([p for p in presets if p.active]) == 1
+
+    # No transition if the active state doesn't change
+    del transitions[:]
+    await vidhub.set_crosspoint(4, 2)
+    assert transitions == []
+    assert index.get_mismatch_count(all_outputs) == 2
+    assert index.get_mismatch_count(presets[4]) == 1
+
+    await vidhub.set_crosspoints((3, 0), (4, 0))
+    assert all_outputs.active
+    assert not presets[3].active
+
+    # Changing a preset's crosspoints re-indexes it
+    presets[5].crosspoints = {6:0, 7:0}
+    assert presets[5].active
+    assert presets[5] not in index.presets_by_output[5]
+    assert presets[5] in index.presets_by_output[6]
+
+    index.remove_preset(presets[5])
+    assert presets[5] not in index.presets_by_output[6]
+
+@pytest.mark.asyncio
+async def test_preset_recall_diff():
+    from vidhubcontrol.backends import DummyBackend
+
+    vidhub = await DummyBackend.create_async()
+    await vidhub.set_crosspoints(*[(i, 0) for i in range(vidhub.num_outputs)])
+    preset = await vidhub.store_preset()
+    preset.crosspoints.update({0:1, 1:2, 2:3})
+
+    sent = []
+    do_set_crosspoints = vidhub.do_set_crosspoints
+    async def wrapped(*args):
+        sent.append(args)
+        return await do_set_crosspoints(*args)
+    vidhub.do_set_crosspoints = wrapped
+
+    result = await preset.recall()
+    assert result.num_changed == 3
+    assert result.latency >= 0
+    assert sent == [((0, 1), (1, 2), (2, 3))]
+    assert preset.active
+
+    # Nothing to send
+    result = await preset.recall()
+    assert result == (0, 0.)
+    assert len(sent) == 1
+
+    await vidhub.set_crosspoint(5, 4)
+    result = await preset.recall()
+    assert result.num_changed == 1
+    assert sent[-1] == ((5, 0),)
+
+    result = await preset.recall(force=True)
+    assert result.num_changed == vidhub.num_outputs
+    assert len(sent[-1]) == vidhub.num_outputs
+
+    # A rejected command changes nothing
+    async def rejected(*args):
+        return False
+    vidhub.do_set_crosspoints = do_set_crosspoints
+    await vidhub.set_crosspoint(5, 4)
+    vidhub.do_set_crosspoints = rejected
+    result = await preset.recall()
+    assert result.num_changed == 0
+    assert result.latency >= 0
+    assert vidhub.crosspoints[5] == 4
+
+    # Timeouts and lost connections are returned as a failed recall
+    from vidhubcontrol.backends.commands import CommandTimeoutError
+    for exc_cls in [CommandTimeoutError, ConnectionResetError]:
+        async def failed(*args):
+            raise exc_cls()
+        vidhub.do_set_crosspoints = failed
+        result = await preset.recall()
+        assert result.num_changed == 0
+        assert result.latency >= 0
+        assert vidhub.crosspoints[5] == 4
+
+@pytest.mark.asyncio
+async def test_preset_encoded_cache(mocked_vidhub_telnet_device):
+    from vidhubcontrol.backends import TelnetBackend
+
+    backend = await TelnetBackend.create_async(hostaddr=True)
+    await backend.set_crosspoints(*[(i, 0) for i in range(backend.num_outputs)])
+    preset = await backend.store_preset(outputs_to_store=[])
+    preset.crosspoints.update({2:5, 0:4})
+
+    data, items = preset.get_encoded_crosspoints()
+    assert items == [(0, 4), (2, 5)]
+    assert data == backend.encode_crosspoints(items)
+    assert preset.get_encoded_crosspoints()[0] is data
+
+    tx = []
+    send_command = backend.send_command
+    async def wrapped(data, *args):
+        tx.append(data)
+        return await send_command(data, *args)
+    backend.send_command = wrapped
+
+    # Full recall sends the cached bytes as-is
+    result = await preset.recall()
+    assert result.num_changed == 2
+    assert tx[-1] is data
+    assert backend.crosspoints[:3] == [4, 0, 5]
+
+    # Changing the preset invalidates the cache
+    preset.crosspoints[1] = 6
+    data2, items = preset.get_encoded_crosspoints()
+    assert data2 is not data
+    assert items == [(0, 4), (1, 6), (2, 5)]
+
+    # Partial recalls are encoded as needed
+    result = await preset.recall()
+    assert result.num_changed == 1
+    assert tx[-1] == backend.encode_crosspoints([(1, 6)])
+
+    result = await preset.recall(force=True)
+    assert result.num_changed == 3
+    assert tx[-1] is data2
+
+    await backend.disconnect()
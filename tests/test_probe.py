@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+
+@pytest.mark.asyncio
+async def test_discovery_probe(unused_tcp_port_factory):
+    from vidhubcontrol.emulator import VidhubEmulator
+    from vidhubcontrol.backends.telnet import TelnetBackend
+    from vidhubcontrol.probe import DiscoveryProbe
+
+    emulators = []
+    ports = []
+    for i in range(6):
+        emulator = VidhubEmulator()
+        port = unused_tcp_port_factory()
+        await emulator.start('127.0.0.1', port)
+        emulators.append(emulator)
+        ports.append(port)
+
+    probe = DiscoveryProbe(max_concurrent=2, max_attempts=3, retry_delay=.05)
+    tasks = [
+        probe.probe(emulator.device_id, TelnetBackend, hostaddr='127.0.0.1', hostport=port)
+        for emulator, port in zip(emulators, ports)
+    ]
+    # Repeated announcements share the same probe
+    assert probe.probe(emulators[0].device_id, TelnetBackend) is tasks[0]
+    assert len(probe.probes) == len(emulators)
+
+    backends = await asyncio.gather(*tasks)
+    assert len(probe.probes) == 0
+    for emulator, backend in zip(emulators, backends):
+        assert backend.device_id == emulator.device_id.upper()
+        assert backend.connected
+        assert backend.prelude_parsed
+        assert backend.connect_fut.done()
+
+    # The probe connection remains usable
+    await backends[0].set_crosspoint(0, 5)
+    assert emulators[0].crosspoints[0] == 5
+
+    # Nothing listening: gives up after max_attempts
+    bad_port = unused_tcp_port_factory()
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    backend = await probe.probe('bad', TelnetBackend, hostaddr='127.0.0.1', hostport=bad_port)
+    assert backend is None
+    assert loop.time() - start >= .05
+    assert len(probe.probes) == 0
+
+    # A device that comes up between attempts is found on retry
+    late_port = unused_tcp_port_factory()
+    late = VidhubEmulator()
+    probe.retry_delay = .3
+    t = probe.probe('late', TelnetBackend, hostaddr='127.0.0.1', hostport=late_port)
+    await asyncio.sleep(.1)
+    await late.start('127.0.0.1', late_port)
+    backend = await t
+    assert backend is not None
+    assert backend.device_id == late.device_id.upper()
+    backends.append(backend)
+    emulators.append(late)
+
+    for backend in backends:
+        await backend.disconnect()
+    for emulator in emulators:
+        await emulator.stop()
@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+
+def test_routing_table():
+    from vidhubcontrol.backends.routing import RoutingTable
+
+    table = RoutingTable([0] * 4)
+    assert len(table) == 4
+    assert table.get_outputs(0) == {0, 1, 2, 3}
+    assert table.pop_dirty() == [0, 1, 2, 3]
+    assert table.pop_dirty() == []
+    version = table.version
+
+    assert table.update([(1, 2), (3, 2), (0, 0)]) == [1, 3]
+    assert table.version == version + 1
+    assert list(table) == [0, 2, 0, 2]
+    assert table.get_outputs(0) == {0, 2}
+    assert table.get_outputs(2) == {1, 3}
+    assert table.get_outputs(5) == set()
+
+    assert table.update([(1, 2)]) == []
+    assert table.version == version + 1
+
+    table.update([(1, 5), (3, 5)])
+    assert table.get_outputs(2) == set()
+    assert table.pop_dirty() == [1, 3]
+
+    # Only outputs that differ are changed when the length is the same
+    version = table.version
+    assert table.reset([0, 5, 0, 7]) == [3]
+    assert table.version == version + 1
+    assert table.pop_dirty() == [3]
+    assert table.reset([0, 5, 0, 7]) == []
+    assert table.version == version + 1
+
+    assert table.reset([1, 1]) is None
+    assert table.pop_dirty() == [0, 1]
+    assert table.get_outputs(1) == {0, 1}
+    assert table.get_outputs(5) == set()
+
+@pytest.mark.asyncio
+async def test_backend_routing_table():
+    from vidhubcontrol.backends import DummyBackend
+
+    vidhub = await DummyBackend.create_async()
+    table = vidhub.routing_table
+    assert list(table) == vidhub.crosspoints
+    version = table.version
+    table.pop_dirty()
+
+    await vidhub.set_crosspoints((0, 3), (1, 3), (2, 3))
+    assert table.version == version + 1
+    assert table.pop_dirty() == [0, 1, 2]
+    assert table.get_outputs(3) == {0, 1, 2} | {
+        i for i, v in enumerate(vidhub.crosspoints) if v == 3
+    }
+
+    vidhub.crosspoints[4] = 3
+    assert 4 in table.get_outputs(3)
+    assert list(table) == vidhub.crosspoints
+
+    vidhub.crosspoints[:2] = [5, 5]
+    assert list(table) == vidhub.crosspoints
+    assert table.get_outputs(5) >= {0, 1}
+
+    # Routing changes update the presets' active state through the table
+    preset = await vidhub.store_preset(outputs_to_store=[0, 1])
+    assert preset.active
+    vidhub.crosspoints[:2] = [6, 6]
+    assert not preset.active
+    assert vidhub.preset_index.get_mismatch_count(preset) == 2
+    vidhub.crosspoints[:] = [5, 5] + vidhub.crosspoints[2:]
+    assert preset.active
+
+    # The state copy is reused until the routes change
+    state = vidhub.get_state()
+    assert vidhub.get_state()['crosspoints'] is state['crosspoints']
+    await vidhub.set_crosspoint(0, 7)
+    assert vidhub.get_state()['crosspoints'] is not state['crosspoints']
+    assert vidhub.get_state()['crosspoints'] == vidhub.crosspoints
+
+@pytest.mark.asyncio
+async def test_stale_routes():
+    from vidhubcontrol.backends import DummyBackend
+
+    vidhub = await DummyBackend.create_async()
+    state = vidhub.get_state()
+    state['crosspoints'] = [1] * vidhub.num_outputs
+
+    backend = DummyBackend(auto_connect=False)
+    backend.load_cached_state(state)
+    assert backend.state_stale
+    assert list(backend.routing_table) == state['crosspoints']
+
+    # Routes reported by the device; output 2 changes and changes back
+    backend.crosspoints[0] = 4
+    backend.crosspoints[2] = 3
+    backend.crosspoints[2] = 1
+    backend.crosspoints[5] = 6
+    await backend.connect()
+    assert backend.prelude_parsed
+    assert not backend.state_stale
+    assert backend.stale_changes['crosspoints'] == {0, 5}
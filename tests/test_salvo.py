@@ -0,0 +1,106 @@
+import asyncio
+import time
+import pytest
+
+@pytest.mark.asyncio
+async def test_salvo_emulated(unused_tcp_port_factory):
+    from vidhubcontrol.emulator import VidhubEmulator
+    from vidhubcontrol.backends.telnet import TelnetBackend
+    from vidhubcontrol.salvo import Salvo
+
+    emulators = [
+        VidhubEmulator(ack_latency=.01),
+        VidhubEmulator(ack_latency=.1),
+    ]
+    backends = []
+    for emulator in emulators:
+        port = unused_tcp_port_factory()
+        await emulator.start('127.0.0.1', port)
+        backend = await TelnetBackend.create_async(
+            hostaddr='127.0.0.1', hostport=port,
+        )
+        assert backend.prelude_parsed
+        backends.append(backend)
+
+    fast, slow = backends
+
+    fast_preset = await fast.store_preset(outputs_to_store=[])
+    fast_preset.crosspoints.update({0:3, 1:4})
+    slow_preset = await slow.store_preset(outputs_to_store=[])
+    slow_preset.crosspoints.update({2:7})
+
+    salvo = Salvo.from_presets([fast_preset, slow_preset], name='take')
+    salvo.prepare()
+    assert fast.encode_crosspoints([(0, 3), (1, 4)]) == salvo.payloads[fast][0]
+    assert salvo.payloads[slow] is slow_preset.get_encoded_crosspoints()
+
+    result = await salvo.fire()
+
+    assert result.results == {fast:True, slow:True}
+    assert result.latencies[slow] > result.latencies[fast]
+    assert result.skew >= .05
+    assert emulators[0].crosspoints[:2] == [3, 4]
+    assert emulators[1].crosspoints[2] == 7
+    assert fast.crosspoints[:2] == [3, 4]
+    assert slow.crosspoints[2] == 7
+
+    # NAK from one device does not affect the others
+    emulators[1].nak_rate = 1.
+    salvo.add_crosspoints(fast, (0, 5))
+    salvo.add_crosspoints(slow, (2, 8))
+    result = await salvo.fire()
+    assert result.results == {fast:True, slow:False}
+    assert emulators[0].crosspoints[0] == 5
+    assert emulators[1].crosspoints[2] == 7
+
+    for backend in backends:
+        await backend.disconnect()
+    for emulator in emulators:
+        await emulator.stop()
+
+@pytest.mark.asyncio
+async def test_salvo_scheduled():
+    from vidhubcontrol.backends.dummy import DummyBackend
+    from vidhubcontrol.salvo import Salvo
+
+    backend1 = await DummyBackend.create_async(device_id='dummy1')
+    backend2 = await DummyBackend.create_async(device_id='dummy2')
+
+    salvo = Salvo()
+    result = await salvo.fire()
+    assert result.results == {}
+    assert result.skew == 0.
+
+    salvo.add_crosspoints(backend1, (0, 1), (1, 2))
+    salvo.add_crosspoints(backend2, (5, 6))
+    salvo.prepare()
+    assert salvo.payloads[backend1][0] is None
+
+    start = time.time()
+    result = await salvo.fire(when=start + .2)
+    assert time.time() - start >= .2
+    assert result.results == {backend1:True, backend2:True}
+    assert backend1.crosspoints[:2] == [1, 2]
+    assert backend2.crosspoints[5] == 6
+
+    # Times in the past are sent immediately
+    salvo.remove_device(backend2)
+    salvo.add_crosspoints(backend1, (0, 3))
+    start = time.time()
+    result = await salvo.fire(when=start - 1)
+    assert time.time() - start < .2
+    assert list(result.results.keys()) == [backend1]
+    assert backend1.crosspoints[:2] == [3, 2]
+
+    # Devices without an id (or with the same id) are reported separately
+    backend3 = await DummyBackend.create_async(device_id=None)
+    backend4 = await DummyBackend.create_async(device_id=None)
+    async def send_failed(*args):
+        raise ConnectionError()
+    backend4.send_encoded_crosspoints = send_failed
+    salvo = Salvo()
+    salvo.add_crosspoints(backend3, (0, 1))
+    salvo.add_crosspoints(backend4, (0, 1))
+    result = await salvo.fire()
+    assert result.results == {backend3:True, backend4:False}
+    assert result.latencies[backend4] is None
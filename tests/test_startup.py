@@ -0,0 +1,204 @@
+import asyncio
+import pytest
+
+from vidhubcontrol.backends import DummyBackend
+
+class SlowBackend(DummyBackend):
+    connect_delay = .1
+    active = 0
+    max_active = 0
+    async def do_connect(self):
+        cls = SlowBackend
+        cls.active += 1
+        cls.max_active = max(cls.max_active, cls.active)
+        try:
+            await asyncio.sleep(self.connect_delay)
+        finally:
+            cls.active -= 1
+        return await super().do_connect()
+    disconnect_delay = 0
+    async def do_disconnect(self):
+        cls = SlowBackend
+        cls.active += 1
+        cls.max_active = max(cls.max_active, cls.active)
+        try:
+            await asyncio.sleep(self.disconnect_delay)
+        finally:
+            cls.active -= 1
+    def do_abort(self):
+        self.aborted = True
+
+@pytest.mark.asyncio
+async def test_device_startup():
+    from vidhubcontrol.startup import DeviceStartup
+
+    backends = [
+        SlowBackend(device_id='slow{}'.format(i), auto_connect=False)
+        for i in range(10)
+    ]
+    hung = SlowBackend(device_id='hung', auto_connect=False)
+    hung.connect_delay = 10
+    backends.append(hung)
+    for backend in backends:
+        assert not backend.connected
+        assert not backend.connect_fut.done()
+
+    startup = DeviceStartup(max_concurrent=5, connect_timeout=.5)
+    ready_devices = []
+    def on_device_ready(result):
+        ready_devices.append(result.backend.device_id)
+    startup.bind(on_device_ready=on_device_ready)
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    results = await startup.start(backends)
+    elapsed = loop.time() - start
+
+    assert startup.ready_event.is_set()
+    assert startup.ready
+    assert SlowBackend.max_active <= 5
+    # Limited by the hung device's timeout rather than the sum of all delays
+    assert elapsed < 1.
+
+    assert set(ready_devices) == set(b.device_id for b in backends)
+    for backend in backends[:-1]:
+        result = results[backend]
+        assert result.ready
+        assert .1 <= result.elapsed < .5
+        assert backend.connected
+        assert backend.prelude_parsed
+        assert backend.connect_fut.done()
+        assert await backend.connect_fut is not False
+
+    result = results[hung]
+    assert not result.ready
+    assert result.elapsed >= .5
+    assert not hung.connected
+    assert await hung.connect_fut is False
+
+class FailingBackend(DummyBackend):
+    async def do_connect(self):
+        await asyncio.sleep(.05)
+        raise ConnectionRefusedError('refused')
+
+@pytest.mark.asyncio
+async def test_device_startup_errors():
+    from vidhubcontrol.startup import DeviceStartup
+
+    backends = [
+        DummyBackend(device_id='dummy{}'.format(i), auto_connect=False)
+        for i in range(4)
+    ]
+    failing = FailingBackend(device_id='failing', auto_connect=False)
+    backends.insert(0, failing)
+
+    startup = DeviceStartup(max_concurrent=2, connect_timeout=.5)
+    results = await asyncio.wait_for(startup.start(backends), 1)
+
+    # One device failing does not stop the others or the readiness event
+    assert startup.ready_event.is_set()
+    assert startup.ready
+    assert set(results.keys()) == set(backends)
+    assert not results[failing].ready
+    assert not failing.connected
+    for backend in backends[1:]:
+        assert results[backend].ready
+        assert backend.connected
+
+@pytest.mark.asyncio
+async def test_device_startup_retry(device_server):
+    from conftest import VIDHUB_PREAMBLE
+    from vidhubcontrol.backends.telnet import TelnetBackend
+    from vidhubcontrol.startup import DeviceStartup
+
+    # Stay silent for the first session so startup times out
+    def get_preamble():
+        if len(device_server.sessions) > 1:
+            return VIDHUB_PREAMBLE
+        return None
+    device_server.get_preamble = get_preamble
+    await device_server.start()
+
+    backend = TelnetBackend(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+        reconnect_delay=.05, auto_connect=False,
+    )
+    startup = DeviceStartup(connect_timeout=.2)
+    results = await startup.start([backend])
+    assert not results[backend].ready
+    assert not backend.connected
+
+    # The device is left reconnecting rather than disconnected
+    assert backend.reconnect_task is not None
+    await asyncio.wait_for(backend.reconnect_task, 2)
+    assert backend.connected and backend.prelude_parsed
+    assert len(device_server.sessions) == 2
+
+    await backend.disconnect()
+    await device_server.stop()
+
+@pytest.mark.asyncio
+async def test_device_shutdown():
+    from vidhubcontrol.startup import DeviceShutdown
+
+    SlowBackend.max_active = 0
+    backends = []
+    for i in range(10):
+        backend = await DummyBackend.create_async(device_id='dummy{}'.format(i))
+        backends.append(backend)
+    for i in range(10):
+        backend = SlowBackend(device_id='slow{}'.format(i), auto_connect=False)
+        backend.connect_delay = 0
+        backend.disconnect_delay = .1
+        await backend.connect()
+        backends.append(backend)
+    hung = SlowBackend(device_id='hung', auto_connect=False)
+    hung.connect_delay = 0
+    hung.disconnect_delay = 10
+    await hung.connect()
+    backends.append(hung)
+    for backend in backends:
+        assert backend.connected
+
+    shutdown = DeviceShutdown(max_concurrent=5, timeout=.5)
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    results = await shutdown.stop(backends)
+    elapsed = loop.time() - start
+
+    assert SlowBackend.max_active <= 5
+    assert .5 <= elapsed < 1.
+    for backend in backends:
+        assert not backend.connected
+    for backend in backends[:-1]:
+        result = results[backend]
+        assert result.clean
+        assert result.elapsed < .5
+        assert not getattr(backend, 'aborted', False)
+
+    result = results[hung]
+    assert not result.clean
+    assert result.elapsed >= .5
+    assert hung.aborted
+    assert hung.client is None
+
+@pytest.mark.asyncio
+async def test_config_startup(tempconfig, missing_netifaces):
+    from vidhubcontrol.config import Config
+
+    config = Config.load(str(tempconfig))
+    await config.start()
+    for i in range(4):
+        vidhub = await DummyBackend.create_async(device_id='dummy{}'.format(i))
+        config.add_vidhub(vidhub)
+    await config.wait_ready()
+    await config.stop()
+
+    config2 = Config.load(str(tempconfig), max_concurrent_connects=2)
+    await config2.start()
+    results = await config2.wait_ready()
+    assert len(results) == 4
+    for vidhub_conf in config2.vidhubs.values():
+        assert results[vidhub_conf.backend].ready
+        assert vidhub_conf.backend.prelude_parsed
+    await config2.stop()
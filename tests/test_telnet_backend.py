@@ -123,3 +123,554 @@ async def test_telnet_smartscope(smartview_backend):
     waiter.unbind()
 
     await backend.disconnect()
+
+@pytest.mark.asyncio
+async def test_telnet_vidhub_socket(device_server):
+    # Send the preamble in small pieces to exercise reassembly
+    device_server.chunk_size = 100
+    await device_server.start()
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+    )
+
+    assert backend.prelude_parsed
+    assert backend.device_id == 'A0B2C3D4E5F6'
+    assert backend.num_outputs == backend.num_inputs == 12
+    assert backend.crosspoints[1] == 9
+
+    await backend.set_crosspoints(*((i, 3) for i in range(backend.num_outputs)))
+    assert backend.crosspoints == [3] * backend.num_outputs
+    assert device_server.rx_commands[-1].startswith(b'VIDEO OUTPUT ROUTING:\n')
+
+    await backend.disconnect()
+    await device_server.stop()
+
+@pytest.mark.asyncio
+async def test_client_concurrent_drain(unused_tcp_port):
+    from vidhubcontrol.aioclient import Client
+
+    read_enabled = asyncio.Event()
+    rx_sizes = []
+    writers = []
+    async def handle_client(reader, writer):
+        writers.append(writer)
+        await read_enabled.wait()
+        size = 0
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            size += len(data)
+        rx_sizes.append(size)
+        writer.close()
+
+    server = await asyncio.start_server(handle_client, '127.0.0.1', unused_tcp_port)
+    chunk = b'x' * (4 * 1024 * 1024)
+
+    # All writes blocked while writing is paused are resumed together
+    client = Client('127.0.0.1', unused_tcp_port)
+    await client.open()
+    tasks = [asyncio.ensure_future(client.write(chunk)) for i in range(4)]
+    await asyncio.sleep(.2)
+    assert client.protocol._write_paused
+    assert not any(t.done() for t in tasks)
+    assert len(client.protocol._drain_waiters) == 4
+    read_enabled.set()
+    await asyncio.wait_for(asyncio.gather(*tasks), 10)
+    assert not len(client.protocol._drain_waiters)
+    await client.close_async()
+    await asyncio.sleep(.1)
+    assert rx_sizes == [len(chunk) * 4]
+
+    # And all fail if the connection is lost
+    read_enabled.clear()
+    client = Client('127.0.0.1', unused_tcp_port)
+    await client.open()
+    tasks = [asyncio.ensure_future(client.write(chunk)) for i in range(4)]
+    await asyncio.sleep(.2)
+    assert not any(t.done() for t in tasks)
+    client.abort()
+    results = await asyncio.wait_for(
+        asyncio.gather(*tasks, return_exceptions=True), 5,
+    )
+    assert all(isinstance(r, ConnectionError) for r in results)
+
+    read_enabled.set()
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_telnet_vidhub_batched_updates(mocked_vidhub_telnet_device):
+
+    backend = TelnetBackend(hostaddr=True)
+
+    emissions = {'crosspoints':[], 'output_labels':[], 'crosspoint_control':[]}
+    def on_prop_change(instance, value, **kwargs):
+        prop = kwargs['property']
+        emissions[prop.name].append(kwargs.get('keys'))
+    backend.bind(**{key:on_prop_change for key in emissions.keys()})
+
+    await backend.connect_fut
+    assert backend.prelude_parsed
+
+    # One emission when the list is sized, one for the parsed block
+    assert len(emissions['crosspoints']) == 2
+    assert emissions['crosspoints'][0] is None
+    assert set(emissions['crosspoints'][1]) == set(
+        (i for i, v in enumerate(backend.crosspoints) if v != 0)
+    )
+    assert len(emissions['output_labels']) == 2
+    assert set(emissions['output_labels'][1]) == set(range(backend.num_outputs))
+    assert backend.crosspoint_control == backend.crosspoints
+    assert backend.output_label_control == backend.output_labels
+
+    for key in emissions.keys():
+        emissions[key].clear()
+
+    xpts = [(i, 5) for i in range(6)]
+    await backend.set_crosspoints(*xpts)
+    assert backend.crosspoints[:6] == [5] * 6
+    assert len(emissions['crosspoints']) == 1
+    assert len(emissions['crosspoint_control']) == 1
+    assert backend.crosspoint_control == backend.crosspoints
+
+    await backend.disconnect()
+
+@pytest.mark.asyncio
+async def test_telnet_vidhub_pipelined(device_server):
+    num_commands = 8
+    rx_commands = []
+
+    async def on_command(writer, cmd):
+        rx_commands.append(cmd)
+        # Don't respond until all commands have been received
+        # (this would deadlock if commands were sent one at a time)
+        if len(rx_commands) < num_commands:
+            return
+        for i, cmd in enumerate(rx_commands):
+            if i == 2:
+                writer.write(b'NAK\n\n')
+            else:
+                writer.write(b'ACK\n\n' + cmd + b'\n\n')
+        rx_commands.clear()
+
+    device_server.on_command = on_command
+    await device_server.start()
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+    )
+    assert backend.prelude_parsed
+
+    tasks = [asyncio.ensure_future(backend.set_crosspoint(i, 7)) for i in range(num_commands)]
+    results = await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+    assert results == [i != 2 for i in range(num_commands)]
+    assert len(backend.command_queue) == 0
+    for i in range(num_commands):
+        if i == 2:
+            continue
+        assert backend.crosspoints[i] == 7
+
+    await backend.disconnect()
+    await device_server.stop()
+
+@pytest.mark.asyncio
+async def test_telnet_send_disconnected(device_server):
+    rx_commands = []
+
+    async def on_command(writer, cmd):
+        session = len(device_server.sessions)
+        rx_commands.append((session, cmd))
+        if session == 1:
+            # Drop the first connection without responding
+            await asyncio.sleep(.05)
+            writer.close()
+            return
+        writer.write(b'ACK\n\n' + cmd + b'\n\n')
+
+    device_server.on_command = on_command
+    await device_server.start()
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+        max_pending_commands=1, auto_reconnect=False,
+    )
+
+    # The second command is waiting for a slot when the connection drops
+    t1 = asyncio.ensure_future(backend.set_crosspoint(0, 1))
+    t2 = asyncio.ensure_future(backend.set_crosspoint(1, 2))
+    for t in [t1, t2]:
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(t, 1)
+    assert not backend.connected
+    assert len(backend.command_queue) == 0
+
+    # Sending while disconnected fails without connecting
+    with pytest.raises(ConnectionError):
+        await asyncio.wait_for(backend.set_crosspoint(2, 3), 1)
+    assert not backend.connected
+    assert len(device_server.sessions) == 1
+
+    # Only commands sent after reconnecting are written to the new connection
+    await backend.connect()
+    assert await asyncio.wait_for(backend.set_crosspoint(2, 3), 1)
+    assert backend.crosspoints[2] == 3
+    assert len(backend.command_queue) == 0
+    assert [cmd for session, cmd in rx_commands if session == 2] == [
+        b'VIDEO OUTPUT ROUTING:\n2 3',
+    ]
+
+    await backend.disconnect()
+    await device_server.stop()
+
+@pytest.mark.asyncio
+async def test_telnet_command_timeout(device_server):
+    from vidhubcontrol.backends.commands import CommandTimeoutError
+
+    async def on_command(writer, cmd):
+        if len(device_server.rx_commands) == 1:
+            # Respond to the first command after its deadline
+            await asyncio.sleep(.3)
+        writer.write(b'ACK\n\n' + cmd + b'\n\n')
+
+    device_server.on_command = on_command
+    await device_server.start()
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+        max_pending_commands=1,
+        command_timeouts={'crosspoints':.1},
+    )
+    assert backend.get_command_timeout('crosspoints') == .1
+    assert backend.get_command_timeout('output_labels') == backend.COMMAND_TIMEOUTS['default']
+
+    with pytest.raises(CommandTimeoutError):
+        await backend.set_crosspoint(0, 1)
+
+    # The send slot is released after the timeout and the late ACK
+    # is matched to the expired command
+    assert backend.command_queue.num_expired == 1
+    assert not backend.command_queue.semaphore.locked()
+    await asyncio.sleep(.3)
+    assert len(backend.command_queue) == 0
+    assert await backend.set_crosspoint(0, 2)
+    assert backend.crosspoints[0] == 2
+    assert len(backend.command_queue) == 0
+
+    await backend.disconnect()
+    await device_server.stop()
+
+@pytest.mark.asyncio
+async def test_telnet_command_no_response(device_server):
+    from vidhubcontrol.backends.commands import CommandTimeoutError
+
+    async def on_command(writer, cmd):
+        if len(device_server.rx_commands) == 1:
+            # Never answer the first command
+            return
+        writer.write(b'ACK\n\n' + cmd + b'\n\n')
+
+    device_server.on_command = on_command
+    await device_server.start()
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+        max_pending_commands=1, reconnect_delay=.05,
+        command_timeouts={'crosspoints':.1},
+    )
+
+    with pytest.raises(CommandTimeoutError):
+        await backend.set_crosspoint(0, 1)
+    assert backend.command_queue.num_expired == 1
+
+    # The ACK for the next command can't be told apart from a late one for
+    # the expired command, so the connection is dropped rather than
+    # matching every later response to the wrong command
+    with pytest.raises(ConnectionError):
+        await backend.set_crosspoint(0, 2)
+    assert len(backend.command_queue) == 0
+    assert backend.reconnect_task is not None
+    await asyncio.wait_for(backend.reconnect_task, 2)
+    assert backend.connected and backend.prelude_parsed
+    assert len(device_server.sessions) == 2
+
+    for i in range(3, 6):
+        assert await backend.set_crosspoint(0, i)
+        assert backend.crosspoints[0] == i
+        assert len(backend.command_queue) == 0
+
+    await backend.disconnect()
+    await device_server.stop()
+
+@pytest.mark.asyncio
+async def test_timer_wheel():
+    from vidhubcontrol.backends.commands import TimerWheel
+
+    loop = asyncio.get_event_loop()
+    wheel = TimerWheel.get(loop)
+    assert TimerWheel.get(loop) is wheel
+
+    fired = []
+    start = loop.time()
+    entries = [wheel.schedule(.1, fired.append, i) for i in range(100)]
+    wheel.schedule(.2, fired.append, 'later')
+    wheel.cancel(entries[0])
+
+    await asyncio.sleep(.15)
+    assert fired == list(range(1, 100))
+    await asyncio.sleep(.15)
+    assert fired[-1] == 'later'
+    assert not len(wheel.buckets)
+
+@pytest.mark.asyncio
+async def test_telnet_reconnect(device_server):
+    from conftest import VIDHUB_PREAMBLE
+
+    await device_server.start()
+    sessions = device_server.sessions
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+        reconnect_delay=.05,
+    )
+    assert backend.connected and backend.prelude_parsed
+    assert backend.crosspoints[0] == 0
+    prev_labels = backend.output_labels[:]
+
+    emitted = {'crosspoints':[], 'output_labels':[], 'input_labels':[]}
+    def on_prop(name):
+        def handler(instance, value, **kwargs):
+            emitted[name].append(kwargs.get('keys'))
+        return handler
+    handlers = {name:on_prop(name) for name in emitted.keys()}
+    backend.bind(**handlers)
+
+    # Drop the connection from the device side after changing a route
+    device_server.preamble = VIDHUB_PREAMBLE.replace(
+        b'VIDEO OUTPUT ROUTING:\n0 0\n', b'VIDEO OUTPUT ROUTING:\n0 5\n',
+    )
+    sessions[0].close()
+    while backend.connected:
+        await asyncio.sleep(.01)
+    assert backend.reconnect_task is not None
+
+    while not (backend.connected and backend.prelude_parsed):
+        await asyncio.sleep(.01)
+    assert len(sessions) == 2
+    t = backend.reconnect_task
+    if t is not None:
+        await asyncio.wait_for(t, 1)
+    assert backend.reconnect_task is None
+
+    # Only the route that changed while offline is emitted
+    assert backend.crosspoints[0] == 5
+    assert emitted['crosspoints'] == [[0]]
+    assert emitted['output_labels'] == []
+    assert emitted['input_labels'] == []
+    assert backend.output_labels == prev_labels
+
+    # A requested disconnect does not reconnect
+    await backend.disconnect()
+    await asyncio.sleep(.2)
+    assert not backend.connected
+    assert len(sessions) == 2
+
+    await device_server.stop()
+
+@pytest.mark.asyncio
+async def test_telnet_reconnect_offline(unused_tcp_port):
+    from conftest import VIDHUB_PREAMBLE
+    from vidhubcontrol.emulator import VidhubEmulator
+
+    # Nothing is listening yet
+    backend = TelnetBackend(
+        hostaddr='127.0.0.1', hostport=unused_tcp_port,
+        reconnect_delay=.05, reconnect_max_delay=.1,
+        auto_connect=False,
+    )
+    assert await backend.connect() is False
+    assert not backend.connected
+    assert backend.reconnect_task is not None
+
+    emulator = VidhubEmulator(preamble=VIDHUB_PREAMBLE)
+    await emulator.start('127.0.0.1', unused_tcp_port)
+
+    await asyncio.wait_for(backend.reconnect_task, 2)
+    assert backend.connected and backend.prelude_parsed
+    assert backend.reconnect_task is None
+
+    await backend.disconnect()
+    await emulator.stop()
+
+@pytest.mark.asyncio
+async def test_reconnect_backoff():
+    from vidhubcontrol.backends.reconnect import Backoff
+
+    backoff = Backoff(initial=1., maximum=8., jitter=0)
+    assert [backoff.next_delay() for i in range(6)] == [1., 2., 4., 8., 8., 8.]
+    backoff.reset()
+    assert backoff.next_delay() == 1.
+
+    backoff = Backoff(initial=1., maximum=8., jitter=.2)
+    for i in range(100):
+        backoff.reset()
+        assert .8 <= backoff.next_delay() <= 1.2
+
+@pytest.mark.asyncio
+async def test_telnet_keepalive(device_server):
+    rx_pings = []
+    respond = asyncio.Event()
+    respond.set()
+
+    async def on_command(writer, cmd):
+        if cmd == b'PING:':
+            rx_pings.append(cmd)
+            if not respond.is_set():
+                return
+        writer.write(b'ACK\n\n')
+
+    device_server.on_command = on_command
+    await device_server.start()
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=device_server.port,
+        keepalive_interval=.05, keepalive_max_misses=2,
+        command_timeouts={'ping':.1},
+        auto_reconnect=False,
+    )
+    assert backend.rtt_p50 is None
+
+    while len(rx_pings) < 5:
+        await asyncio.sleep(.01)
+    assert backend.rtt_histogram.count >= 4
+    assert 0 < backend.rtt_p50 <= backend.rtt_p95 <= backend.rtt_p99 < .1
+    assert backend.connected
+
+    # Stop answering pings and wait for the device to be declared unreachable
+    respond.clear()
+    num_pings = len(rx_pings)
+    while backend.connected:
+        await asyncio.sleep(.01)
+    assert len(rx_pings) - num_pings == 2
+    assert backend.keepalive_misses == 2
+    assert backend.keepalive_task is None
+
+    await backend.disconnect()
+    await device_server.stop()
+
+def test_histogram():
+    from vidhubcontrol.backends.histogram import Histogram
+
+    h = Histogram()
+    assert h.percentile(50) is None
+    for i in range(1, 1001):
+        h.add(i / 1000.)
+    assert h.count == 1000
+    for p in [50, 95, 99]:
+        assert h.percentile(p) == pytest.approx(p / 100., rel=.05)
+    assert h.percentile(100) == 1.
+    assert h.percentile(0) == .001
+    assert len(h.counts) < 200
+
+@pytest.mark.asyncio
+async def test_telnet_trace_replay(tmpdir, unused_tcp_port):
+    from conftest import VIDHUB_PREAMBLE
+    from vidhubcontrol.emulator import VidhubEmulator
+    from vidhubcontrol.backends.trace import (
+        read_trace, split_sessions, ReplayClient, RX, TX, OPEN,
+    )
+
+    emulator = VidhubEmulator(preamble=VIDHUB_PREAMBLE, ack_latency=.05)
+    await emulator.start('127.0.0.1', unused_tcp_port)
+
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=unused_tcp_port,
+        trace_filename=str(tmpdir.join('session-{hostport}.trace')),
+    )
+    trace_filename = str(tmpdir.join('session-{}.trace'.format(unused_tcp_port)))
+    assert backend.recorder.filename == trace_filename
+    assert await backend.set_crosspoints((0, 5), (1, 6))
+    assert await backend.set_output_label(2, 'Foo')
+    await asyncio.sleep(.1)
+    recorded_xpts = backend.crosspoints[:]
+    recorded_labels = backend.output_labels[:]
+    await backend.disconnect()
+    # Closed on disconnect
+    assert backend.recorder is None
+    await emulator.stop()
+
+    start_time, frames = read_trace(trace_filename)
+    assert frames[0][1] == OPEN
+    rx_data = b''.join(data for t, direction, data in frames if direction == RX)
+    tx_data = [data for t, direction, data in frames if direction == TX]
+    assert rx_data.startswith(VIDHUB_PREAMBLE.rstrip())
+    assert len(tx_data) == 2
+    sessions = split_sessions(frames)
+    assert len(sessions) == 1
+    timestamps = [t for t, direction, data in sessions[0]]
+    assert timestamps == sorted(timestamps)
+    duration = timestamps[-1]
+    assert duration >= .1
+
+    for speed in [None, 1.]:
+        factory = ReplayClient.factory(trace_filename, speed=speed)
+        replay = await TelnetBackend.create_async(
+            hostaddr='127.0.0.1', hostport=unused_tcp_port,
+            client_factory=factory,
+        )
+        assert replay.prelude_parsed
+        client = factory.clients[0]
+        await asyncio.wait_for(client.play_task, 5)
+        await asyncio.sleep(0)
+        assert replay.crosspoints == recorded_xpts
+        assert replay.output_labels == recorded_labels
+        await replay.disconnect()
+
+    # Closed on abort (as in shutdown timeouts and failed probes)
+    factory = ReplayClient.factory(trace_filename, speed=None)
+    backend = await TelnetBackend.create_async(
+        hostaddr='127.0.0.1', hostport=unused_tcp_port,
+        client_factory=factory, trace_filename=str(tmpdir.join('aborted.trace')),
+    )
+    recorder = backend.recorder
+    backend.abort()
+    assert backend.recorder is None
+    assert recorder.fp is None
+    start_time, frames = read_trace(str(tmpdir.join('aborted.trace')))
+    assert frames[0][1] == OPEN
+
+@pytest.mark.asyncio
+async def test_telnet_trace_buffer(mocked_vidhub_telnet_device):
+    from vidhubcontrol.backends.trace import TraceBuffer
+
+    backend = await TelnetBackend.create_async(hostaddr=True)
+    assert backend.trace_buffer is None
+    assert backend.dump_trace() == []
+
+    backend.enable_trace(4)
+    assert await backend.set_crosspoint(0, 1)
+    lines = backend.dump_trace()
+    assert len(lines) == 2
+    assert lines[0].split(' ')[1] == 'tx'
+    assert "b'VIDEO OUTPUT ROUTING:\\n0 1\\n\\n'" in lines[0]
+    assert lines[1].split(' ')[1] == 'rx'
+
+    for i in range(4):
+        assert await backend.set_crosspoint(0, i)
+    assert len(backend.trace_buffer) == 4
+    assert "0 3" in backend.dump_trace()[-2]
+
+    backend.disable_trace()
+    assert await backend.set_crosspoint(0, 5)
+    assert backend.dump_trace() == []
+
+    await backend.disconnect()
+    backend = await TelnetBackend.create_async(
+        hostaddr=True, trace_buffer_size=8,
+    )
+    lines = backend.dump_trace()
+    assert lines[0].split(' ')[1] == 'open'
+    assert lines[1].split(' ')[1] == 'rx'
+    await backend.disconnect()
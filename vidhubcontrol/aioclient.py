@@ -0,0 +1,131 @@
+import asyncio
+import collections
+
+class ClientProtocol(asyncio.Protocol):
+    '''Raw TCP protocol that buffers whole received chunks for :class:`Client`
+    '''
+    def __init__(self, loop):
+        self.loop = loop
+        self.transport = None
+        self.rx_chunks = []
+        self.eof = False
+        self.read_ready_event = asyncio.Event()
+        self.closed = asyncio.Event()
+        self._write_paused = False
+        self._drain_waiters = collections.deque()
+    def connection_made(self, transport):
+        self.transport = transport
+    def data_received(self, data):
+        self.rx_chunks.append(data)
+        self.read_ready_event.set()
+    def eof_received(self):
+        self.eof = True
+        self.read_ready_event.set()
+    def connection_lost(self, exc):
+        self.eof = True
+        self.transport = None
+        self.read_ready_event.set()
+        self.closed.set()
+        if exc is None:
+            exc = ConnectionResetError('Connection lost')
+        self._wake_drain_waiters(exc)
+    def pause_writing(self):
+        self._write_paused = True
+    def resume_writing(self):
+        self._write_paused = False
+        self._wake_drain_waiters()
+    def _wake_drain_waiters(self, exc=None):
+        # Every write waiting in drain() is woken, not only the last one
+        waiters = self._drain_waiters
+        while len(waiters):
+            waiter = waiters.popleft()
+            if waiter.done():
+                continue
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+    async def drain(self):
+        if self.transport is None:
+            raise ConnectionResetError('Connection lost')
+        if not self._write_paused:
+            return
+        waiter = self.loop.create_future()
+        self._drain_waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            try:
+                self._drain_waiters.remove(waiter)
+            except ValueError:
+                pass
+
+class Client(object):
+    '''Asyncio TCP client used by the telnet backends
+
+    Received data is handed over in whole chunks as it arrives from the
+    transport (no per-byte processing or fixed-size reads).
+    '''
+    def __init__(self, host=None, port=0, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.transport = None
+        self.protocol = None
+    @property
+    def eof(self):
+        if self.protocol is None:
+            return True
+        return self.protocol.eof and not len(self.protocol.rx_chunks)
+    async def open(self, host=None, port=None):
+        if host is not None:
+            self.host = host
+        if port is not None:
+            self.port = port
+        self.transport, self.protocol = await self.loop.create_connection(
+            lambda: ClientProtocol(self.loop), self.host, self.port,
+        )
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        if self.protocol is not None:
+            self.protocol.read_ready_event.set()
+        self.transport = None
+    def abort(self):
+        if self.transport is not None:
+            self.transport.abort()
+        self.close()
+    async def close_async(self):
+        protocol = self.protocol
+        self.close()
+        if protocol is not None:
+            await protocol.closed.wait()
+    async def write(self, bfr):
+        if self.transport is None:
+            raise ConnectionResetError('Connection closed')
+        self.transport.write(bfr)
+        await self.protocol.drain()
+    async def wait_for_data(self):
+        await self.protocol.read_ready_event.wait()
+    def read_nowait(self):
+        '''Return all data received since the last call (without waiting)
+        '''
+        protocol = self.protocol
+        chunks = protocol.rx_chunks
+        if len(chunks) == 1:
+            bfr = chunks[0]
+        else:
+            bfr = b''.join(chunks)
+        protocol.rx_chunks = []
+        if not protocol.eof:
+            protocol.read_ready_event.clear()
+        return bfr
+
+async def open_connection(host, port, loop=None):
+    '''Create a :class:`Client` and connect it to the given address
+    '''
+    c = Client(host, port, loop)
+    await c.open()
+    return c
@@ -1,8 +1,27 @@
 import asyncio
+import collections
+import logging
 
 from pydispatch import Dispatcher, Property
 from pydispatch.properties import ListProperty, DictProperty
 
+from .coalesce import WriteCoalescer
+from .routing import RoutingTable
+from .commands import CommandTimeoutError
+
+logger = logging.getLogger(__name__)
+
+def get_index_keys(kwargs):
+    '''Get the changed indices from the ``keys`` argument of a list property
+    event
+
+    Returns ``None`` if the change was not to individual items
+    (such as slice assignment)
+    '''
+    keys = kwargs.get('keys')
+    if keys is None or isinstance(keys[0], slice):
+        return None
+    return keys
 
 class BackendBase(Dispatcher):
     device_name = Property()
@@ -26,14 +45,26 @@ class BackendBase(Dispatcher):
         if not obj.connected or not obj.prelude_parsed:
             return None
         return obj
+    def _init_connect(self, **kwargs):
+        if kwargs.get('auto_connect', True):
+            self.connect_fut = asyncio.ensure_future(self.connect(), loop=self.event_loop)
+        else:
+            # Resolved by the first call to connect()
+            self.connect_fut = self.event_loop.create_future()
     async def connect(self):
         if self.connected:
             return self.client
         self.connected = True
-        r = await self.do_connect()
-        if r is False:
-            self.connected = False
-        else:
+        r = False
+        try:
+            r = await self.do_connect()
+        finally:
+            fut = getattr(self, 'connect_fut', None)
+            if fut is not None and not isinstance(fut, asyncio.Task) and not fut.done():
+                fut.set_result(r)
+            if r is False:
+                self.connected = False
+        if r is not False:
             if self.client is not None:
                 self.client = r
         return r
@@ -43,10 +74,20 @@ class BackendBase(Dispatcher):
         await self.do_disconnect()
         self.client = None
         self.connected = False
+    def abort(self):
+        '''Close the connection immediately without waiting for the device
+
+        Used when :meth:`disconnect` does not finish in time
+        '''
+        self.do_abort()
+        self.client = None
+        self.connected = False
     async def do_connect(self):
         raise NotImplementedError()
     async def do_disconnect(self):
         raise NotImplementedError()
+    def do_abort(self):
+        pass
     async def get_status(self):
         raise NotImplementedError()
     def on_device_id(self, instance, value, **kwargs):
@@ -66,15 +107,31 @@ class VidhubBackendBase(BackendBase):
     presets = ListProperty()
     num_outputs = Property(0)
     num_inputs = Property(0)
+    state_stale = Property(False)
     device_type = 'vidhub'
     feedback_prop_map = {
         'crosspoints':'crosspoint_control',
         'input_labels':'input_label_control',
         'output_labels':'output_label_control',
     }
-    _events_ = ['on_preset_added', 'on_preset_stored', 'on_preset_active']
+    _events_ = [
+        'on_preset_added', 'on_preset_stored', 'on_preset_active',
+        'on_presets_loaded',
+    ]
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.coalesce_window = kwargs.get('coalesce_window')
+        self._coalescers = {}
+        if self.coalesce_window is not None:
+            for name in ['crosspoints', 'output_labels', 'input_labels']:
+                coro = getattr(self, 'do_set_{}'.format(name))
+                self._coalescers[name] = WriteCoalescer(
+                    coro, self.coalesce_window, loop=self.event_loop,
+                )
+        self.routing_table = RoutingTable(self.crosspoints)
+        self._state_routes = None
+        self.preset_index = PresetIndex(self)
+        self.bind(crosspoints=self._update_routing_table)
         self.bind(
             num_outputs=self.on_num_outputs,
             num_inputs=self.on_num_inputs,
@@ -85,7 +142,55 @@ class VidhubBackendBase(BackendBase):
             input_label_control=self.on_prop_control,
             crosspoint_control=self.on_prop_control,
         )
-        presets = kwargs.get('presets', [])
+        self.stale_changes = {}
+        self.bind(prelude_parsed=self._on_prelude_parsed_stale)
+        self.preset_loader = kwargs.get('preset_loader')
+        self.bind(prelude_parsed=self._on_prelude_parsed_load_presets)
+        self._add_presets(kwargs.get('presets', []))
+        self._init_connect(**kwargs)
+    async def set_crosspoint(self, out_idx, in_idx):
+        return await self.set_crosspoints((out_idx, in_idx))
+    async def set_crosspoints(self, *args):
+        return await self._set_items('crosspoints', args)
+    async def set_output_label(self, out_idx, label):
+        return await self.set_output_labels((out_idx, label))
+    async def set_output_labels(self, *args):
+        return await self._set_items('output_labels', args)
+    async def set_input_label(self, in_idx, label):
+        return await self.set_input_labels((in_idx, label))
+    async def set_input_labels(self, *args):
+        return await self._set_items('input_labels', args)
+    async def do_set_crosspoints(self, *args):
+        raise NotImplementedError()
+    def encode_crosspoints(self, items):
+        '''Encode crosspoint changes ahead of time for
+        :meth:`send_encoded_crosspoints`
+
+        Args:
+            items: A sequence of ``(out_idx, in_idx)`` pairs
+
+        Returns ``None`` for backends with no wire protocol
+        '''
+        return None
+    async def send_encoded_crosspoints(self, data, items):
+        '''Send crosspoint changes encoded by :meth:`encode_crosspoints`
+
+        Bypasses write coalescing. ``items`` must be the pairs that ``data``
+        was encoded from
+        '''
+        return await self.do_set_crosspoints(*items)
+    async def do_set_output_labels(self, *args):
+        raise NotImplementedError()
+    async def do_set_input_labels(self, *args):
+        raise NotImplementedError()
+    async def _set_items(self, name, args):
+        coalescer = self._coalescers.get(name)
+        if coalescer is None:
+            coro = getattr(self, 'do_set_{}'.format(name))
+            return await coro(*args)
+        return await asyncio.shield(coalescer.submit(args))
+    def _add_presets(self, presets):
+        added = []
         for pst_data in presets:
             pst_data['backend'] = self
             preset = Preset(**pst_data)
@@ -94,20 +199,27 @@ class VidhubBackendBase(BackendBase):
                 on_preset_stored=self.on_preset_stored,
                 active=self.on_preset_active,
             )
-        self.connect_fut = asyncio.ensure_future(self.connect(), loop=self.event_loop)
-    async def set_crosspoint(self, out_idx, in_idx):
-        raise NotImplementedError()
-    async def set_crosspoints(self, *args):
-        raise NotImplementedError()
-    async def set_output_label(self, out_idx, label):
-        raise NotImplementedError()
-    async def set_output_labels(self, *args):
-        raise NotImplementedError()
-    async def set_input_label(self, in_idx, label):
-        raise NotImplementedError()
-    async def set_input_labels(self, *args):
-        raise NotImplementedError()
+            added.append(preset)
+        return added
+    def load_presets(self):
+        '''Create the presets given by the ``preset_loader`` keyword argument
+
+        ``preset_loader`` is a callable returning a list of preset data (in the
+        form of the ``presets`` argument). It is called once, either when the
+        device prelude is parsed or when presets are first added or searched
+        for, so presets are not read for devices that are never used.
+        '''
+        loader = self.preset_loader
+        if loader is None:
+            return
+        self.preset_loader = None
+        presets = self._add_presets(loader())
+        self.emit('on_presets_loaded', backend=self, presets=presets)
+    def _on_prelude_parsed_load_presets(self, instance, value, **kwargs):
+        if value:
+            self.load_presets()
     async def add_preset(self, name=None):
+        self.load_presets()
         index = len(self.presets)
         preset = Preset(backend=self, name=name, index=index)
         self.presets.append(preset)
@@ -118,6 +230,7 @@ class VidhubBackendBase(BackendBase):
         self.emit('on_preset_added', backend=self, preset=preset)
         return preset
     async def store_preset(self, outputs_to_store=None, name=None, index=None, clear_current=True):
+        self.load_presets()
         if index is None:
             preset = await self.add_preset()
         else:
@@ -150,20 +263,130 @@ class VidhubBackendBase(BackendBase):
         if value != len(self.crosspoints):
             self.crosspoints = [0] * value
         self.input_labels = [''] * value
+    def get_state(self):
+        '''Get the current routing, labels and device info for
+        :meth:`load_cached_state`
+        '''
+        return dict(
+            device_model=self.device_model,
+            device_version=self.device_version,
+            num_outputs=self.num_outputs,
+            num_inputs=self.num_inputs,
+            crosspoints=self._get_state_routes(),
+            output_labels=self.output_labels[:],
+            input_labels=self.input_labels[:],
+        )
+    def _get_state_routes(self):
+        # Reuse the copied routes until the routing table changes
+        version = self.routing_table.version
+        if self._state_routes is None or self._state_routes[0] != version:
+            self._state_routes = (version, self.crosspoints[:])
+        return self._state_routes[1]
+    def load_cached_state(self, state):
+        '''Apply state saved by :meth:`get_state` (before connecting)
+
+        The state is marked as stale (:attr:`state_stale`) until the device
+        prelude is parsed. The cached values are then compared with the live
+        ones, and the indices that differed are stored in
+        :attr:`stale_changes` by property name
+        '''
+        if self.prelude_parsed:
+            return
+        self.state_stale = False
+        for key in ['device_model', 'device_version']:
+            if state.get(key) is not None:
+                setattr(self, key, state[key])
+        self.num_outputs = state['num_outputs']
+        self.num_inputs = state['num_inputs']
+        for key in ['crosspoints', 'output_labels', 'input_labels']:
+            value = state[key]
+            if len(value) == len(getattr(self, key)):
+                self.update_list_property(key, enumerate(value))
+        self.stale_changes = {}
+        self._cached_state = state
+        # Routes changed from here on are compared with the cached ones
+        self.routing_table.pop_dirty()
+        self.state_stale = True
+    def _on_prelude_parsed_stale(self, instance, value, **kwargs):
+        if not value or not self.state_stale:
+            return
+        state = self._cached_state
+        self._cached_state = None
+        changes = {}
+        for key in ['crosspoints', 'output_labels', 'input_labels']:
+            cached = state[key]
+            current = getattr(self, key)
+            if len(cached) != len(current):
+                changed = set(range(len(current)))
+            elif key == 'crosspoints':
+                # Only outputs routed since the cached state was loaded
+                changed = set(
+                    i for i in self.routing_table.pop_dirty() if cached[i] != current[i]
+                )
+            else:
+                changed = set(i for i, v in enumerate(current) if cached[i] != v)
+            if len(changed):
+                changes[key] = changed
+        self.stale_changes = changes
+        self.state_stale = False
+    def update_list_property(self, name, items):
+        '''Apply multiple changes to a list property with a single emission
+
+        Args:
+            name (str): The name of the :class:`ListProperty`
+            items: An iterable of ``(index, value)`` pairs
+
+        Only the indices whose values actually changed are stored. Listeners
+        receive them (in order of first change) in the ``keys`` keyword
+        argument. Nothing is emitted if no values changed.
+
+        Returns:
+            list: The changed indices
+        '''
+        values = getattr(self, name)
+        keys = []
+        changed = set()
+        setitem = list.__setitem__
+        for i, value in items:
+            if values[i] == value:
+                continue
+            setitem(values, i, value)
+            if i not in changed:
+                changed.add(i)
+                keys.append(i)
+        if not len(keys):
+            return keys
+        prop = getattr(self.__class__, name)
+        if self.emission_lock(name).held:
+            # Only the last held event is dispatched, so send it as a full update
+            self.emit(name, self, values, property=prop, old=None)
+        else:
+            self.emit(name, self, values, property=prop, old=None, keys=keys)
+        return keys
+    def _update_routing_table(self, instance, value, **kwargs):
+        keys = get_index_keys(kwargs)
+        if keys is None or len(self.routing_table) != len(value):
+            changed = self.routing_table.reset(value)
+        else:
+            changed = self.routing_table.update((i, value[i]) for i in keys)
+        self.preset_index.on_routes_changed(changed)
     def on_prop_feedback(self, instance, value, **kwargs):
         prop = kwargs.get('property')
         if prop.name not in self.feedback_prop_map:
             return
-        elock = self.emission_lock(prop.name)
         control_prop = self.feedback_prop_map[prop.name]
-        setattr(self, control_prop, value[:])
+        keys = get_index_keys(kwargs)
+        if keys is None or len(getattr(self, control_prop)) != len(value):
+            setattr(self, control_prop, value[:])
+        else:
+            self.update_list_property(control_prop, ((i, value[i]) for i in keys))
     def on_prop_control(self, instance, value, **kwargs):
         if not self.connected:
             return
         if not self.prelude_parsed:
             return
         prop = kwargs.get('property')
-        keys = kwargs.get('keys')
+        keys = get_index_keys(kwargs)
         if keys is None:
             keys = range(len(value))
         feedback_prop = '{}s'.format(prop.name.split('_control')[0])
@@ -187,7 +410,7 @@ class SmartViewBackendBase(BackendBase):
     def __init__(self, **kwargs):
         self.bind(monitors=self._on_monitors)
         super().__init__(**kwargs)
-        self.connect_fut = asyncio.ensure_future(self.connect(), loop=self.event_loop)
+        self._init_connect(**kwargs)
     async def set_monitor_property(self, monitor, name, value):
         raise NotImplementedError()
     def get_monitor_cls(self):
@@ -335,6 +558,7 @@ class SmartScopeMonitor(SmartViewMonitor):
             'scope_mode',
         ]
 
+PresetRecallResult = collections.namedtuple('PresetRecallResult', ['num_changed', 'latency'])
 
 class Preset(Dispatcher):
     name = Property()
@@ -350,47 +574,161 @@ class Preset(Dispatcher):
             name = 'Preset {}'.format(self.index + 1)
         self.name = name
         self.crosspoints = kwargs.get('crosspoints', {})
-        if self.backend.connected and self.backend.prelude_parsed:
-            self.check_active()
-        else:
-            self.backend.bind(prelude_parsed=self.on_backend_ready)
-        self.backend.bind(crosspoints=self.on_backend_crosspoints)
+        self._encoded_crosspoints = None
+        self.backend.preset_index.add_preset(self)
         self.bind(crosspoints=self.on_preset_crosspoints)
     async def store(self, outputs_to_store=None, clear_current=True):
         if outputs_to_store is None:
             outputs_to_store = range(self.backend.num_outputs)
         if clear_current:
             self.crosspoints = {}
-        async with self.emission_lock('crosspoints'):
-            for out_idx in outputs_to_store:
-                self.crosspoints[out_idx] = self.backend.crosspoints[out_idx]
-            self.active = True
+        # The emission lock stays held unless an event is emitted within it
+        outputs_to_store = list(outputs_to_store)
+        if len(outputs_to_store):
+            async with self.emission_lock('crosspoints'):
+                for out_idx in outputs_to_store:
+                    self.crosspoints[out_idx] = self.backend.crosspoints[out_idx]
+                self.active = True
         self.emit('on_preset_stored', preset=self)
-    async def recall(self):
-        if not len(self.crosspoints):
-            return
-        args = [(i, v) for i, v in self.crosspoints.items()]
-        await self.backend.set_crosspoints(*args)
+    async def recall(self, force=False):
+        '''Route the stored crosspoints on the backend
+
+        Only outputs not currently routed as stored are sent unless ``force``
+        is ``True``. When all of them are sent, the cached command from
+        :meth:`get_encoded_crosspoints` is used.
+
+        Returns:
+            A :class:`PresetRecallResult` with the number of routes changed
+            (zero if the device rejected the command, did not respond or is
+            not connected) and the time in seconds taken to send them and
+            receive the response
+        '''
+        table = self.backend.routing_table
+        num_outputs = len(table)
+        args = [
+            (out_idx, in_idx) for out_idx, in_idx in self.crosspoints.items()
+            if force or out_idx >= num_outputs or table[out_idx] != in_idx
+        ]
+        if not len(args):
+            return PresetRecallResult(0, 0.)
+        loop = self.backend.event_loop
+        start = loop.time()
+        data = None
+        if len(args) == len(self.crosspoints):
+            data, items = self.get_encoded_crosspoints()
+        try:
+            if data is not None:
+                r = await self.backend.send_encoded_crosspoints(data, items)
+            else:
+                r = await self.backend.set_crosspoints(*args)
+        except (CommandTimeoutError, ConnectionError) as exc:
+            logger.warning('Recall of {} failed: {!r}'.format(self.name, exc))
+            r = False
+        latency = loop.time() - start
+        if r is False:
+            return PresetRecallResult(0, latency)
+        return PresetRecallResult(len(args), latency)
+    def get_encoded_crosspoints(self):
+        '''Get the stored crosspoints encoded by the backend's
+        :meth:`~VidhubBackendBase.encode_crosspoints`
+
+        The result is cached until :attr:`crosspoints` changes.
+
+        Returns:
+            A tuple of ``(data, items)``
+        '''
+        if self._encoded_crosspoints is None:
+            items = sorted(self.crosspoints.items())
+            data = self.backend.encode_crosspoints(items)
+            self._encoded_crosspoints = (data, items)
+        return self._encoded_crosspoints
     def check_active(self):
-        if not len(self.crosspoints):
-            self.active = False
-            return
-        for out_idx, in_idx in self.crosspoints.items():
-            in_idx = self.crosspoints[out_idx]
-            if self.backend.crosspoints[out_idx] != in_idx:
-                self.active = False
-                return
-        self.active = True
-    def on_backend_ready(self, instance, value, **kwargs):
-        if not value:
-            return
-        self.backend.unbind(self.on_backend_ready)
+        self.backend.preset_index.update_preset(self)
+    def on_preset_crosspoints(self, instance, value, **kwargs):
+        self._encoded_crosspoints = None
         self.check_active()
-    def on_backend_crosspoints(self, instance, value, **kwargs):
+
+class PresetIndex(object):
+    '''Tracks the active state of all presets for a backend
+
+    Each output is mapped to the presets that store it, and the outputs that
+    do not match the current routing are kept for each preset. Routing
+    changes come from the backend's :class:`~.routing.RoutingTable`, so only
+    the presets that include the changed outputs are updated.
+
+    Args:
+        backend: The :class:`VidhubBackendBase` instance
+    '''
+    def __init__(self, backend):
+        self.backend = backend
+        self.presets_by_output = {}
+        self.preset_outputs = {}
+        self.mismatched = {}
+        backend.bind(prelude_parsed=self.on_backend_prelude_parsed)
+    def add_preset(self, preset):
+        self.update_preset(preset)
+    def remove_preset(self, preset):
+        for out_idx in self.preset_outputs.pop(preset, ()):
+            presets = self.presets_by_output[out_idx]
+            presets.discard(preset)
+            if not len(presets):
+                del self.presets_by_output[out_idx]
+        self.mismatched.pop(preset, None)
+    def update_preset(self, preset):
+        '''Re-index a preset after its crosspoints have changed
+        '''
+        outputs = set(preset.crosspoints.keys())
+        old_outputs = self.preset_outputs.get(preset, set())
+        for out_idx in old_outputs - outputs:
+            presets = self.presets_by_output[out_idx]
+            presets.discard(preset)
+            if not len(presets):
+                del self.presets_by_output[out_idx]
+        for out_idx in outputs - old_outputs:
+            self.presets_by_output.setdefault(out_idx, set()).add(preset)
+        self.preset_outputs[preset] = outputs
+        xpts = self.backend.routing_table
+        num_outputs = len(xpts)
+        self.mismatched[preset] = set(
+            out_idx for out_idx, in_idx in preset.crosspoints.items()
+            if out_idx >= num_outputs or xpts[out_idx] != in_idx
+        )
+        self._update_active(preset)
+    def get_mismatch_count(self, preset):
+        '''Number of the preset's outputs not routed as stored
+        '''
+        return len(self.mismatched[preset])
+    def rebuild(self):
+        for preset in list(self.preset_outputs.keys()):
+            self.update_preset(preset)
+    def _update_active(self, preset):
         if not self.backend.prelude_parsed:
             return
-        self.check_active()
-    def on_preset_crosspoints(self, instance, value, **kwargs):
-        if not len(self.crosspoints) or not self.backend.prelude_parsed:
+        preset.active = len(preset.crosspoints) > 0 and not len(self.mismatched[preset])
+    def on_backend_prelude_parsed(self, instance, value, **kwargs):
+        if value:
+            self.rebuild()
+    def on_routes_changed(self, keys):
+        '''Called by the backend with the output indices changed in its
+        routing table (``None`` if the number of outputs changed)
+        '''
+        if not self.backend.prelude_parsed:
             return
-        self.check_active()
+        if keys is None:
+            self.rebuild()
+            return
+        routes = self.backend.routing_table
+        affected = set()
+        for out_idx in keys:
+            presets = self.presets_by_output.get(out_idx)
+            if not presets:
+                continue
+            in_idx = routes[out_idx]
+            for preset in presets:
+                if preset.crosspoints[out_idx] == in_idx:
+                    self.mismatched[preset].discard(out_idx)
+                else:
+                    self.mismatched[preset].add(out_idx)
+                affected.add(preset)
+        for preset in affected:
+            self._update_active(preset)
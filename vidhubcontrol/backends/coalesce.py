@@ -0,0 +1,67 @@
+import asyncio
+
+class WriteCoalescer(object):
+    '''Merges indexed changes submitted within a short window into one command
+
+    The first call to :meth:`submit` opens a window of :attr:`window` seconds.
+    Any changes submitted before it closes are merged (last write wins for
+    each index) and sent with a single call to :attr:`send_func`. All callers
+    in the window receive the result of that merged command.
+
+    Args:
+        send_func: A coroutine function accepting ``(index, value)`` pairs as
+            positional arguments
+        window (float): The time window in seconds
+        loop: The event loop
+    '''
+    def __init__(self, send_func, window, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.send_func = send_func
+        self.window = window
+        self.pending = {}
+        self.order = []
+        self.future = None
+        self._timer = None
+    def submit(self, items):
+        '''Add ``(index, value)`` pairs to the current window
+
+        Returns:
+            An :class:`asyncio.Future` resolved with the result of the merged
+            command
+        '''
+        pending = self.pending
+        for i, value in items:
+            if i not in pending:
+                self.order.append(i)
+            pending[i] = value
+        if self.future is None:
+            self.future = self.loop.create_future()
+            self._timer = self.loop.call_later(self.window, self.flush)
+        return self.future
+    def flush(self):
+        '''Send the merged changes immediately
+        '''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        fut = self.future
+        if fut is None:
+            return
+        pending = self.pending
+        items = [(i, pending[i]) for i in self.order]
+        self.pending = {}
+        self.order = []
+        self.future = None
+        task = asyncio.ensure_future(self.send_func(*items), loop=self.loop)
+        task.add_done_callback(lambda t: self._on_sent(t, fut))
+    def _on_sent(self, task, fut):
+        if fut.done():
+            return
+        if task.cancelled():
+            fut.cancel()
+        elif task.exception() is not None:
+            fut.set_exception(task.exception())
+        else:
+            fut.set_result(task.result())
@@ -0,0 +1,229 @@
+import asyncio
+import collections
+import logging
+import math
+import weakref
+
+logger = logging.getLogger(__name__)
+
+class CommandTimeoutError(asyncio.TimeoutError):
+    '''Raised when a device does not respond to a command before its deadline
+    '''
+    pass
+
+class TimerWheel(object):
+    '''A coarse, shared timer for command deadlines
+
+    Deadlines are rounded up to the next tick of :attr:`resolution` seconds and
+    stored in per-tick buckets. Only one loop callback is scheduled (for the
+    earliest occupied tick) no matter how many deadlines are pending, and
+    cancelling an entry is O(1).
+
+    Use :meth:`get` to obtain the wheel shared by everything on an event loop.
+    '''
+    DEFAULT_RESOLUTION = .05
+    _instances = weakref.WeakKeyDictionary()
+    def __init__(self, resolution=DEFAULT_RESOLUTION, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.resolution = resolution
+        self.buckets = {}
+        self._handle = None
+        self._handle_tick = None
+    @classmethod
+    def get(cls, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        wheel = cls._instances.get(loop)
+        if wheel is None:
+            wheel = cls._instances[loop] = cls(loop=loop)
+        return wheel
+    def schedule(self, timeout, callback, *args):
+        '''Call ``callback(*args)`` after (at least) ``timeout`` seconds
+
+        Returns:
+            An entry object to be passed to :meth:`cancel`
+        '''
+        tick = int(math.ceil((self.loop.time() + timeout) / self.resolution))
+        entry = [callback, args, False]
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = []
+        bucket.append(entry)
+        if self._handle_tick is None or tick < self._handle_tick:
+            self._schedule_tick(tick)
+        return entry
+    def cancel(self, entry):
+        entry[2] = True
+    def _schedule_tick(self, tick):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle_tick = tick
+        self._handle = self.loop.call_at(tick * self.resolution, self._on_tick)
+    def _on_tick(self):
+        self._handle = None
+        self._handle_tick = None
+        now = self.loop.time() / self.resolution
+        expired = [tick for tick in self.buckets if tick <= now]
+        for tick in sorted(expired):
+            for callback, args, cancelled in self.buckets.pop(tick):
+                if not cancelled:
+                    callback(*args)
+        if len(self.buckets):
+            self._schedule_tick(min(self.buckets))
+
+class Command(object):
+    '''A command that has been sent and is awaiting an ACK or NAK
+
+    Attributes:
+        data (bytes): The encoded command
+        future: An :class:`asyncio.Future` resolved with ``True`` on ACK or
+            ``False`` on NAK
+        expired (bool): ``True`` if the deadline passed before a response
+            arrived. The command is kept in the queue so a late response is
+            still matched to it (see :meth:`CommandQueue.handle_response`)
+    '''
+    __slots__ = ('data', 'future', 'timer', 'expired')
+    def __init__(self, data, future):
+        self.data = data
+        self.future = future
+        self.timer = None
+        self.expired = False
+
+class CommandQueue(object):
+    '''Pipelines commands for a single device connection
+
+    Up to :attr:`max_pending` commands may be outstanding at once. The device
+    answers each command with an ACK or NAK in the order they were received,
+    so responses are matched to commands in FIFO order.
+
+    Args:
+        write_func: A coroutine function used to send data to the device. If
+            it returns ``False`` the command is failed with a
+            :class:`ConnectionError`
+        max_pending (int): Maximum number of commands in flight
+        loop: The event loop
+        timeout_callback (optional): Called with the :class:`Command` when a
+            command's deadline passes
+        resync_callback (optional): Called when responses can no longer be
+            matched to commands (see :meth:`handle_response`). It should
+            drop the connection and call :meth:`cancel_all`. If not given,
+            :meth:`cancel_all` is called
+    '''
+    def __init__(self, write_func, max_pending=16, loop=None, timeout_callback=None,
+                 resync_callback=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.write_func = write_func
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        self.semaphore = asyncio.Semaphore(max_pending)
+        self.timeout_callback = timeout_callback
+        self.resync_callback = resync_callback
+    async def send(self, data, timeout=None):
+        '''Send a command once a slot is available
+
+        Args:
+            data (bytes): The encoded command
+            timeout (float, optional): If given, the command fails with
+                :class:`CommandTimeoutError` (and its slot is released) if no
+                response arrives within this many seconds
+
+        Returns:
+            The :class:`asyncio.Future` for the command's response
+        '''
+        await self.semaphore.acquire()
+        cmd = Command(data, self.loop.create_future())
+        self.pending.append(cmd)
+        try:
+            r = await self.write_func(data)
+        except Exception:
+            self._fail(cmd)
+            raise
+        if r is False:
+            self._fail(cmd, ConnectionError('Could not send command'))
+        elif timeout is not None and not cmd.future.done():
+            cmd.timer = TimerWheel.get(self.loop).schedule(timeout, self._on_timeout, cmd)
+        return cmd.future
+    def handle_response(self, ack):
+        '''Resolve the oldest pending command with an ACK (``True``) or NAK
+        (``False``)
+
+        A response is only treated as a late one for an expired command if
+        no other commands are waiting. Otherwise it may belong to any of
+        them (the device may never answer the expired command), so the
+        queue is resynchronized instead of shifting every later response
+        onto the wrong command
+        '''
+        if not len(self.pending):
+            logger.debug('Unsolicited {}'.format('ACK' if ack else 'NAK'))
+            return
+        cmd = self.pending[0]
+        if cmd.expired:
+            if not all(c.expired for c in self.pending):
+                logger.warning('Response order lost after timeout of {!r}'.format(cmd.data))
+                self.resync()
+                return
+            self.pending.popleft()
+            logger.debug('Late {} for {!r}'.format('ACK' if ack else 'NAK', cmd.data))
+            return
+        self.pending.popleft()
+        self._complete(cmd)
+        if not cmd.future.done():
+            cmd.future.set_result(ack)
+    def cancel_all(self, exc=None):
+        '''Fail all pending commands (when the connection is lost or closed)
+        '''
+        if exc is None:
+            exc = ConnectionResetError('Connection closed')
+        while len(self.pending):
+            cmd = self.pending.popleft()
+            if cmd.expired:
+                continue
+            self._complete(cmd)
+            if not cmd.future.done():
+                cmd.future.set_exception(exc)
+    def resync(self):
+        '''Fail all pending commands through :attr:`resync_callback` (or
+        :meth:`cancel_all`)
+        '''
+        if self.resync_callback is not None:
+            self.resync_callback()
+        else:
+            self.cancel_all()
+    @property
+    def num_expired(self):
+        return len([cmd for cmd in self.pending if cmd.expired])
+    def _complete(self, cmd):
+        if cmd.timer is not None:
+            TimerWheel.get(self.loop).cancel(cmd.timer)
+            cmd.timer = None
+        self.semaphore.release()
+    def _on_timeout(self, cmd):
+        cmd.timer = None
+        if cmd.expired or cmd.future.done():
+            return
+        cmd.expired = True
+        self.semaphore.release()
+        logger.warning('Command timed out: {!r}'.format(cmd.data))
+        cmd.future.set_exception(CommandTimeoutError(
+            'No response for command {!r}'.format(cmd.data)
+        ))
+        if self.timeout_callback is not None:
+            self.timeout_callback(cmd)
+    def _fail(self, cmd, exc=None):
+        try:
+            self.pending.remove(cmd)
+        except ValueError:
+            return
+        self._complete(cmd)
+        if cmd.future.done():
+            return
+        if exc is None:
+            cmd.future.cancel()
+        else:
+            cmd.future.set_exception(exc)
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,57 @@
+import math
+
+class Histogram(object):
+    '''A streaming histogram for latency values (in seconds)
+
+    Values are counted in logarithmically spaced buckets, so memory use does
+    not grow with the number of samples and percentiles are accurate to
+    within ``growth`` of the actual value.
+
+    Args:
+        min_value (float): Values below this are counted in the first bucket
+        growth (float): Ratio between the bounds of adjacent buckets
+    '''
+    def __init__(self, min_value=1e-5, growth=1.05):
+        self.min_value = min_value
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self.reset()
+    def reset(self):
+        self.counts = {}
+        self.count = 0
+        self.min = None
+        self.max = None
+    def add(self, value):
+        if value <= self.min_value:
+            i = 0
+        else:
+            i = int(math.log(value / self.min_value) / self._log_growth) + 1
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    def percentile(self, p):
+        '''Get the approximate value at percentile ``p`` (0 to 100)
+
+        Returns ``None`` if no values have been added
+        '''
+        if not self.count:
+            return None
+        if p <= 0:
+            return self.min
+        if p >= 100:
+            return self.max
+        target = max(1, int(math.ceil(self.count * p / 100.)))
+        total = 0
+        for i in sorted(self.counts):
+            total += self.counts[i]
+            if total >= target:
+                break
+        if i == 0:
+            value = self.min_value
+        else:
+            # Geometric midpoint of the bucket
+            value = self.min_value * self.growth ** (i - .5)
+        return min(max(value, self.min), self.max)
@@ -0,0 +1,97 @@
+class Block(object):
+    '''A single protocol block (a header line followed by zero or more lines)
+
+    Attributes:
+        name (str): The block header without the trailing colon
+            (``'VIDEO OUTPUT ROUTING'``, ``'ACK'``, etc)
+        lines (list): The decoded body lines of the block
+    '''
+    __slots__ = ('name', 'lines')
+    def __init__(self, name, lines=None):
+        self.name = name
+        if lines is None:
+            lines = []
+        self.lines = lines
+    def iter_items(self):
+        '''Iterate over ``(key, value)`` pairs for ``"Key: value"`` lines
+        '''
+        for line in self.lines:
+            key, sep, value = line.partition(':')
+            if not sep:
+                continue
+            yield key, value.strip(' ')
+    def iter_indexed(self):
+        '''Iterate over ``(index, value)`` pairs for ``"<index> <value>"`` lines
+        '''
+        for line in self.lines:
+            i, sep, value = line.partition(' ')
+            if not i.isdigit():
+                continue
+            yield int(i), value
+    def __eq__(self, other):
+        if not isinstance(other, Block):
+            return NotImplemented
+        return self.name == other.name and self.lines == other.lines
+    def __repr__(self):
+        return '<{self.__class__.__name__}: {self}>'.format(self=self)
+    def __str__(self):
+        return '{} ({} lines)'.format(self.name, len(self.lines))
+
+class BlockParser(object):
+    '''Incremental framer for the Blackmagic Ethernet control protocols
+
+    Raw bytes are passed to :meth:`feed` as they arrive from the transport.
+    Complete lines are decoded exactly once and collected into
+    :class:`Block` objects, which are returned as soon as their terminating
+    blank line has been received. Only the trailing partial line (if any)
+    is held over between calls.
+
+    Blocks listed in :attr:`SINGLE_LINE_BLOCKS` have no body and are returned
+    as soon as their header line is complete.
+    '''
+    SINGLE_LINE_BLOCKS = ('ACK', 'NAK', 'END PRELUDE')
+    def __init__(self, encoding='UTF-8'):
+        self.encoding = encoding
+        self.partial = b''
+        self.current_block = None
+    def reset(self):
+        self.partial = b''
+        self.current_block = None
+    def feed(self, data):
+        '''Consume received bytes and return a list of completed blocks
+        '''
+        blocks = []
+        if len(self.partial):
+            data = self.partial + data
+        start = 0
+        find = data.find
+        parse_line = self._parse_line
+        while True:
+            i = find(b'\n', start)
+            if i < 0:
+                break
+            parse_line(data[start:i], blocks)
+            start = i + 1
+        self.partial = data[start:]
+        return blocks
+    def _parse_line(self, line, blocks):
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        block = self.current_block
+        if not len(line):
+            if block is not None:
+                self.current_block = None
+                blocks.append(block)
+            return
+        line = line.decode(self.encoding, 'replace')
+        if block is not None:
+            block.lines.append(line)
+            return
+        name = line
+        if name.endswith(':'):
+            name = name[:-1]
+        block = Block(name)
+        if name in self.SINGLE_LINE_BLOCKS:
+            blocks.append(block)
+        else:
+            self.current_block = block
@@ -0,0 +1,23 @@
+import random
+
+class Backoff(object):
+    '''Jittered exponential backoff delays for reconnect attempts
+
+    Each call to :meth:`next_delay` returns ``initial * factor ** attempt``
+    (capped at ``maximum``), scaled by a random amount within ``+/- jitter``
+    so that many devices don't retry in lock-step.
+    '''
+    def __init__(self, initial=.5, maximum=30., factor=2., jitter=.2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempt = 0
+    def reset(self):
+        self.attempt = 0
+    def next_delay(self):
+        delay = min(self.initial * self.factor ** self.attempt, self.maximum)
+        self.attempt += 1
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return delay
@@ -0,0 +1,86 @@
+from array import array
+
+class RoutingTable(object):
+    '''Compact routing state for a matrix router
+
+    Routes are stored as an ``array('H')`` of input indices (one per output)
+    along with a reverse index from each input to the outputs it is routed to.
+
+    :class:`~vidhubcontrol.backends.base.VidhubBackendBase` keeps one in sync
+    with its ``crosspoints`` and hands the changed outputs to its
+    :class:`~vidhubcontrol.backends.base.PresetIndex`.
+
+    Attributes:
+        routes: The input index for each output
+        version (int): Incremented each time routes are changed
+        dirty (set): Output indices changed since the last call to
+            :meth:`pop_dirty`
+    '''
+    def __init__(self, routes=None):
+        self.version = 0
+        self.routes = array('H')
+        self._reverse = {}
+        self.dirty = set()
+        self.reset(routes or [])
+    def reset(self, routes):
+        '''Replace all routes
+
+        Returns:
+            The output indices that changed, or ``None`` if the number of
+            outputs changed (every output is then marked as dirty)
+        '''
+        if len(routes) == len(self.routes):
+            return self.update(enumerate(routes))
+        self.routes = array('H', routes)
+        self._reverse = {}
+        for out_idx, in_idx in enumerate(self.routes):
+            self._reverse.setdefault(in_idx, set()).add(out_idx)
+        self.dirty = set(range(len(self.routes)))
+        self.version += 1
+        return None
+    def update(self, items):
+        '''Apply ``(out_idx, in_idx)`` pairs
+
+        Returns:
+            list: The output indices that changed
+        '''
+        routes = self.routes
+        reverse = self._reverse
+        keys = []
+        for out_idx, in_idx in items:
+            prev = routes[out_idx]
+            if prev == in_idx:
+                continue
+            routes[out_idx] = in_idx
+            outputs = reverse[prev]
+            outputs.discard(out_idx)
+            if not len(outputs):
+                del reverse[prev]
+            reverse.setdefault(in_idx, set()).add(out_idx)
+            keys.append(out_idx)
+        if len(keys):
+            self.dirty.update(keys)
+            self.version += 1
+        return keys
+    def get_outputs(self, in_idx):
+        '''Get the output indices currently routed from the given input
+
+        Returns:
+            frozenset
+        '''
+        return frozenset(self._reverse.get(in_idx, ()))
+    def pop_dirty(self):
+        '''Get (and clear) the output indices changed since the last call
+
+        Returns:
+            list: The changed output indices in ascending order
+        '''
+        dirty = sorted(self.dirty)
+        self.dirty.clear()
+        return dirty
+    def __getitem__(self, out_idx):
+        return self.routes[out_idx]
+    def __len__(self):
+        return len(self.routes)
+    def __iter__(self):
+        return iter(self.routes)
@@ -1,10 +1,14 @@
 import asyncio
 import logging
-import string
 
 from pydispatch import Property
 
-from vidhubcontrol import aiotelnetlib
+from vidhubcontrol import aioclient
+from .parser import BlockParser
+from .commands import CommandQueue, CommandTimeoutError
+from .reconnect import Backoff
+from .histogram import Histogram
+from .trace import TraceRecorder, TraceBuffer, RX, TX, OPEN
 from .base import (
     VidhubBackendBase,
     SmartViewBackendBase,
@@ -17,164 +21,431 @@ logger = logging.getLogger(__name__)
 class TelnetBackendBase(object):
     hostaddr = Property()
     hostport = Property()
+    rtt_p50 = Property()
+    rtt_p95 = Property()
+    rtt_p99 = Property()
+    MAX_PENDING_COMMANDS = 16
+    COMMAND_TIMEOUTS = {
+        'default':5.,
+        'prelude':10.,
+        'ping':2.,
+    }
+    KEEPALIVE_INTERVAL = 10.
+    KEEPALIVE_MAX_MISSES = 3
+    TRACE_BUFFER_SIZE = 0
     def _telnet_init(self, **kwargs):
         self.read_enabled = False
-        self.current_section = None
-        self.ack_or_nak = None
-        self.ack_or_nak_event = asyncio.Event()
+        self.parser = BlockParser()
         self.read_coro = None
         self.hostaddr = kwargs.get('hostaddr')
         self.hostport = kwargs.get('hostport', self.DEFAULT_PORT)
-        self.rx_bfr = b''
         self.response_ready = asyncio.Event()
+        self.command_queue = CommandQueue(
+            self.send_to_client,
+            max_pending=kwargs.get('max_pending_commands', self.MAX_PENDING_COMMANDS),
+            loop=self.event_loop,
+            resync_callback=self.on_command_resync,
+        )
+        self.command_timeouts = self.COMMAND_TIMEOUTS.copy()
+        self.command_timeouts.update(kwargs.get('command_timeouts', {}))
+        self.auto_reconnect = kwargs.get('auto_reconnect', True)
+        self.reconnect_backoff = Backoff(
+            initial=kwargs.get('reconnect_delay', .5),
+            maximum=kwargs.get('reconnect_max_delay', 30.),
+        )
+        self.reconnect_task = None
+        self.keepalive_interval = kwargs.get('keepalive_interval', self.KEEPALIVE_INTERVAL)
+        self.keepalive_max_misses = kwargs.get('keepalive_max_misses', self.KEEPALIVE_MAX_MISSES)
+        self.keepalive_task = None
+        self.keepalive_misses = 0
+        self.last_rx_time = None
+        self.rtt_histogram = Histogram()
+        self.client_factory = kwargs.get('client_factory')
+        self.recorder = None
+        self.trace_buffer = None
+        trace_buffer_size = kwargs.get('trace_buffer_size', self.TRACE_BUFFER_SIZE)
+        if trace_buffer_size:
+            self.enable_trace(trace_buffer_size)
+        trace_filename = kwargs.get('trace_filename')
+        if trace_filename is not None:
+            self.start_recording(trace_filename)
+    def enable_trace(self, maxlen=256):
+        '''Keep the last ``maxlen`` frames sent and received in memory
+
+        See :meth:`dump_trace`
+        '''
+        if self.trace_buffer is not None and self.trace_buffer.maxlen == maxlen:
+            return
+        self.trace_buffer = TraceBuffer(maxlen)
+    def disable_trace(self):
+        self.trace_buffer = None
+    def dump_trace(self):
+        '''Get the frames in the trace buffer as a list of strings
+
+        Returns an empty list if tracing is not enabled
+        '''
+        if self.trace_buffer is None:
+            return []
+        return self.trace_buffer.format_lines()
+    def start_recording(self, filename):
+        '''Record all data sent and received to a trace file
+
+        ``{hostaddr}`` and ``{hostport}`` in the filename are replaced with
+        those of the device. Each reconnect is added to the same file as a
+        new session. The file is closed by :meth:`stop_recording` or when
+        the backend is disconnected or aborted.
+
+        See :class:`~vidhubcontrol.backends.trace.TraceRecorder`
+        '''
+        self.stop_recording()
+        filename = filename.format(hostaddr=self.hostaddr, hostport=self.hostport)
+        self.recorder = TraceRecorder(filename)
+        if self.client is not None:
+            self.recorder.record_open(self.hostaddr, self.hostport)
+    def stop_recording(self):
+        recorder = self.recorder
+        if recorder is None:
+            return
+        self.recorder = None
+        recorder.close()
+    def get_command_timeout(self, command_type=None):
+        if command_type in self.command_timeouts:
+            return self.command_timeouts[command_type]
+        return self.command_timeouts.get('default')
     async def read_loop(self):
         while self.read_enabled:
-            await self.client.wait_for_data()
+            c = self.client
+            if c is None:
+                break
+            await c.wait_for_data()
             if not self.read_enabled:
                 break
+            rx_bfr = c.read_nowait()
+            if len(rx_bfr):
+                self.last_rx_time = self.event_loop.time()
+                if self.trace_buffer is not None:
+                    self.trace_buffer.append(RX, rx_bfr)
+                if self.recorder is not None:
+                    self.recorder.record_rx(rx_bfr)
+                for block in self.parser.feed(rx_bfr):
+                    await self.parse_block(block)
+                self.response_ready.set()
+            if c.eof:
+                logger.error('Connection closed by {}:{}'.format(self.hostaddr, self.hostport))
+                self.on_connection_lost()
+                return
+    def on_connection_lost(self):
+        '''Called when the connection drops without :meth:`disconnect`
+
+        Pending commands are failed and, if :attr:`auto_reconnect` is enabled,
+        :meth:`reconnect_loop` is started.
+        '''
+        c = self.client
+        self.client = None
+        self.read_enabled = False
+        self._stop_keepalive()
+        self.prelude_parsed = False
+        self.connected = False
+        if c is not None:
+            c.abort()
+        self.command_queue.cancel_all()
+        self.response_ready.set()
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.auto_reconnect:
+            self.start_reconnect()
+    def on_command_resync(self):
+        '''Called by :attr:`command_queue` when responses can no longer be
+        matched to commands
+
+        The connection is dropped (failing all pending commands) and
+        reconnected if :attr:`auto_reconnect` is enabled
+        '''
+        logger.error('Lost track of responses from {}:{}, reconnecting'.format(
+            self.hostaddr, self.hostport))
+        self.on_connection_lost()
+    def _on_connect_failed(self):
+        # Keep retrying devices that are unreachable (including at startup)
+        # rather than giving up after the first attempt
+        if self.auto_reconnect:
+            self.start_reconnect()
+    def start_reconnect(self):
+        t = self.reconnect_task
+        if t is not None and not t.done():
+            return
+        self.reconnect_task = asyncio.ensure_future(
+            self.reconnect_loop(), loop=self.event_loop,
+        )
+    async def reconnect_loop(self):
+        '''Reconnect with jittered exponential backoff until successful
+
+        Existing routing and label state is kept while disconnected. The new
+        prelude is applied through
+        :meth:`~vidhubcontrol.backends.base.VidhubBackendBase.update_list_property`,
+        so only values that changed while offline are emitted.
+        '''
+        backoff = self.reconnect_backoff
+        backoff.reset()
+        try:
+            while self.auto_reconnect and not self.connected:
+                delay = backoff.next_delay()
+                logger.info('Reconnecting to {}:{} in {:.2f}s'.format(
+                    self.hostaddr, self.hostport, delay))
+                await asyncio.sleep(delay)
+                if self.connected:
+                    break
+                await self.connect()
+        except asyncio.CancelledError:
+            if self.client is not None or self.read_coro is not None:
+                await self._close_client()
+            self.connected = False
+            raise
+        finally:
+            if self.reconnect_task is asyncio.current_task():
+                self.reconnect_task = None
+    async def keepalive_loop(self):
+        '''Send ``PING`` to the device when the connection has been idle for
+        :attr:`keepalive_interval` seconds
+
+        Round-trip times are added to :attr:`rtt_histogram`. If
+        :attr:`keepalive_max_misses` pings in a row go unanswered, the device
+        is considered unreachable and the connection is dropped (and
+        reconnected if :attr:`auto_reconnect` is enabled).
+        '''
+        loop = self.event_loop
+        interval = self.keepalive_interval
+        while self.read_enabled:
+            idle = loop.time() - self.last_rx_time
+            if idle < interval:
+                await asyncio.sleep(interval - idle)
+                continue
+            start = loop.time()
             try:
-                rx_bfr = await self.client.read_very_eager()
-            except Exception as e:
-                self.client = None
-                self.read_enabled = False
-                self.connected = False
-                logger.error(e)
+                fut = await self.send_command(b'PING:\n\n', 'ping')
+                r = await fut
+            except CommandTimeoutError:
+                r = None
+            except ConnectionError:
                 return
-            if len(rx_bfr):
-                self.rx_bfr += rx_bfr
-                logger.debug(self.rx_bfr.decode('UTF-8'))
-                await self.parse_rx_bfr()
-                self.rx_bfr = b''
+            if r is None:
+                self.keepalive_misses += 1
+                logger.warning('No PING response from {}:{} ({} missed)'.format(
+                    self.hostaddr, self.hostport, self.keepalive_misses))
+                if self.keepalive_misses >= self.keepalive_max_misses:
+                    logger.error('{}:{} unreachable'.format(self.hostaddr, self.hostport))
+                    self.on_connection_lost()
+                    return
+                continue
+            self.keepalive_misses = 0
+            self.add_rtt_sample(loop.time() - start)
+            # Wait a full interval even if the ACK was the last thing received
+            self.last_rx_time = loop.time()
+    def add_rtt_sample(self, value):
+        h = self.rtt_histogram
+        h.add(value)
+        self.rtt_p50 = h.percentile(50)
+        self.rtt_p95 = h.percentile(95)
+        self.rtt_p99 = h.percentile(99)
+    def _start_keepalive(self):
+        if not self.keepalive_interval:
+            return
+        self.keepalive_misses = 0
+        self.last_rx_time = self.event_loop.time()
+        self.keepalive_task = asyncio.ensure_future(
+            self.keepalive_loop(), loop=self.event_loop,
+        )
+    def _stop_keepalive(self):
+        t = self.keepalive_task
+        self.keepalive_task = None
+        if t is None or t.done():
+            return
+        try:
+            current = asyncio.current_task()
+        except RuntimeError:
+            # Called from :meth:`abort` outside of the event loop
+            current = None
+        if t is current:
+            return
+        t.cancel()
+    async def stop_reconnect(self):
+        t = self.reconnect_task
+        self.reconnect_task = None
+        if t is None or t.done():
+            return
+        if t is asyncio.current_task():
+            return
+        t.cancel()
+        await asyncio.wait([t])
     async def send_to_client(self, data):
-        if not self.connected:
-            c = await self.connect()
+        # Connecting here would fail the queued command (and every other
+        # pending one) while its data is still written to the new connection
         c = self.client
         if not c:
-            return
-        s = '\n'.join(['---> {}'.format(line) for line in data.decode('UTF-8').splitlines()])
-        logger.debug(s)
+            return False
+        if self.trace_buffer is not None:
+            self.trace_buffer.append(TX, data)
+        if self.recorder is not None:
+            self.recorder.record_tx(data)
         try:
             await c.write(data)
         except Exception as e:
-            self.client = None
-            self.connected = False
             logger.error(e)
+            if self.client is c:
+                self.on_connection_lost()
+            return False
+        return True
+    async def send_command(self, data, command_type=None):
+        '''Send an encoded command to the device
+
+        Multiple commands may be in flight at once (up to
+        ``max_pending_commands``).
+
+        Args:
+            data (bytes): The encoded command
+            command_type (str, optional): Used to look up the deadline in
+                :attr:`command_timeouts` (the ``'default'`` entry is used if
+                not found). A timeout of ``None`` disables the deadline
+
+        Returns:
+            An :class:`asyncio.Future` resolved with ``True`` if the device
+            acknowledged the command or ``False`` if it was rejected (NAK).
+            If no response arrives in time, the future raises
+            :class:`~vidhubcontrol.backends.commands.CommandTimeoutError`
+
+        Raises:
+            ConnectionError: If not connected. Reconnecting is left to
+                :meth:`connect` and :meth:`reconnect_loop`
+        '''
+        if not self.connected:
+            raise ConnectionError('Not connected to {}:{}'.format(self.hostaddr, self.hostport))
+        timeout = self.get_command_timeout(command_type)
+        return await self.command_queue.send(data, timeout)
     async def do_connect(self):
-        self.rx_bfr = b''
+        self.parser.reset()
+        self.command_queue.cancel_all()
         logger.debug('connecting')
+        factory = self.client_factory
+        if factory is None:
+            factory = aioclient.Client
         try:
-            c = self.client = await aiotelnetlib.Telnet(self.hostaddr, self.hostport)
+            c = factory(self.hostaddr, self.hostport, loop=self.event_loop)
+            await c.open()
         except OSError as e:
             logger.error(e)
             self.client = None
+            self._on_connect_failed()
             return False
+        self.client = c
+        if self.trace_buffer is not None:
+            self.trace_buffer.append(OPEN, bytes('{}:{}'.format(self.hostaddr, self.hostport), 'UTF-8'))
+        if self.recorder is not None:
+            self.recorder.record_open(self.hostaddr, self.hostport)
         self.prelude_parsed = False
         self.read_enabled = True
         self.read_coro = asyncio.ensure_future(self.read_loop(), loop=self.event_loop)
-        await self.wait_for_response(prelude=True)
+        try:
+            r = await asyncio.wait_for(
+                self.wait_for_prelude(), self.get_command_timeout('prelude'),
+            )
+        except asyncio.TimeoutError:
+            logger.error('Timed out waiting for prelude from {}:{}'.format(
+                self.hostaddr, self.hostport))
+            r = False
+        except asyncio.CancelledError:
+            await self._close_client()
+            raise
+        if not r:
+            await self._close_client()
+            self._on_connect_failed()
+            return False
         logger.debug('prelude parsed')
+        self._start_keepalive()
         return c
+    async def disconnect(self):
+        await self.stop_reconnect()
+        await super().disconnect()
+        self.stop_recording()
     async def do_disconnect(self):
         logger.debug('disconnecting')
+        await self._close_client()
+        logger.debug('disconnected')
+    async def _close_client(self):
         self.read_enabled = False
+        self._stop_keepalive()
         if self.client is not None:
             await self.client.close_async()
         if self.read_coro is not None:
-            await asyncio.wait([self.read_coro], loop=self.event_loop)
+            await asyncio.wait([self.read_coro])
             self.read_coro = None
         self.client = None
-        logger.debug('disconnected')
-    async def wait_for_response(self, prelude=False):
-        logger.debug('wait_for_response...')
+        self.command_queue.cancel_all()
+        if self.recorder is not None:
+            self.recorder.flush()
+    def do_abort(self):
+        self.read_enabled = False
+        self._stop_keepalive()
+        t = self.reconnect_task
+        self.reconnect_task = None
+        if t is not None and not t.done():
+            t.cancel()
+        if self.client is not None:
+            self.client.abort()
+        if self.read_coro is not None:
+            self.read_coro.cancel()
+            self.read_coro = None
+        self.command_queue.cancel_all()
+        self.response_ready.set()
+        self.stop_recording()
+    async def parse_block(self, block):
+        if block.name in ('ACK', 'NAK'):
+            self.command_queue.handle_response(block.name == 'ACK')
+            return True
+        return False
+    async def wait_for_prelude(self):
+        logger.debug('wait_for_prelude...')
         while self.read_enabled:
+            if self.prelude_parsed:
+                return True
             await self.response_ready.wait()
             self.response_ready.clear()
-            if prelude:
-                if self.prelude_parsed:
-                    return
-                else:
-                    await asyncio.sleep(.1)
-            if self.ack_or_nak is not None:
-                resp = self.ack_or_nak
-                self.ack_or_nak_event.clear()
-                logger.debug('ack_or_nak: {}'.format(resp))
-                self.ack_or_nak = None
-                return resp
-    async def wait_for_ack_or_nak(self):
-        logger.debug('wait_for_ack_or_nak...')
-        await self.ack_or_nak_event.wait()
-        resp = self.ack_or_nak
-        self.ack_or_nak = None
-        self.ack_or_nak_event.clear()
-        return resp.startswith('ACK')
+        return self.prelude_parsed
+    async def send_and_wait(self, data, command_type=None):
+        fut = await self.send_command(data, command_type)
+        return await fut
 
 class TelnetBackend(TelnetBackendBase, VidhubBackendBase):
     DEFAULT_PORT = 9990
-    SECTION_NAMES = [
-        'PROTOCOL PREAMBLE:',
-        'VIDEOHUB DEVICE:',
-        'INPUT LABELS:',
-        'OUTPUT LABELS:',
-        'VIDEO OUTPUT LOCKS:',
-        'VIDEO OUTPUT ROUTING:',
-        'CONFIGURATION:',
-    ]
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self._telnet_init(**kwargs)
-    async def parse_rx_bfr(self):
-        def split_value(line):
-            return line.split(':')[1].strip(' ')
-        bfr = self.rx_bfr.decode('UTF-8')
-        section_parsed = False
-        for line_idx, line in enumerate(bfr.splitlines()):
-            if 'END PRELUDE' in line:
-                self.current_section = None
-                self.rx_bfr = b''
-                self.prelude_parsed = True
-                break
-            line = line.rstrip('\n')
-            if not len(line):
-                continue
-            if line.startswith('ACK') or line.startswith('NAK'):
-                self.ack_or_nak = line
-                self.ack_or_nak_event.set()
-                continue
-            if line in self.SECTION_NAMES:
-                self.current_section = line.rstrip(':')
-                continue
-            if self.current_section is None:
-                continue
-            elif self.current_section == 'PROTOCOL PREAMBLE':
-                if line.startswith('Version:'):
-                    self.device_version = split_value(line)
-            elif self.current_section == 'VIDEOHUB DEVICE':
-                if line.startswith('Model name:'):
-                    self.device_model = split_value(line)
-                elif line.startswith('Unique ID:'):
-                    self.device_id = split_value(line).upper()
-                elif line.startswith('Video outputs:'):
-                    self.num_outputs = int(split_value(line))
-                elif line.startswith('Video inputs:'):
-                    self.num_inputs = int(split_value(line))
-            elif self.current_section == 'OUTPUT LABELS':
-                i = int(line.split(' ')[0])
-                self.output_labels[i] = ' '.join(line.split(' ')[1:])
-                section_parsed = True
-            elif self.current_section == 'INPUT LABELS':
-                i = int(line.split(' ')[0])
-                self.input_labels[i] = ' '.join(line.split(' ')[1:])
-                section_parsed = True
-            elif self.current_section == 'VIDEO OUTPUT ROUTING':
-                out_idx, in_idx = [int(v) for v in line.split(' ')]
-                self.crosspoints[out_idx] = in_idx
-            else:
-                section_parsed = True
-        self.response_ready.set()
-        if not self.prelude_parsed:
+    async def parse_block(self, block):
+        if await super().parse_block(block):
             return
-        if self.current_section is not None and section_parsed:
-            self.current_section = None
+        name = block.name
+        if name == 'END PRELUDE':
+            self.prelude_parsed = True
+        elif name == 'PROTOCOL PREAMBLE':
+            for key, value in block.iter_items():
+                if key == 'Version':
+                    self.device_version = value
+        elif name == 'VIDEOHUB DEVICE':
+            for key, value in block.iter_items():
+                if key == 'Model name':
+                    self.device_model = value
+                elif key == 'Unique ID':
+                    self.device_id = value.upper()
+                elif key == 'Video outputs':
+                    self.num_outputs = int(value)
+                elif key == 'Video inputs':
+                    self.num_inputs = int(value)
+        elif name == 'OUTPUT LABELS':
+            self.update_list_property('output_labels', block.iter_indexed())
+        elif name == 'INPUT LABELS':
+            self.update_list_property('input_labels', block.iter_indexed())
+        elif name == 'VIDEO OUTPUT ROUTING':
+            self.update_list_property('crosspoints', (
+                (out_idx, int(in_idx)) for out_idx, in_idx in block.iter_indexed()
+            ))
     async def get_status(self, *sections):
         if not len(sections):
             sections = [
@@ -182,131 +453,81 @@ class TelnetBackend(TelnetBackendBase, VidhubBackendBase):
                 b'OUTPUT LABELS:\n\n',
                 b'INPUT LABELS:\n\n',
             ]
+        futs = []
         for section in sections:
-            await self.send_to_client(section)
-    async def set_crosspoint(self, out_idx, in_idx):
-        return await self.set_crosspoints((out_idx, in_idx))
-    async def set_crosspoints(self, *args):
+            futs.append(await self.send_command(section, 'status'))
+        await asyncio.gather(*futs)
+    def encode_crosspoints(self, items):
         tx_lines = ['VIDEO OUTPUT ROUTING:']
-        for arg in args:
-            out_idx, in_idx = arg
+        for out_idx, in_idx in items:
             tx_lines.append('{} {}'.format(out_idx, in_idx))
         tx_bfr = bytes('\n'.join(tx_lines), 'UTF-8')
         tx_bfr += b'\n\n'
-        async with self.emission_lock('crosspoints'):
-            await self.send_to_client(tx_bfr)
-            r = await self.wait_for_ack_or_nak()
-            if not r:
-                return False
-            xpts = self.crosspoints[:]
-            for out_idx, in_idx in args:
-                xpts[out_idx] = in_idx
-            self.crosspoints[:] = xpts
+        return tx_bfr
+    async def do_set_crosspoints(self, *args):
+        return await self.send_encoded_crosspoints(self.encode_crosspoints(args), args)
+    async def send_encoded_crosspoints(self, data, items):
+        r = await self.send_and_wait(data, 'crosspoints')
+        if not r:
+            return False
+        self.update_list_property('crosspoints', items)
         return True
-    async def set_output_label(self, out_idx, label):
-        return await self.set_output_labels((out_idx, label))
-    async def set_output_labels(self, *args):
+    async def do_set_output_labels(self, *args):
         tx_lines = ['OUTPUT LABELS:']
         for arg in args:
             out_idx, label = arg
             tx_lines.append('{} {}'.format(out_idx, label))
         tx_bfr = bytes('\n'.join(tx_lines), 'UTF-8')
         tx_bfr += b'\n\n'
-        async with self.emission_lock('output_labels'):
-            await self.send_to_client(tx_bfr)
-            r = await self.wait_for_ack_or_nak()
-            if not r:
-                return False
-            lbls = self.output_labels[:]
-            for out_idx, label in args:
-                lbls[out_idx] = label
-            self.output_labels = lbls[:]
+        r = await self.send_and_wait(tx_bfr, 'output_labels')
+        if not r:
+            return False
+        self.update_list_property('output_labels', args)
         return True
-    async def set_input_label(self, in_idx, label):
-        return await self.set_input_labels((in_idx, label))
-    async def set_input_labels(self, *args):
+    async def do_set_input_labels(self, *args):
         tx_lines = ['INPUT LABELS:']
         for arg in args:
             in_idx, label = arg
             tx_lines.append('{} {}'.format(in_idx, label))
         tx_bfr = bytes('\n'.join(tx_lines), 'UTF-8')
         tx_bfr += b'\n\n'
-        async with self.emission_lock('input_labels'):
-            await self.send_to_client(tx_bfr)
-            r = await self.wait_for_ack_or_nak()
-            if not r:
-                return False
-            lbls = self.input_labels[:]
-            for in_idx, label in args:
-                lbls[in_idx] = label
-            self.input_labels = lbls[:]
+        r = await self.send_and_wait(tx_bfr, 'input_labels')
+        if not r:
+            return False
+        self.update_list_property('input_labels', args)
         return True
 
 class SmartViewTelnetBackendBase(TelnetBackendBase):
     DEFAULT_PORT = 9992
-    SECTION_NAMES = [
-        'PROTOCOL PREAMBLE:',
-        'SMARTVIEW DEVICE:',
-        'NETWORK:',
-    ]
-    async def parse_rx_bfr(self):
-        def split_value(line):
-            return line.split(':')[1].strip(' ')
-        bfr = self.rx_bfr.decode('UTF-8')
-        section_parsed = False
-        for line_idx, line in enumerate(bfr.splitlines()):
-            line = line.rstrip('\n')
-            if not len(line):
-                if self.current_section.startswith('MONITOR') and len(self.monitors) == self.num_monitors:
-                    self.current_section = None
-                    self.rx_bfr = b''
-                    self.prelude_parsed = True
-                    break
-                continue
-            if line.startswith('ACK') or line.startswith('NAK'):
-                self.ack_or_nak = line
-                self.ack_or_nak_event.set()
-                if bfr.rstrip('\n') == line:
-                    self.current_section = None
-                    self.rx_bfr = b''
-                    break
-                continue
-            if line in self.SECTION_NAMES:
-                self.current_section = line.rstrip(':')
-                continue
-            if self.current_section is None:
-                continue
-            elif self.current_section == 'PROTOCOL PREAMBLE':
-                if line.startswith('Version:'):
-                    self.device_version = split_value(line)
-            elif self.current_section == 'SMARTVIEW DEVICE':
-                if line.startswith('Model:'):
-                    self.device_model = split_value(line)
-                elif line.startswith('Hostname:'):
-                    self.device_id = split_value(line).split('-')[1].upper()
-                elif line.startswith('Name:'):
-                    if self.device_name is None or self.device_name == self.device_id:
-                        self.device_name = split_value(line)
-                elif line.startswith('Monitors:'):
-                    self.num_monitors = int(split_value(line))
-                    for c in string.ascii_uppercase[:self.num_monitors]:
-                        s = 'MONITOR {}:'.format(c)
-                        if s not in self.SECTION_NAMES:
-                            self.SECTION_NAMES.append(s)
-                elif line.startswith('Inverted:'):
-                    self.inverted = split_value(line) == 'true'
-            elif self.current_section == 'NETWORK':
-                pass
-            elif self.current_section.startswith('MONITOR '):
-                monitor_name = self.current_section
-                await self.parse_monitor_line(monitor_name, line, split_value(line))
-            else:
-                section_parsed = True
-        self.response_ready.set()
-        if not self.prelude_parsed:
+    async def parse_block(self, block):
+        if await super().parse_block(block):
             return
-        if self.current_section is not None and section_parsed:
-            self.current_section = None
+        name = block.name
+        if name == 'PROTOCOL PREAMBLE':
+            for key, value in block.iter_items():
+                if key == 'Version':
+                    self.device_version = value
+        elif name == 'SMARTVIEW DEVICE':
+            for key, value in block.iter_items():
+                if key == 'Model':
+                    self.device_model = value
+                elif key == 'Hostname':
+                    self.device_id = value.split('-')[1].upper()
+                elif key == 'Name':
+                    if self.device_name is None or self.device_name == self.device_id:
+                        self.device_name = value
+                elif key == 'Monitors':
+                    self.num_monitors = int(value)
+                elif key == 'Inverted':
+                    self.inverted = value == 'true'
+        elif name.startswith('MONITOR '):
+            for line in block.lines:
+                key, sep, value = line.partition(':')
+                if not sep:
+                    continue
+                await self.parse_monitor_line(name, line, value.strip(' '))
+            if not self.prelude_parsed and len(self.monitors) == self.num_monitors:
+                self.prelude_parsed = True
     async def parse_monitor_line(self, monitor_name, line, value):
         monitor = None
         for _m in self.monitors:
@@ -333,8 +554,7 @@ class SmartViewTelnetBackendBase(TelnetBackendBase):
         ]
         tx_bfr = bytes('\n'.join(tx_lines), 'UTF-8')
         tx_bfr += b'\n\n'
-        await self.send_to_client(tx_bfr)
-        r = await self.wait_for_ack_or_nak()
+        r = await self.send_and_wait(tx_bfr, 'monitor')
         if r:
             await monitor.set_property_from_backend(name, value)
     def _on_monitors(self, *args, **kwargs):
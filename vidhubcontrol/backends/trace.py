@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import struct
+import time
+
+TRACE_MAGIC = b'VHTR'
+TRACE_VERSION = 1
+
+RX = 0
+TX = 1
+OPEN = 2
+
+DIRECTION_NAMES = {RX:'rx', TX:'tx', OPEN:'open'}
+
+_header = struct.Struct('<4sBd')
+_frame = struct.Struct('<dBI')
+
+class TraceRecorder(object):
+    '''Writes timestamped protocol frames to a binary trace file
+
+    The file begins with a header of ``(b'VHTR', version, start_time)`` where
+    ``start_time`` is the wall-clock time of the recording. Each frame is a
+    ``(timestamp, direction, length)`` header followed by the raw bytes, where
+    ``timestamp`` is in seconds relative to the start of the recording.
+
+    Args:
+        filename (str): The trace file to create
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = open(filename, 'wb')
+        self._start = time.monotonic()
+        self.fp.write(_header.pack(TRACE_MAGIC, TRACE_VERSION, time.time()))
+    def write_frame(self, direction, data):
+        fp = self.fp
+        fp.write(_frame.pack(time.monotonic() - self._start, direction, len(data)))
+        fp.write(data)
+    def record_rx(self, data):
+        self.write_frame(RX, data)
+    def record_tx(self, data):
+        self.write_frame(TX, data)
+    def record_open(self, hostaddr, hostport):
+        self.write_frame(OPEN, bytes('{}:{}'.format(hostaddr, hostport), 'UTF-8'))
+    def flush(self):
+        if self.fp is None:
+            return
+        self.fp.flush()
+    def close(self):
+        if self.fp is None:
+            return
+        self.fp.close()
+        self.fp = None
+
+class TraceBuffer(object):
+    '''Keeps the most recent raw protocol frames in memory
+
+    Frames are stored as-is and only formatted when :meth:`format_lines` is
+    called.
+
+    Args:
+        maxlen (int): Number of frames to keep
+    '''
+    def __init__(self, maxlen=256):
+        self.frames = collections.deque(maxlen=maxlen)
+    @property
+    def maxlen(self):
+        return self.frames.maxlen
+    def append(self, direction, data):
+        self.frames.append((time.time(), direction, data))
+    def clear(self):
+        self.frames.clear()
+    def format_lines(self):
+        '''Get a list of human-readable strings for the buffered frames
+        '''
+        lines = []
+        for timestamp, direction, data in self.frames:
+            lines.append('{:.6f} {} {!r}'.format(
+                timestamp, DIRECTION_NAMES[direction], data,
+            ))
+        return lines
+    def __len__(self):
+        return len(self.frames)
+
+def read_trace(filename):
+    '''Read a trace file written by :class:`TraceRecorder`
+
+    Returns:
+        A tuple of ``(start_time, frames)`` where ``frames`` is a list of
+        ``(timestamp, direction, data)`` tuples
+    '''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic, version, start_time = _header.unpack_from(data)
+    if magic != TRACE_MAGIC:
+        raise ValueError('Not a trace file: {}'.format(filename))
+    if version != TRACE_VERSION:
+        raise ValueError('Unsupported trace version: {}'.format(version))
+    frames = []
+    i = _header.size
+    size = len(data)
+    while i + _frame.size <= size:
+        timestamp, direction, length = _frame.unpack_from(data, i)
+        i += _frame.size
+        frames.append((timestamp, direction, data[i:i+length]))
+        i += length
+    return start_time, frames
+
+def split_sessions(frames):
+    '''Split trace frames into one list per connection
+
+    Timestamps in each session are made relative to its ``OPEN`` frame
+    '''
+    sessions = []
+    session = None
+    for timestamp, direction, data in frames:
+        if direction == OPEN:
+            session = []
+            sessions.append(session)
+            start = timestamp
+            continue
+        if session is None:
+            session = []
+            sessions.append(session)
+            start = 0.
+        session.append((timestamp - start, direction, data))
+    return sessions
+
+class ReplayClient(object):
+    '''Stands in for :class:`vidhubcontrol.aioclient.Client`, feeding
+    recorded data to a backend
+
+    Received frames from the trace are made available at their recorded
+    times (divided by ``speed``). Data written by the backend is collected in
+    :attr:`tx_frames`.
+
+    Args:
+        frames: A list of ``(timestamp, direction, data)`` tuples for a single
+            session (see :func:`split_sessions`)
+        speed (float): Playback speed. If ``None``, frames are fed as fast
+            as they are read
+    '''
+    def __init__(self, frames, host=None, port=None, loop=None, speed=1.):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.frames = frames
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.rx_chunks = []
+        self.tx_frames = []
+        self.eof = False
+        self.read_ready_event = asyncio.Event()
+        self.play_task = None
+    @classmethod
+    def factory(cls, filename, speed=1.):
+        '''Build a ``client_factory`` for a backend from a trace file
+
+        Each connection made by the backend replays the next session in the
+        trace.
+        '''
+        start_time, frames = read_trace(filename)
+        sessions = split_sessions(frames)
+        clients = []
+        def build(host=None, port=None, loop=None):
+            i = len(clients)
+            if i >= len(sessions):
+                raise OSError('No more sessions in trace {}'.format(filename))
+            client = cls(sessions[i], host, port, loop, speed)
+            clients.append(client)
+            return client
+        build.clients = clients
+        return build
+    async def open(self):
+        self.play_task = asyncio.ensure_future(self.play(), loop=self.loop)
+    async def play(self):
+        loop = self.loop
+        speed = self.speed
+        start = loop.time()
+        for timestamp, direction, data in self.frames:
+            if direction != RX:
+                continue
+            if speed:
+                delay = start + timestamp / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)
+            self.rx_chunks.append(data)
+            self.read_ready_event.set()
+    def close(self):
+        if self.play_task is not None:
+            self.play_task.cancel()
+            self.play_task = None
+        self.eof = True
+        self.read_ready_event.set()
+    def abort(self):
+        self.close()
+    async def close_async(self):
+        self.close()
+    async def write(self, bfr):
+        self.tx_frames.append(bfr)
+    async def wait_for_data(self):
+        await self.read_ready_event.wait()
+    def read_nowait(self):
+        data = b''.join(self.rx_chunks)
+        self.rx_chunks = []
+        if not self.eof:
+            self.read_ready_event.clear()
+        return data
@@ -1,4 +1,3 @@
-import os
 import json
 import asyncio
 
@@ -7,6 +6,9 @@ from pydispatch import Dispatcher, Property
 from pydispatch.properties import ListProperty, DictProperty
 
 from vidhubcontrol.discovery import BMDDiscovery
+from vidhubcontrol.storage import STORAGE_TYPES, StateCache, copy_data
+from vidhubcontrol.probe import DiscoveryProbe
+from vidhubcontrol.startup import DeviceStartup, DeviceShutdown
 from vidhubcontrol.backends import (
     DummyBackend,
     SmartViewDummyBackend,
@@ -51,21 +53,52 @@ class Config(ConfigBase):
         self.running = asyncio.Event()
         self.stopped = asyncio.Event()
         self.filename = kwargs.get('filename', self.DEFAULT_FILENAME)
-        if self.loop is None:
+        if self.loop is None or self.loop.is_closed():
             Config.loop = kwargs.get('loop', asyncio.get_event_loop())
+        self.storage = kwargs.get('storage')
+        if self.storage is None:
+            self.storage = self.build_storage(**kwargs)
+        state_filename = kwargs.get('state_cache_filename')
+        if state_filename is None:
+            state_filename = '{}.state'.format(self.filename)
+        self.state_cache = StateCache(state_filename, loop=self.loop)
+        cached_state = self.state_cache.read()
+        # Extra keyword arguments for every backend built (such as
+        # ``trace_buffer_size`` for the telnet backends)
+        self.backend_kwargs = kwargs.get('backend_kwargs', {})
         for key, d in self._device_type_map.items():
             items = kwargs.get(d['prop'], {})
             prop = getattr(self, d['prop'])
             for item_data in items.values():
-                obj = d['cls'](**item_data)
+                obj = d['cls'](
+                    storage=self.storage, auto_connect=False,
+                    backend_kwargs=self.backend_kwargs, **item_data
+                )
                 device_id = obj.device_id
                 if device_id is None:
                     device_id = str(id(obj.backend))
                 prop[device_id] = obj
                 obj.backend.bind(device_id=self.on_backend_device_id)
                 obj.bind(trigger_save=self.on_device_trigger_save)
+                if device_id in cached_state and hasattr(obj.backend, 'load_cached_state'):
+                    obj.backend.load_cached_state(cached_state[device_id])
+                self._bind_backend_state(obj.backend)
+        self.startup = DeviceStartup(
+            loop=self.loop,
+            max_concurrent=kwargs.get('max_concurrent_connects'),
+            connect_timeout=kwargs.get('connect_timeout'),
+        )
+        self.max_concurrent_disconnects = kwargs.get('max_concurrent_disconnects')
+        self.shutdown_timeout = kwargs.get('shutdown_timeout')
+        self.startup_fut = asyncio.ensure_future(
+            self.startup.start([obj.backend for obj in self.iter_devices()]),
+            loop=self.loop,
+        )
         self.discovery_listener = None
-        self.discovery_lock = asyncio.Lock()
+        self.discovery_probe = DiscoveryProbe(
+            loop=self.loop,
+            max_concurrent=kwargs.get('max_concurrent_probes'),
+        )
         self._start_fut = None
         if self.USE_DISCOVERY:
            fut = asyncio.ensure_future(self.start(), loop=self.loop)
@@ -89,18 +122,40 @@ class Config(ConfigBase):
         self.running.set()
     async def stop(self):
         self.running.clear()
+        if not self.startup_fut.done():
+            self.startup_fut.cancel()
+            await asyncio.wait([self.startup_fut])
+        await self.storage.flush()
+        self.storage.close()
+        await self.state_cache.flush()
         if self.discovery_listener is None:
             return
         await self.discovery_listener.stop()
         self.discovery_listener = None
-        for vidhub in self.vidhubs.values():
-            await vidhub.backend.disconnect()
-        for smartview in self.smartviews.values():
-            await smartview.backend.disconnect()
-        for smartscope in self.smartscopes.values():
-            await smartscope.backend.disconnect()
+        await self.discovery_probe.stop()
+        shutdown = DeviceShutdown(
+            loop=self.loop,
+            max_concurrent=self.max_concurrent_disconnects,
+            timeout=self.shutdown_timeout,
+        )
+        await shutdown.stop([obj.backend for obj in self.iter_devices()])
         self.stopped.set()
         Config.loop = None
+    async def wait_ready(self):
+        '''Wait until all configured devices have been connected (or have
+        failed to connect)
+
+        Returns:
+            dict: A :class:`~vidhubcontrol.startup.StartupResult` for each
+            backend
+        '''
+        await self.startup.ready_event.wait()
+        return self.startup.results
+    def iter_devices(self):
+        '''Iterate over the configuration objects for all devices
+        '''
+        for d in self._device_type_map.values():
+            yield from getattr(self, d['prop']).values()
     def build_backend(self, device_type, backend_name, **kwargs):
         prop = getattr(self, self._device_type_map[device_type]['prop'])
         for obj in prop.values():
@@ -111,6 +166,8 @@ class Config(ConfigBase):
             if kwargs.get('hostaddr') is not None and kwargs['hostaddr'] == obj.hostaddr:
                 return obj.backend
         cls = BACKENDS[device_type][backend_name]
+        for key, val in self.backend_kwargs.items():
+            kwargs.setdefault(key, val)
         kwargs['event_loop'] = self.loop
         backend = cls(**kwargs)
         self.add_device(backend)
@@ -127,46 +184,75 @@ class Config(ConfigBase):
         if device_id is None:
             device_id = str(id(backend))
         cls = self._device_type_map[device_type]['cls']
-        prop = getattr(self, self._device_type_map[device_type]['prop'])
+        prop_name = self._device_type_map[device_type]['prop']
+        prop = getattr(self, prop_name)
         obj = cls.from_existing(backend)
         prop[device_id] = obj
         obj.bind(trigger_save=self.on_device_trigger_save)
         backend.bind(device_id=self.on_backend_device_id)
-        self.save()
+        self._bind_backend_state(backend)
+        self.record_change([prop_name, device_id], obj._get_conf_data())
     def on_backend_device_id(self, backend, value, **kwargs):
         if value is None:
             return
-        prop = getattr(self, self._device_type_map[backend.device_type]['prop'])
+        prop_name = self._device_type_map[backend.device_type]['prop']
+        prop = getattr(self, prop_name)
         obj = prop[str(id(backend))]
         obj.device_id = value
         del prop[str(id(backend))]
+        self.record_change([prop_name, str(id(backend))], delete=True)
         if value in prop:
-            self.save()
             return
         prop[value] = obj
-        self.save()
+        self.record_change([prop_name, value], obj._get_conf_data())
+    def _bind_backend_state(self, backend):
+        if not hasattr(backend, 'get_state'):
+            return
+        keys = [
+            'device_model', 'device_version', 'num_outputs', 'num_inputs',
+            'crosspoints', 'output_labels', 'input_labels', 'prelude_parsed',
+            'state_stale',
+        ]
+        backend.bind(**{key:self.on_backend_state for key in keys})
+    def on_backend_state(self, backend, value, **kwargs):
+        if backend.state_stale or not backend.prelude_parsed:
+            return
+        self.state_cache.schedule_save(self.get_state_data)
+    def get_state_data(self):
+        '''Get the state of each vidhub to be stored in :attr:`state_cache`
+        '''
+        data = {}
+        for device_id, obj in self.vidhubs.items():
+            backend = obj.backend
+            if backend.device_id is None or not backend.num_outputs:
+                continue
+            data[backend.device_id] = backend.get_state()
+        return data
     async def add_discovered_device(self, device_type, info, device_id):
-        async with self.discovery_lock:
-            prop = getattr(self, self._device_type_map[device_type]['prop'])
-            cls = None
-            for key, _cls in BACKENDS[device_type].items():
-                if 'Telnet' in key:
-                    cls = _cls
-                    break
-            if device_id in prop:
-                return
-            addr = str(info.address)
-            backend = await cls.create_async(
-                hostaddr=addr,
-                hostport=int(info.port),
-                event_loop=self.loop,
-            )
-            if backend is None:
-                return
-            if backend.device_id != device_id:
-                await backend.disconnect()
-                return
-            self.add_device(backend)
+        prop = getattr(self, self._device_type_map[device_type]['prop'])
+        cls = None
+        for key, _cls in BACKENDS[device_type].items():
+            if 'Telnet' in key:
+                cls = _cls
+                break
+        if device_id in prop:
+            return
+        backend = await self.discovery_probe.probe(
+            (device_type, device_id), cls,
+            hostaddr=str(info.address),
+            hostport=int(info.port),
+            **self.backend_kwargs
+        )
+        if backend is None:
+            return
+        obj = prop.get(backend.device_id)
+        if obj is not None and obj.backend is backend:
+            # Another announcement for the same device was handled first
+            return
+        if backend.device_id != device_id or obj is not None:
+            await backend.disconnect()
+            return
+        self.add_device(backend)
     def on_discovery_service_added(self, info, **kwargs):
         if kwargs.get('class') not in ['Videohub', 'SmartView']:
             return
@@ -179,29 +265,100 @@ class Config(ConfigBase):
             return
         asyncio.ensure_future(self.add_discovered_device(device_type, info, device_id))
     def on_device_trigger_save(self, *args, **kwargs):
-        self.save()
+        obj = kwargs.get('obj')
+        key = kwargs.get('key')
+        if obj is None or key is None:
+            self.save_later()
+            return
+        prop_name = self._device_type_map[obj.device_type]['prop']
+        for device_id, _obj in getattr(self, prop_name).items():
+            if _obj is obj:
+                break
+        else:
+            return
+        self.record_change([prop_name, device_id] + list(key), kwargs.get('value'))
     def save(self, filename=None):
+        '''Write the configuration immediately
+        '''
         if filename is not None:
             self.filename = filename
-        else:
-            filename = self.filename
-        filename = os.path.expanduser(filename)
+            self.storage.filename = filename
+        self.storage.save(self.get_save_data())
+    def save_later(self):
+        '''Schedule the configuration to be written by :attr:`storage`
+
+        Changes made within :attr:`~vidhubcontrol.storage.StorageBase.save_delay`
+        of each other are written together
+        '''
+        self.storage.schedule_save(self.get_save_data)
+    def record_change(self, path, value=None, delete=False):
+        '''Save a single change through :attr:`storage`
+
+        See :meth:`vidhubcontrol.storage.StorageBase.record_change`
+        '''
+        self.storage.record_change(self.get_save_data, path, value, delete)
+    def find_presets(self, name=None, output=None, device_id=None):
+        '''Find vidhub presets by name, stored output or device
+
+        Uses the indexes of :attr:`storage` if available (see
+        :meth:`vidhubcontrol.storage.SqliteStorage.find_presets`), otherwise
+        searches the presets in memory
+
+        Returns:
+            A list of :class:`~vidhubcontrol.backends.base.Preset` objects
+        '''
+        results = self.storage.find_presets(name=name, output=output, device_id=device_id)
+        if results is None:
+            results = []
+            for _device_id, vidhub in self.vidhubs.items():
+                if device_id is not None and _device_id != device_id:
+                    continue
+                for pdata in vidhub.presets:
+                    if name is not None and pdata['name'] != name:
+                        continue
+                    if output is not None and output not in pdata['crosspoints']:
+                        continue
+                    results.append((_device_id, pdata['index']))
+        presets = []
+        for _device_id, index in results:
+            vidhub = self.vidhubs.get(_device_id)
+            if vidhub is None:
+                continue
+            vidhub.backend.load_presets()
+            if index >= len(vidhub.backend.presets):
+                continue
+            presets.append(vidhub.backend.presets[index])
+        return presets
+    def get_save_data(self):
+        '''Get a copy of the configuration data as plain objects
+        '''
         data = self._get_conf_data()
-        if not os.path.exists(os.path.dirname(filename)):
-            os.makedirs(os.path.dirname(filename))
-        s = jsonfactory.dumps(data, indent=4)
-        with open(filename, 'w') as f:
-            f.write(s)
+        for d in self._device_type_map.values():
+            data[d['prop']] = {
+                key:obj._get_conf_data() for key, obj in data[d['prop']].items()
+            }
+        return copy_data(data)
+    @classmethod
+    def build_storage(cls, **kwargs):
+        '''Create the storage object given by the ``storage_type`` keyword
+        argument (one of :data:`vidhubcontrol.storage.STORAGE_TYPES`)
+        '''
+        filename = kwargs.get('filename', cls.DEFAULT_FILENAME)
+        storage_cls = STORAGE_TYPES[kwargs.get('storage_type', 'json')]
+        skwargs = {'loop':kwargs.get('loop')}
+        for key in ['save_delay', 'compact_threshold']:
+            if kwargs.get(key) is not None:
+                skwargs[key] = kwargs[key]
+        return storage_cls(filename, **skwargs)
     @classmethod
     def load(cls, filename=None, **kwargs):
         if filename is None:
             filename = cls.DEFAULT_FILENAME
         kwargs['filename'] = filename
-        filename = os.path.expanduser(filename)
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                s = f.read()
-            kwargs.update(jsonfactory.loads(s))
+        storage = kwargs.get('storage')
+        if storage is None:
+            storage = kwargs['storage'] = cls.build_storage(**kwargs)
+        kwargs.update(storage.read())
         return cls(**kwargs)
 
 class DeviceConfigBase(ConfigBase):
@@ -223,7 +380,12 @@ class DeviceConfigBase(ConfigBase):
             setattr(self, attr, kwargs.get(attr))
         self.backend = kwargs.get('backend')
         if self.backend is None:
-            self.backend = self.build_backend(**self._get_conf_data())
+            bkwargs = self._get_conf_data()
+            for key, val in kwargs.get('backend_kwargs', {}).items():
+                bkwargs.setdefault(key, val)
+            self.backend = self.build_backend(
+                auto_connect=kwargs.get('auto_connect', True), **bkwargs
+            )
         if self.backend.device_name != self.device_name:
             self.device_name = self.backend.device_name
         self.backend.bind(device_name=self.on_backend_prop_change)
@@ -253,7 +415,7 @@ class DeviceConfigBase(ConfigBase):
     def on_backend_prop_change(self, instance, value, **kwargs):
         prop = kwargs.get('property')
         setattr(self, prop.name, value)
-        self.emit('trigger_save')
+        self.emit('trigger_save', obj=self, key=[prop.name], value=value)
 
 class VidhubConfig(DeviceConfigBase):
     presets = ListProperty()
@@ -262,12 +424,22 @@ class VidhubConfig(DeviceConfigBase):
     ]
     device_type = 'vidhub'
     def __init__(self, **kwargs):
-        kwargs.setdefault('presets', [])
+        self._preset_storage = None
+        if kwargs.get('presets') is None:
+            # Storage types that keep presets apart from the device data
+            # (SqliteStorage) are read by the backend's preset_loader when
+            # the device connects or its presets are first used
+            kwargs['presets'] = []
+            if kwargs.get('backend') is None:
+                self._preset_storage = kwargs.get('storage')
         super().__init__(**kwargs)
         pkwargs = {k:self.on_preset_update for k in ['name', 'crosspoints']}
         for preset in self.backend.presets:
             preset.bind(**pkwargs)
-        self.backend.bind(on_preset_added=self.on_preset_added)
+        self.backend.bind(
+            on_preset_added=self.on_preset_added,
+            on_presets_loaded=self.on_presets_loaded,
+        )
         if hasattr(self.backend, 'hostport'):
             self.backend.bind(
                 hostaddr=self.on_backend_prop_change,
@@ -284,26 +456,48 @@ class VidhubConfig(DeviceConfigBase):
             ))
         return super().from_existing(backend, **kwargs)
     def build_backend(self, cls=None, **kwargs):
-        kwargs['presets'] = kwargs['presets'][:]
+        kwargs['presets'] = kwargs.get('presets', [])[:]
+        if self._preset_storage is not None:
+            kwargs['preset_loader'] = self.read_stored_presets
         return super().build_backend(cls, **kwargs)
+    def read_stored_presets(self):
+        '''Read the presets for this device from :attr:`storage` (used as the
+        backend's ``preset_loader``)
+        '''
+        storage = self._preset_storage
+        self._preset_storage = None
+        presets = storage.read_presets(self.device_id)
+        self.presets = presets
+        return presets[:]
+    def on_presets_loaded(self, *args, **kwargs):
+        pkwargs = {k:self.on_preset_update for k in ['name', 'crosspoints']}
+        for preset in kwargs.get('presets'):
+            preset.bind(**pkwargs)
     def on_preset_added(self, *args, **kwargs):
         preset = kwargs.get('preset')
-        self.presets.append(dict(
+        pdata = dict(
             name=preset.name,
             index=preset.index,
             crosspoints=preset.crosspoints.copy(),
-        ))
+        )
+        self.presets.append(pdata)
         bkwargs = {k:self.on_preset_update for k in ['name', 'crosspoints']}
-        self.emit('trigger_save')
+        self.emit('trigger_save', obj=self, key=['presets', preset.index], value=pdata)
         preset.bind(**bkwargs)
     def on_preset_update(self, instance, value, **kwargs):
         prop = kwargs.get('property')
         if prop.name == 'crosspoints':
             value = value.copy()
         self.presets[instance.index][prop.name] = value
-        self.emit('trigger_save')
+        self.emit(
+            'trigger_save', obj=self, key=['presets', instance.index, prop.name], value=value,
+        )
     def _get_conf_data(self):
         d = super()._get_conf_data()
+        if self._preset_storage is not None:
+            # Not loaded yet, so the stored presets are left as they are
+            del d['presets']
+            return d
         for pdata in d['presets']:
             if 'backend' in pdata:
                 del pdata['backend']
@@ -1,5 +1,7 @@
 import asyncio
 import ipaddress
+import logging
+import concurrent.futures
 
 from pydispatch import Dispatcher, Property
 from pydispatch.properties import DictProperty
@@ -13,6 +15,8 @@ except ImportError: # pragma: no cover
 
 from vidhubcontrol.utils import find_ip_addresses
 
+logger = logging.getLogger(__name__)
+
 PUBLISH_TTL = 60
 
 def convert_bytes_dict(d):
@@ -59,9 +63,21 @@ class ServiceInfo(Dispatcher):
         name = kwargs.pop('name')
         return zeroconf.ServiceInfo(type_, name, **kwargs)
     def update(self, other):
+        '''Update from another instance with the same :attr:`id`
+
+        Only the values that differ are changed
+        '''
+        for attr in ['server', 'address', 'port']:
+            val = getattr(other, attr)
+            if val is not None and val != getattr(self, attr):
+                setattr(self, attr, val)
         if self.properties == other.properties:
             return
-        self.properties = other.properties.copy()
+        for key in set(self.properties.keys()) - set(other.properties.keys()):
+            del self.properties[key]
+        for key, val in other.properties.items():
+            if self.properties.get(key) != val:
+                self.properties[key] = val
     def __hash__(self):
         return hash(self.id)
     def __eq__(self, other):
@@ -91,6 +107,16 @@ class PublishMessage(Message):
         self.ttl = ttl
 
 class Listener(Dispatcher):
+    '''Browses for zeroconf services
+
+    Services are resolved concurrently in an executor with at most
+    :attr:`RESOLVE_WORKERS` threads. Resolved services are cached for
+    :attr:`RESOLVE_CACHE_TTL` seconds so they are not resolved again if they
+    are announced within that time. The cached entry is discarded when the
+    service is removed.
+    '''
+    RESOLVE_WORKERS = 4
+    RESOLVE_CACHE_TTL = 60.
     _events_ = ['service_added', 'service_removed']
     services = DictProperty()
     def __init__(self, mainloop, service_type):
@@ -101,7 +127,13 @@ class Listener(Dispatcher):
         self.message_queue = asyncio.Queue()
         self.zeroconf = None
         self.published_services = {}
+        self.resolve_executor = None
+        self.resolve_tasks = {}
+        self.resolve_cache = {}
     async def start(self):
+        self.resolve_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.RESOLVE_WORKERS,
+        )
         await self.mainloop.run_in_executor(None, self.run_zeroconf)
         self.running = True
         self.run_future = asyncio.ensure_future(self.run(), loop=self.mainloop)
@@ -128,7 +160,14 @@ class Listener(Dispatcher):
                     None, self.zeroconf.register_service,
                     zc_info, msg.ttl,
                 )
+        tasks = list(self.resolve_tasks.values())
+        self.resolve_tasks.clear()
+        for t in tasks:
+            t.cancel()
+        if len(tasks):
+            await asyncio.wait(tasks)
         await self.mainloop.run_in_executor(None, self.stop_zeroconf)
+        self.resolve_executor.shutdown(wait=False)
         self.stopped.set()
     async def stop(self):
         if not self.running:
@@ -154,14 +193,52 @@ class Listener(Dispatcher):
         del self.services[info.id]
         self.emit('service_removed', info, **kwargs)
     def remove_service(self, zc, type_, name):
+        self.mainloop.call_soon_threadsafe(self.cancel_resolve, type_, name)
         info = ServiceInfo(type=type_, name=name)
         msg = RemovedMessage(info)
         asyncio.run_coroutine_threadsafe(self.add_message(msg), loop=self.mainloop)
     def add_service(self, zc, type_, name):
-        info = zc.get_service_info(type_, name)
-        info = ServiceInfo.from_zc_info(info)
-        msg = AddedMessage(info)
-        asyncio.run_coroutine_threadsafe(self.add_message(msg), loop=self.mainloop)
+        # Called from the zeroconf thread. Resolution is done by start_resolve
+        # so this thread is not blocked
+        self.mainloop.call_soon_threadsafe(self.start_resolve, zc, type_, name)
+    def start_resolve(self, zc, type_, name):
+        '''Resolve an announced service (unless it is cached or already
+        being resolved) and add it
+        '''
+        key = (type_, name)
+        cached = self.resolve_cache.get(key)
+        if cached is not None:
+            ts, info = cached
+            if self.mainloop.time() - ts < self.RESOLVE_CACHE_TTL:
+                self.message_queue.put_nowait(AddedMessage(info))
+                return
+            del self.resolve_cache[key]
+        if key in self.resolve_tasks:
+            return
+        self.resolve_tasks[key] = asyncio.ensure_future(
+            self.resolve_service(zc, type_, name), loop=self.mainloop,
+        )
+    def cancel_resolve(self, type_, name):
+        key = (type_, name)
+        self.resolve_cache.pop(key, None)
+        t = self.resolve_tasks.pop(key, None)
+        if t is not None:
+            t.cancel()
+    async def resolve_service(self, zc, type_, name):
+        key = (type_, name)
+        try:
+            zc_info = await self.mainloop.run_in_executor(
+                self.resolve_executor, zc.get_service_info, type_, name,
+            )
+        finally:
+            if self.resolve_tasks.get(key) is asyncio.current_task():
+                del self.resolve_tasks[key]
+        if zc_info is None:
+            logger.debug('Could not resolve {}'.format(name))
+            return
+        info = ServiceInfo.from_zc_info(zc_info)
+        self.resolve_cache[info.id] = (self.mainloop.time(), info)
+        await self.add_message(AddedMessage(info))
     async def get_local_ifaces(self, refresh=False):
         ifaces = getattr(self, '_local_ifaces', None)
         if ifaces is not None and not refresh:
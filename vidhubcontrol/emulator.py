@@ -0,0 +1,465 @@
+#! /usr/bin/env python
+'''Emulated Videohub and SmartView/SmartScope devices
+
+Each emulator is an asyncio TCP server speaking the device's Ethernet
+control protocol, for load testing and development without hardware.
+
+Run ``vidhubcontrol-emulator --help`` for usage.
+'''
+
+import asyncio
+import argparse
+import logging
+import random
+
+from vidhubcontrol.backends.parser import BlockParser
+
+logger = logging.getLogger(__name__)
+
+class EmulatorBase(object):
+    '''Base class for emulated devices
+
+    Args:
+        device_id (str, optional): The unique id (12 hex digits). A random one
+            is generated if not given
+        ack_latency (float): Delay in seconds before each response
+        ack_jitter (float): Random amount (+/-) added to ``ack_latency``
+        nak_rate (float): Probability (0 to 1) that a valid command is
+            rejected with NAK
+        change_rate (float): Average number of unsolicited changes per second
+            (as if made from the front panel or another client)
+        preamble (bytes, optional): A device preamble (in the format of the
+            ``tests/*-preamble.txt`` files) to load the initial state from
+        loop: The event loop. If not given, the running loop is used when
+            :meth:`start` is called
+    '''
+    DEFAULT_PORT = None
+    protocol_version = None
+    def __init__(self, **kwargs):
+        self.loop = kwargs.get('loop')
+        device_id = kwargs.get('device_id')
+        if device_id is None:
+            device_id = '{:012x}'.format(random.getrandbits(48))
+        self.device_id = device_id
+        self.ack_latency = kwargs.get('ack_latency', 0.)
+        self.ack_jitter = kwargs.get('ack_jitter', 0.)
+        self.nak_rate = kwargs.get('nak_rate', 0.)
+        self.change_rate = kwargs.get('change_rate', 0.)
+        self.server = None
+        self.clients = set()
+        self.change_task = None
+        self.num_commands = 0
+    async def start(self, host='127.0.0.1', port=None):
+        if port is None:
+            port = self.DEFAULT_PORT
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        if self.change_rate:
+            self.change_task = asyncio.ensure_future(self.change_loop(), loop=self.loop)
+        logger.info('{} listening on {}:{}'.format(self, host, port))
+    async def stop(self):
+        if self.change_task is not None:
+            self.change_task.cancel()
+            await asyncio.wait([self.change_task])
+            self.change_task = None
+        if self.server is None:
+            return
+        self.server.close()
+        for writer in list(self.clients):
+            writer.close()
+        await self.server.wait_closed()
+        self.server = None
+    async def handle_client(self, reader, writer):
+        parser = BlockParser()
+        self.clients.add(writer)
+        writer.write(self.build_preamble())
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for block in parser.feed(data):
+                    await self.handle_block(block, writer)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+    async def handle_block(self, block, writer):
+        self.num_commands += 1
+        delay = self.ack_latency
+        if self.ack_jitter:
+            delay += random.uniform(-self.ack_jitter, self.ack_jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if block.name == 'PING':
+            writer.write(b'ACK\n\n')
+            return
+        if not len(block.lines):
+            response = self.build_block(block.name)
+            if response is None:
+                writer.write(b'NAK\n\n')
+            else:
+                writer.write(b'ACK\n\n' + response)
+            return
+        if self.nak_rate and random.random() < self.nak_rate:
+            writer.write(b'NAK\n\n')
+            return
+        changed = self.apply_block(block)
+        if changed is None:
+            writer.write(b'NAK\n\n')
+            return
+        writer.write(b'ACK\n\n')
+        if len(changed):
+            self.broadcast(self.encode_block(block.name, changed))
+    def broadcast(self, data):
+        for writer in self.clients:
+            writer.write(data)
+    async def change_loop(self):
+        while True:
+            await asyncio.sleep(random.expovariate(self.change_rate))
+            r = self.make_random_change()
+            if r is not None:
+                self.broadcast(self.encode_block(*r))
+    def encode_block(self, name, lines):
+        lines = ['{}:'.format(name)] + list(lines)
+        return bytes('\n'.join(lines), 'UTF-8') + b'\n\n'
+    def build_preamble(self):
+        blocks = [self.encode_block('PROTOCOL PREAMBLE', [
+            'Version: {}'.format(self.protocol_version),
+        ])]
+        blocks.extend(self.build_state_blocks())
+        blocks.append(b'END PRELUDE:\n\n')
+        return b''.join(blocks)
+    def load_preamble(self, data):
+        '''Set the device state from the blocks in a preamble
+        '''
+        parser = BlockParser()
+        for block in parser.feed(data):
+            if block.name == 'PROTOCOL PREAMBLE':
+                for key, value in block.iter_items():
+                    if key == 'Version':
+                        self.protocol_version = value
+            else:
+                self.load_block(block)
+    def load_block(self, block):
+        raise NotImplementedError()
+    def build_state_blocks(self):
+        raise NotImplementedError()
+    def build_block(self, name):
+        '''Encode the current state for a block name (for queries)
+
+        Returns ``None`` if the name is not recognized
+        '''
+        raise NotImplementedError()
+    def apply_block(self, block):
+        '''Apply a command block to the current state
+
+        Returns:
+            A list of the changed lines (as they would be sent by the device),
+            or ``None`` if the command is invalid
+        '''
+        raise NotImplementedError()
+    def make_random_change(self):
+        '''Change something at random
+
+        Returns:
+            A tuple of ``(block_name, changed_lines)`` or ``None``
+        '''
+        raise NotImplementedError()
+    def __str__(self):
+        return '{} ({})'.format(self.__class__.__name__, self.device_id)
+
+class VidhubEmulator(EmulatorBase):
+    '''An emulated Smart Videohub
+
+    Args:
+        num_inputs (int): Number of inputs
+        num_outputs (int): Number of outputs
+        model_name (str, optional): Defaults to ``'Smart Videohub {inputs}x{outputs}'``
+    '''
+    DEFAULT_PORT = 9990
+    protocol_version = '2.7'
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.num_inputs = kwargs.get('num_inputs', 12)
+        self.num_outputs = kwargs.get('num_outputs', 12)
+        model_name = kwargs.get('model_name')
+        if model_name is None:
+            model_name = 'Smart Videohub {}x{}'.format(self.num_inputs, self.num_outputs)
+        self.model_name = model_name
+        self.input_labels = ['Input {}'.format(i+1) for i in range(self.num_inputs)]
+        self.output_labels = ['Output {}'.format(i+1) for i in range(self.num_outputs)]
+        self.crosspoints = [0] * self.num_outputs
+        self.output_locks = ['U'] * self.num_outputs
+        preamble = kwargs.get('preamble')
+        if preamble is not None:
+            self.load_preamble(preamble)
+    def load_block(self, block):
+        if block.name == 'VIDEOHUB DEVICE':
+            for key, value in block.iter_items():
+                if key == 'Model name':
+                    self.model_name = value
+                elif key == 'Unique ID':
+                    self.device_id = value
+                elif key == 'Video inputs':
+                    self.num_inputs = int(value)
+                    self.input_labels = ['Input {}'.format(i+1) for i in range(self.num_inputs)]
+                elif key == 'Video outputs':
+                    self.num_outputs = int(value)
+                    self.output_labels = ['Output {}'.format(i+1) for i in range(self.num_outputs)]
+                    self.crosspoints = [0] * self.num_outputs
+                    self.output_locks = ['U'] * self.num_outputs
+        elif block.name in self.sections:
+            self.apply_block(block)
+    @property
+    def sections(self):
+        return {
+            'INPUT LABELS':self.input_labels,
+            'OUTPUT LABELS':self.output_labels,
+            'VIDEO OUTPUT LOCKS':self.output_locks,
+            'VIDEO OUTPUT ROUTING':self.crosspoints,
+        }
+    def build_state_blocks(self):
+        blocks = [self.encode_block('VIDEOHUB DEVICE', [
+            'Device present: true',
+            'Model name: {}'.format(self.model_name),
+            'Friendly name: {}'.format(self.model_name),
+            'Unique ID: {}'.format(self.device_id),
+            'Video inputs: {}'.format(self.num_inputs),
+            'Video processing units: 0',
+            'Video outputs: {}'.format(self.num_outputs),
+            'Video monitoring outputs: 0',
+            'Serial ports: 0',
+        ])]
+        for name in ['INPUT LABELS', 'OUTPUT LABELS', 'VIDEO OUTPUT LOCKS', 'VIDEO OUTPUT ROUTING']:
+            blocks.append(self.build_block(name))
+        blocks.append(self.encode_block('CONFIGURATION', ['Take Mode: true']))
+        return blocks
+    def build_block(self, name):
+        values = self.sections.get(name)
+        if values is None:
+            return None
+        return self.encode_block(name, ('{} {}'.format(i, v) for i, v in enumerate(values)))
+    def apply_block(self, block):
+        values = self.sections.get(block.name)
+        if values is None:
+            return None
+        items = list(block.iter_indexed())
+        if len(items) != len(block.lines):
+            return None
+        if block.name == 'VIDEO OUTPUT ROUTING':
+            try:
+                items = [(i, int(v)) for i, v in items]
+            except ValueError:
+                return None
+            num_values = self.num_inputs
+        else:
+            num_values = None
+        for i, v in items:
+            if i >= len(values):
+                return None
+            if num_values is not None and v >= num_values:
+                return None
+        changed = []
+        for i, v in items:
+            values[i] = v
+            changed.append('{} {}'.format(i, v))
+        return changed
+    def make_random_change(self):
+        out_idx = random.randrange(self.num_outputs)
+        in_idx = random.randrange(self.num_inputs)
+        self.crosspoints[out_idx] = in_idx
+        return 'VIDEO OUTPUT ROUTING', ['{} {}'.format(out_idx, in_idx)]
+
+class SmartViewEmulator(EmulatorBase):
+    '''An emulated SmartView monitor
+
+    Args:
+        num_monitors (int): Number of monitors
+        model_name (str, optional): The model name
+    '''
+    DEFAULT_PORT = 9991
+    protocol_version = '1.3'
+    default_model_name = 'SmartView Duo'
+    monitor_defaults = [
+        ('Brightness', '255'),
+        ('Contrast', '128'),
+        ('Saturation', '128'),
+        ('Identify', 'false'),
+        ('Border', 'None'),
+        ('WidescreenSD', 'auto'),
+        ('AudioChannel', '0'),
+    ]
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.num_monitors = kwargs.get('num_monitors', 2)
+        self.model_name = kwargs.get('model_name', self.default_model_name)
+        self.monitors = {}
+        for i in range(self.num_monitors):
+            name = 'MONITOR {}'.format(chr(ord('A') + i))
+            self.monitors[name] = self.monitor_defaults[:]
+        preamble = kwargs.get('preamble')
+        if preamble is not None:
+            self.load_preamble(preamble)
+    def load_block(self, block):
+        if block.name == 'SMARTVIEW DEVICE':
+            for key, value in block.iter_items():
+                if key == 'Model':
+                    self.model_name = value
+                elif key == 'Hostname':
+                    self.device_id = value.split('-')[-1]
+                elif key == 'Monitors':
+                    self.num_monitors = int(value)
+                    self.monitors = {}
+        elif block.name.startswith('MONITOR '):
+            self.monitors[block.name] = list(block.iter_items())
+    def build_state_blocks(self):
+        hostname = '{}-{}'.format(self.model_name.replace(' ', ''), self.device_id)
+        blocks = [self.encode_block('SMARTVIEW DEVICE', [
+            'Model: {}'.format(self.model_name),
+            'Hostname: {}'.format(hostname),
+            'Name: {}'.format(self.model_name),
+            'Monitors: {}'.format(self.num_monitors),
+            'Inverted: false',
+        ])]
+        for name in sorted(self.monitors.keys()):
+            blocks.append(self.build_block(name))
+        return blocks
+    def build_block(self, name):
+        monitor = self.monitors.get(name)
+        if monitor is None:
+            return None
+        return self.encode_block(name, ('{}: {}'.format(k, v) for k, v in monitor))
+    def apply_block(self, block):
+        monitor = self.monitors.get(block.name)
+        if monitor is None:
+            return None
+        keys = [k for k, v in monitor]
+        items = list(block.iter_items())
+        if len(items) != len(block.lines):
+            return None
+        for key, value in items:
+            if key not in keys:
+                return None
+        changed = []
+        for key, value in items:
+            monitor[keys.index(key)] = (key, value)
+            changed.append('{}: {}'.format(key, value))
+        return changed
+    def make_random_change(self):
+        name = random.choice(sorted(self.monitors.keys()))
+        monitor = self.monitors[name]
+        value = str(random.randrange(256))
+        monitor[0] = ('Brightness', value)
+        return name, ['Brightness: {}'.format(value)]
+
+class SmartScopeEmulator(SmartViewEmulator):
+    '''An emulated SmartScope Duo
+    '''
+    DEFAULT_PORT = 9992
+    default_model_name = 'SmartScope Duo 4K'
+    monitor_defaults = SmartViewEmulator.monitor_defaults[:-1] + [
+        ('ScopeMode', 'WaveformLuma'),
+        ('AudioChannel', '0'),
+    ]
+
+EMULATOR_CLASSES = {
+    'vidhub':VidhubEmulator,
+    'smartview':SmartViewEmulator,
+    'smartscope':SmartScopeEmulator,
+}
+
+def parse_args(args=None):
+    p = argparse.ArgumentParser(description='Run emulated Blackmagic devices')
+    p.add_argument('device_type', choices=sorted(EMULATOR_CLASSES.keys()),
+        help='The type of device to emulate')
+    p.add_argument('--host', dest='host', default='127.0.0.1',
+        help='Host address to listen on')
+    p.add_argument('--port', dest='port', type=int,
+        help='Port for the first device. Defaults to the standard port for the device type')
+    p.add_argument('-n', '--count', dest='count', type=int, default=1,
+        help='Number of devices to run (on consecutive ports)')
+    p.add_argument('--inputs', dest='num_inputs', type=int, default=12,
+        help='Number of inputs (vidhub)')
+    p.add_argument('--outputs', dest='num_outputs', type=int, default=12,
+        help='Number of outputs (vidhub)')
+    p.add_argument('--monitors', dest='num_monitors', type=int, default=2,
+        help='Number of monitors (smartview/smartscope)')
+    p.add_argument('--preamble', dest='preamble_filename',
+        help='Load the initial device state from a preamble file')
+    p.add_argument('--ack-latency', dest='ack_latency', type=float, default=0.,
+        help='Response delay in seconds')
+    p.add_argument('--ack-jitter', dest='ack_jitter', type=float, default=0.,
+        help='Random (+/-) variation of the response delay in seconds')
+    p.add_argument('--nak-rate', dest='nak_rate', type=float, default=0.,
+        help='Probability (0 to 1) of rejecting a command')
+    p.add_argument('--change-rate', dest='change_rate', type=float, default=0.,
+        help='Unsolicited changes per second')
+    return p.parse_args(args)
+
+def offset_device_id(device_id, offset):
+    '''Get a device id offset from the given one, keeping its length and case
+
+    Used to give each emulator built from the same preamble its own id.
+    A random id is returned if ``device_id`` is not hexadecimal
+    '''
+    try:
+        value = int(device_id, 16)
+    except (TypeError, ValueError):
+        return '{:012x}'.format(random.getrandbits(48))
+    width = len(device_id)
+    result = '{:0{}x}'.format((value + offset) % (16 ** width), width)
+    if device_id == device_id.upper():
+        result = result.upper()
+    return result
+
+def build_emulators(opts, loop=None):
+    cls = EMULATOR_CLASSES[opts.device_type]
+    port = opts.port
+    if port is None:
+        port = cls.DEFAULT_PORT
+    preamble = None
+    if opts.preamble_filename is not None:
+        with open(opts.preamble_filename, 'rb') as f:
+            preamble = f.read()
+    emulators = []
+    for i in range(opts.count):
+        emulator = cls(
+            num_inputs=opts.num_inputs,
+            num_outputs=opts.num_outputs,
+            num_monitors=opts.num_monitors,
+            ack_latency=opts.ack_latency,
+            ack_jitter=opts.ack_jitter,
+            nak_rate=opts.nak_rate,
+            change_rate=opts.change_rate,
+            preamble=preamble,
+            loop=loop,
+        )
+        if preamble is not None and i > 0:
+            # The preamble sets the same Unique ID on each of them
+            emulator.device_id = offset_device_id(emulator.device_id, i)
+        emulators.append((emulator, port + i))
+    return emulators
+
+def main(args=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s\t%(name)s\t%(levelname)s\t%(message)s',
+    )
+    opts = parse_args(args)
+    loop = asyncio.get_event_loop()
+    emulators = build_emulators(opts, loop)
+    for emulator, port in emulators:
+        loop.run_until_complete(emulator.start(opts.host, port))
+    logger.info('Running. Press CTRL+c to exit')
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    for emulator, port in emulators:
+        loop.run_until_complete(emulator.stop())
+
+if __name__ == '__main__':
+    main()
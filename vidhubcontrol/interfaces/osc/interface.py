@@ -5,8 +5,10 @@ from pydispatch import Dispatcher, Property
 from pydispatch.properties import DictProperty
 
 from vidhubcontrol.utils import find_ip_addresses
+from vidhubcontrol.backends.base import get_index_keys
+from vidhubcontrol.salvo import Salvo
 from .node import OscNode, PubSubOscNode
-from .server import OSCUDPServer, OscDispatcher
+from .server import OSCUDPServer, OscDispatcher, timetag_callback
 
 
 class OscInterface(Dispatcher):
@@ -59,12 +61,15 @@ class OscInterface(Dispatcher):
             cls=PubSubOscNode,
             published_property=(self, 'vidhubs_by_name'),
         )
+        vidhub_node.add_child('find-presets', cls=FindPresetsNode, interface=self)
+        self.root_node.add_child('salvo', cls=SalvoNode, interface=self)
         # self.root_node.add_child('vidhubs/_update')
         # subscribe_node = self.root_node.add_child('vidhubs/_subscribe')
         # query_node = self.root_node.add_child('vidhubs/_query')
         # query_node.bind(on_message_received=self.on_vidhub_query_message)
     async def add_vidhub(self, vidhub):
-        await vidhub.connect_fut
+        if not vidhub.state_stale:
+            await vidhub.connect_fut
         if vidhub.device_id in self.vidhubs:
             return
         node = VidhubNode(vidhub, use_device_id=True)
@@ -117,6 +122,72 @@ class OscInterface(Dispatcher):
             asyncio.ensure_future(self.add_vidhub(vidhub), loop=self.event_loop)
 
 
+class FindPresetsNode(OscNode):
+    '''Searches the presets of all configured vidhubs
+
+    Arguments are pairs of ``field, value`` where ``field`` is one of
+    ``"name"``, ``"output"`` or ``"device_id"``
+    (see :meth:`vidhubcontrol.config.Config.find_presets`). Responds with
+    pairs of ``device_id, preset_index``, which can be sent as-is to
+    :class:`SalvoNode`. There are no results without a config
+    '''
+    FIELDS = ['name', 'output', 'device_id']
+    def __init__(self, name, parent, **kwargs):
+        super().__init__(name, parent, **kwargs)
+        self.interface = kwargs.get('interface')
+    def on_osc_dispatcher_message(self, osc_address, client_address, *messages):
+        config = self.interface.config
+        fkwargs = {}
+        for field, value in zip(messages[::2], messages[1::2]):
+            if field in self.FIELDS:
+                fkwargs[field] = value
+        response = []
+        if config is not None:
+            for preset in config.find_presets(**fkwargs):
+                response.extend([preset.backend.device_id, preset.index])
+        self.ensure_message(client_address, *response)
+        super().on_osc_dispatcher_message(osc_address, client_address, *messages)
+
+class SalvoNode(OscNode):
+    '''Recalls presets on multiple vidhubs at once
+
+    Arguments are pairs of ``device_id, preset_index``. Unknown devices or
+    presets are ignored. Responds with the device ids and whether each
+    succeeded, followed by the skew (in seconds) between device responses
+
+    If the message is in a bundle with a future timetag, the salvo is built
+    and encoded when the message arrives and only sent at the timetag
+    '''
+    def __init__(self, name, parent, **kwargs):
+        super().__init__(name, parent, **kwargs)
+        self.interface = kwargs.get('interface')
+    @timetag_callback
+    def on_osc_dispatcher_message(self, osc_address, client_address, *messages, when=None):
+        presets = []
+        for device_id, i in zip(messages[::2], messages[1::2]):
+            vidhub = self.interface.vidhubs.get(device_id)
+            if vidhub is None:
+                continue
+            try:
+                presets.append(vidhub.presets[i])
+            except (IndexError, TypeError):
+                continue
+        if len(presets):
+            salvo = Salvo.from_presets(presets)
+            salvo.prepare()
+            asyncio.ensure_future(
+                self.fire_salvo(salvo, client_address, when),
+                loop=self.event_loop,
+            )
+        super().on_osc_dispatcher_message(osc_address, client_address, *messages)
+    async def fire_salvo(self, salvo, client_address, when=None):
+        result = await salvo.fire(when)
+        response = []
+        for backend, r in result.results.items():
+            response.extend([backend.device_id, r])
+        response.append(result.skew)
+        await self.send_message(client_address, *response)
+
 class VidhubNode(PubSubOscNode):
     _info_properties = [
         ('device_id', 'id'),
@@ -125,6 +196,7 @@ class VidhubNode(PubSubOscNode):
         ('device_version', 'version'),
         ('num_outputs', 'num_outputs'),
         ('num_inputs', 'num_inputs'),
+        ('state_stale', 'stale'),
     ]
     device_info = DictProperty()
     def __init__(self, vidhub, use_device_id=True):
@@ -147,7 +219,76 @@ class VidhubNode(PubSubOscNode):
         self.label_node.add_child('output', cls=VidhubLabelNode, vidhub=vidhub)
         self.crosspoint_node = self.add_child('crosspoints', cls=VidhubCrosspointNode, vidhub=vidhub)
         self.preset_node = self.add_child('presets', cls=VidhubPresetGroupNode, vidhub=vidhub)
+        self.trace_node = self.add_child('trace', cls=VidhubTraceNode, vidhub=vidhub)
+        self.add_child('routes-by-input', cls=VidhubRoutesByInputNode, vidhub=vidhub)
+
+class VidhubRoutesByInputNode(OscNode):
+    '''Responds with the outputs currently routed from an input
 
+    The input index is given as the argument. The response is the input
+    index followed by the output indices (in ascending order)
+    '''
+    def __init__(self, name, parent, **kwargs):
+        super().__init__(name, parent, **kwargs)
+        self.vidhub = kwargs.get('vidhub')
+    def on_osc_dispatcher_message(self, osc_address, client_address, *messages):
+        if len(messages) and isinstance(messages[0], int):
+            in_idx = messages[0]
+            outputs = sorted(self.vidhub.routing_table.get_outputs(in_idx))
+            self.ensure_message(client_address, in_idx, *outputs)
+        super().on_osc_dispatcher_message(osc_address, client_address, *messages)
+
+class VidhubTraceNode(OscNode):
+    '''Responds with the most recent protocol frames from the device
+
+    An optional integer argument sets the number of frames (default 16).
+    A count of zero responds with no frames.
+
+    Tracing is enabled or resized on a running backend through the ``size``
+    child node (see :class:`VidhubTraceSizeNode`)
+    '''
+    DEFAULT_COUNT = 16
+    def __init__(self, name, parent, **kwargs):
+        super().__init__(name, parent, **kwargs)
+        self.vidhub = kwargs.get('vidhub')
+        self.add_child('size', cls=VidhubTraceSizeNode, vidhub=self.vidhub)
+    def on_osc_dispatcher_message(self, osc_address, client_address, *messages):
+        count = self.DEFAULT_COUNT
+        if len(messages) and isinstance(messages[0], int):
+            count = messages[0]
+        dump_trace = getattr(self.vidhub, 'dump_trace', None)
+        if dump_trace is None or count <= 0:
+            lines = []
+        else:
+            lines = dump_trace()[-count:]
+        self.ensure_message(client_address, *lines)
+        super().on_osc_dispatcher_message(osc_address, client_address, *messages)
+
+class VidhubTraceSizeNode(OscNode):
+    '''Sets the number of frames kept in the backend's trace buffer
+
+    An integer argument enables tracing with that many frames (or disables
+    it if zero). Responds with the current size, which is zero if tracing is
+    disabled or not supported by the backend
+    '''
+    def __init__(self, name, parent, **kwargs):
+        super().__init__(name, parent, **kwargs)
+        self.vidhub = kwargs.get('vidhub')
+    def on_osc_dispatcher_message(self, osc_address, client_address, *messages):
+        enable_trace = getattr(self.vidhub, 'enable_trace', None)
+        if enable_trace is not None and len(messages) and isinstance(messages[0], int):
+            size = messages[0]
+            if size > 0:
+                enable_trace(size)
+            else:
+                self.vidhub.disable_trace()
+        trace_buffer = getattr(self.vidhub, 'trace_buffer', None)
+        if trace_buffer is None:
+            size = 0
+        else:
+            size = trace_buffer.maxlen
+        self.ensure_message(client_address, size)
+        super().on_osc_dispatcher_message(osc_address, client_address, *messages)
 
 class VidhubInfoNode(PubSubOscNode):
     def __init__(self, name, parent, **kwargs):
@@ -160,6 +301,16 @@ class VidhubInfoNode(PubSubOscNode):
             vidhub, prop = self.published_property
             vidhub.device_name = messages[0]
 
+def update_child_values(node, value, keys=None):
+    '''Copy changed list items to the ``value`` of the indexed child nodes
+    '''
+    if keys is None:
+        keys = range(len(value))
+    for i in keys:
+        child = node.children.get(str(i))
+        if child is not None:
+            child.value = value[i]
+
 class VidhubLabelNode(PubSubOscNode):
     def __init__(self, name, parent, **kwargs):
         super().__init__(name, parent, **kwargs)
@@ -169,6 +320,9 @@ class VidhubLabelNode(PubSubOscNode):
         for i, lbl in enumerate(self.vidhub_property):
             node = self.add_child(str(i), cls=VidhubSingleLabelNode)
         self.published_property = (self.vidhub, self.property_attr)
+        self.vidhub.bind(**{self.property_attr:self.on_vidhub_labels})
+    def on_vidhub_labels(self, instance, value, **kwargs):
+        update_child_values(self, value, get_index_keys(kwargs))
     def on_osc_dispatcher_message(self, osc_address, client_address, *messages):
         if not len(messages):
             lbls = self.vidhub_property[:]
@@ -197,9 +351,6 @@ class VidhubSingleLabelNode(PubSubOscNode):
         self.index = int(name)
         self.published_property = (self, 'value')
         self.value = self.parent.vidhub_property[self.index]
-        self.parent.vidhub.bind(**{self.parent.property_attr:self.on_vidhub_labels})
-    def on_vidhub_labels(self, instance, value, **kwargs):
-        self.value = value[self.index]
 
 class VidhubCrosspointNode(PubSubOscNode):
     def __init__(self, name, parent, **kwargs):
@@ -208,6 +359,9 @@ class VidhubCrosspointNode(PubSubOscNode):
         for i in range(self.vidhub.num_outputs):
             self.add_child(name=str(i), cls=VidhubSingleCrosspointNode, index=i)
         self.published_property = (self.vidhub, 'crosspoints')
+        self.vidhub.bind(crosspoints=self.on_vidhub_crosspoints)
+    def on_vidhub_crosspoints(self, instance, value, **kwargs):
+        update_child_values(self, value, get_index_keys(kwargs))
     def on_osc_dispatcher_message(self, osc_address, client_address, *messages):
         if not len(messages):
             self.ensure_message(client_address, *self.vidhub.crosspoints[:])
@@ -228,9 +382,6 @@ class VidhubSingleCrosspointNode(PubSubOscNode):
         self.published_property = (self, 'value')
         self.index = kwargs.get('index')
         self.value = self.parent.vidhub.crosspoints[self.index]
-        self.parent.vidhub.bind(crosspoints=self.on_crosspoints)
-    def on_crosspoints(self, instance, value, **kwargs):
-        self.value = value[self.index]
     def on_osc_dispatcher_message(self, osc_address, client_address, *messages):
         if not len(messages):
             self.ensure_message(client_address, self.value)
@@ -265,12 +416,16 @@ class VidhubPresetGroupNode(PubSubOscNode):
     def on_child_message_received(self, node, client_address, *messages):
         loop = self.vidhub.event_loop
         if node.name == 'recall':
+            presets = []
             for i in messages:
                 try:
-                    preset = self.vidhub.presets[i]
+                    presets.append(self.vidhub.presets[i])
                 except IndexError:
                     continue
-                asyncio.ensure_future(preset.recall(), loop=loop)
+            if len(presets) == 1:
+                asyncio.ensure_future(presets[0].recall(), loop=loop)
+            elif len(presets):
+                asyncio.ensure_future(Salvo.from_presets(presets).fire(), loop=loop)
         elif node.name == 'store':
             # args:
             #       preset_index (int, optional)
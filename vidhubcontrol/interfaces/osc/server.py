@@ -19,7 +19,23 @@ class OscDispatcher(pythonosc.dispatcher.Dispatcher):
         msg = builder.build()
         await self.server.sendto(msg, client_address, when)
 
+def timetag_callback(f):
+    '''Mark an OSC handler to be called as soon as its message arrives
+
+    The bundle timetag (a :func:`time.time` timestamp or ``None``) is passed
+    as the ``when`` keyword argument rather than delaying the call until that
+    time. The handler is then responsible for acting at ``when``
+    '''
+    f.osc_timetag = True
+    return f
+
 async def _handle_callback(handler, osc_address, client_address, when=None, *messages):
+    if getattr(handler.callback, 'osc_timetag', False):
+        if handler.args:
+            handler.callback(osc_address, client_address, handler.args, *messages, when=when)
+        else:
+            handler.callback(osc_address, client_address, *messages, when=when)
+        return
     if when is not None:
         now = time.time()
         if when > now:
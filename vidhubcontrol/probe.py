@@ -0,0 +1,104 @@
+import asyncio
+import logging
+
+from vidhubcontrol.backends.reconnect import Backoff
+
+logger = logging.getLogger(__name__)
+
+class DiscoveryProbe(object):
+    '''Connects to discovered devices to find out what they are
+
+    At most ``max_concurrent`` devices are probed at once. Failed connections
+    are retried up to ``max_attempts`` times with a jittered backoff delay.
+
+    The connected backend is the result of a probe, so it can be used as the
+    device's live connection without reconnecting.
+
+    Args:
+        loop: The event loop
+        max_concurrent (int, optional): Defaults to :attr:`MAX_CONCURRENT`
+        max_attempts (int, optional): Defaults to :attr:`MAX_ATTEMPTS`
+        connect_timeout (float, optional): Defaults to :attr:`CONNECT_TIMEOUT`
+        retry_delay (float, optional): Initial delay between attempts.
+            Defaults to :attr:`RETRY_DELAY`
+        retry_max_delay (float, optional): Defaults to :attr:`RETRY_MAX_DELAY`
+
+    Attributes:
+        probes (dict): The probe task for each key currently being probed
+    '''
+    MAX_CONCURRENT = 4
+    MAX_ATTEMPTS = 3
+    CONNECT_TIMEOUT = 10.
+    RETRY_DELAY = 1.
+    RETRY_MAX_DELAY = 10.
+    def __init__(self, **kwargs):
+        self.loop = kwargs.get('loop')
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        for attr in ['max_concurrent', 'max_attempts', 'connect_timeout',
+                     'retry_delay', 'retry_max_delay']:
+            val = kwargs.get(attr)
+            if val is None:
+                val = getattr(self, attr.upper())
+            setattr(self, attr, val)
+        self.probes = {}
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+    def probe(self, key, cls, **kwargs):
+        '''Start probing a device
+
+        If a probe for the given key is already running, it is returned instead
+        of starting another
+
+        Args:
+            key: A hashable identifying the probe
+            cls: The backend class to connect with
+            **kwargs: Keyword arguments for the backend (such as ``hostaddr``)
+
+        Returns:
+            An :class:`asyncio.Task` resolving to the connected backend, or
+            ``None`` if all attempts failed
+        '''
+        t = self.probes.get(key)
+        if t is not None and not t.done():
+            return t
+        t = asyncio.ensure_future(self._run_probe(key, cls, kwargs), loop=self.loop)
+        self.probes[key] = t
+        return t
+    async def _run_probe(self, key, cls, kwargs):
+        backoff = Backoff(initial=self.retry_delay, maximum=self.retry_max_delay)
+        backend = None
+        try:
+            for attempt in range(self.max_attempts):
+                if attempt > 0:
+                    await asyncio.sleep(backoff.next_delay())
+                async with self._semaphore:
+                    backend = await self.connect_device(cls, kwargs)
+                if backend is not None:
+                    break
+                logger.debug('Probe {} failed (attempt {} of {})'.format(
+                    key, attempt + 1, self.max_attempts,
+                ))
+        finally:
+            del self.probes[key]
+        return backend
+    async def connect_device(self, cls, kwargs):
+        backend = cls(auto_connect=False, event_loop=self.loop, **kwargs)
+        try:
+            r = await asyncio.wait_for(backend.connect(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            r = False
+        except asyncio.CancelledError:
+            backend.abort()
+            raise
+        if r is False or not backend.prelude_parsed:
+            backend.abort()
+            return None
+        return backend
+    async def stop(self):
+        '''Cancel all running probes
+        '''
+        tasks = list(self.probes.values())
+        for t in tasks:
+            t.cancel()
+        if len(tasks):
+            await asyncio.wait(tasks)
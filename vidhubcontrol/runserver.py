@@ -19,12 +19,32 @@ else:
     logger = logging.getLogger(__name__)
 
 from vidhubcontrol.config import Config
+from vidhubcontrol.storage import STORAGE_TYPES
+from vidhubcontrol.probe import DiscoveryProbe
+from vidhubcontrol.startup import DeviceStartup, DeviceShutdown
 from vidhubcontrol.interfaces.osc import OscInterface
 
 def parse_args():
     p = argparse.ArgumentParser()
     p.add_argument('-c', '--config', dest='config_filename',
         default=Config.DEFAULT_FILENAME, help='Configuration filename')
+    p.add_argument('--storage', dest='storage_type', default='json',
+        choices=sorted(STORAGE_TYPES.keys()),
+        help='How the configuration is stored. "journal" appends each change '
+             'to a journal file next to the configuration file. "sqlite" uses '
+             'the configuration filename as an SQLite database')
+    p.add_argument('--max-connects', dest='max_connects', type=int,
+        default=DeviceStartup.MAX_CONCURRENT,
+        help='Maximum number of devices to connect to at once on startup')
+    p.add_argument('--connect-timeout', dest='connect_timeout', type=float,
+        default=DeviceStartup.CONNECT_TIMEOUT,
+        help='Seconds to wait for each device to connect on startup')
+    p.add_argument('--max-probes', dest='max_probes', type=int,
+        default=DiscoveryProbe.MAX_CONCURRENT,
+        help='Maximum number of discovered devices to probe at once')
+    p.add_argument('--shutdown-timeout', dest='shutdown_timeout', type=float,
+        default=DeviceShutdown.TIMEOUT,
+        help='Seconds to wait for devices to disconnect before aborting them')
     p.add_argument('--osc-address', dest='osc_address',
         help='Host address for OSC server. If not specified, one will be detected.')
     p.add_argument('--osc-port', dest='osc_port', default=OscInterface.DEFAULT_HOSTPORT,
@@ -33,11 +53,38 @@ def parse_args():
         help='Name of network interface to use for OSC server. If not specified, one will be detected.')
     p.add_argument('--osc-disabled', dest='osc_disabled', action='store_true',
         help='Disable OSC server')
+    p.add_argument('--trace-size', dest='trace_size', type=int, default=0,
+        help='Number of protocol frames to keep in memory for each device. '
+             'Send SIGUSR1 to write them to the log')
+    p.add_argument('--record-trace', dest='record_trace', metavar='FILE',
+        help='Record the protocol traffic of each device to a trace file. '
+             '"{hostaddr}" and "{hostport}" in FILE are replaced for each '
+             'device. If FILE contains neither, they are added before the '
+             'extension')
     return p.parse_args()
 
+def get_trace_filename(filename):
+    if '{hostaddr}' in filename or '{hostport}' in filename:
+        return filename
+    base, ext = os.path.splitext(filename)
+    return '{}-{{hostaddr}}-{{hostport}}{}'.format(base, ext)
+
 async def start(loop, opts):
     Config.loop = loop
-    config = Config.load(opts.config_filename)
+    backend_kwargs = {'trace_buffer_size':opts.trace_size}
+    if opts.record_trace is not None:
+        backend_kwargs['trace_filename'] = get_trace_filename(
+            os.path.expanduser(opts.record_trace),
+        )
+    config = Config.load(
+        opts.config_filename,
+        storage_type=opts.storage_type,
+        max_concurrent_connects=opts.max_connects,
+        connect_timeout=opts.connect_timeout,
+        shutdown_timeout=opts.shutdown_timeout,
+        max_concurrent_probes=opts.max_probes,
+        backend_kwargs=backend_kwargs,
+    )
     await config.start()
     logger.debug('Config started')
     interfaces = []
@@ -67,6 +114,7 @@ async def run(loop, opts):
     config, interfaces = await start(loop, opts)
     for sig in [signal.SIGINT, signal.SIGTERM]:
         loop.add_signal_handler(sig, on_sigint, config, interfaces)
+    loop.add_signal_handler(signal.SIGUSR1, dump_traces, config)
     logger.info('Ready')
     await config.stopped.wait()
 
@@ -74,6 +122,16 @@ def on_sigint(config, interfaces):
     logger.info('Exiting...')
     asyncio.ensure_future(stop(config, interfaces))
 
+def dump_traces(config):
+    for device_conf in config.iter_devices():
+        backend = device_conf.backend
+        if not hasattr(backend, 'dump_trace'):
+            continue
+        lines = backend.dump_trace()
+        logger.info('Trace for {} ({} frames)'.format(backend.device_name, len(lines)))
+        for line in lines:
+            logger.info(line)
+
 def main():
     with PidFile(pidname='vidhubcontrolserver.pid', force_tmpdir=True) as pf:
         opts = parse_args()
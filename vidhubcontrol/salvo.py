@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import time
+
+SalvoResult = collections.namedtuple('SalvoResult', ['results', 'latencies', 'skew'])
+SalvoResult.__doc__ = '''The outcome of :meth:`Salvo.fire`
+
+Attributes:
+    results (dict): ``True`` for each backend whose routes were acknowledged.
+        Keyed by backend since the device id may be unknown or shared
+    latencies (dict): Seconds from the start of the salvo to each backend's
+        response (``None`` if the command failed with an exception)
+    skew (float): Seconds between the first and last device responses
+'''
+
+class Salvo(object):
+    '''Routes on multiple devices changed together as a single "take"
+
+    The command for each device is encoded ahead of time (by :meth:`prepare`)
+    and all are sent concurrently when the salvo is fired.
+
+    Args:
+        name (str, optional): Name of the salvo
+    '''
+    def __init__(self, name=None):
+        self.name = name
+        self.crosspoints = collections.OrderedDict()
+        self.payloads = {}
+    @classmethod
+    def from_presets(cls, presets, **kwargs):
+        '''Build a salvo from one or more :class:`~vidhubcontrol.backends.base.Preset`
+        objects (for the same or different devices)
+
+        If presets for the same device share outputs, the last one wins.
+        Devices with a single preset use its cached command
+        '''
+        salvo = cls(**kwargs)
+        by_backend = collections.OrderedDict()
+        for preset in presets:
+            by_backend.setdefault(preset.backend, []).append(preset)
+            salvo.add_crosspoints(preset.backend, *preset.crosspoints.items())
+        for backend, _presets in by_backend.items():
+            if len(_presets) == 1:
+                salvo.payloads[backend] = _presets[0].get_encoded_crosspoints()
+        return salvo
+    def add_crosspoints(self, backend, *items):
+        '''Add ``(out_idx, in_idx)`` pairs for a device
+        '''
+        xpts = self.crosspoints.get(backend)
+        if xpts is None:
+            xpts = self.crosspoints[backend] = collections.OrderedDict()
+        for out_idx, in_idx in items:
+            xpts[out_idx] = in_idx
+        self.payloads.pop(backend, None)
+    def remove_device(self, backend):
+        self.crosspoints.pop(backend, None)
+        self.payloads.pop(backend, None)
+    def prepare(self):
+        '''Encode the command for each device that has changed since the last
+        call
+        '''
+        for backend, xpts in self.crosspoints.items():
+            if backend in self.payloads:
+                continue
+            items = sorted(xpts.items())
+            self.payloads[backend] = (backend.encode_crosspoints(items), items)
+    async def fire(self, when=None):
+        '''Send the routes to all devices at once
+
+        Args:
+            when (float, optional): A wall-clock (:func:`time.time`) timestamp
+                (such as an OSC timetag) to wait for before sending
+
+        Returns:
+            A :class:`SalvoResult`
+        '''
+        self.prepare()
+        if not len(self.payloads):
+            return SalvoResult({}, {}, 0.)
+        if when is not None:
+            delay = when - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        backends = list(self.crosspoints.keys())
+        loop = backends[0].event_loop
+        start = loop.time()
+        async def send(backend):
+            data, items = self.payloads[backend]
+            r = await backend.send_encoded_crosspoints(data, items)
+            return r, loop.time()
+        responses = await asyncio.gather(
+            *[send(backend) for backend in backends],
+            return_exceptions=True
+        )
+        results = {}
+        latencies = {}
+        response_times = []
+        for backend, response in zip(backends, responses):
+            if isinstance(response, BaseException):
+                results[backend] = False
+                latencies[backend] = None
+                continue
+            r, t = response
+            results[backend] = r is not False
+            latencies[backend] = t - start
+            response_times.append(t)
+        if len(response_times):
+            skew = max(response_times) - min(response_times)
+        else:
+            skew = 0.
+        return SalvoResult(results, latencies, skew)
+    def __repr__(self):
+        return '<{self.__class__.__name__}: {self}>'.format(self=self)
+    def __str__(self):
+        return '{} ({} devices)'.format(self.name, len(self.crosspoints))
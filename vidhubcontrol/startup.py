@@ -0,0 +1,202 @@
+import asyncio
+import collections
+import logging
+
+from pydispatch import Dispatcher, Property
+
+logger = logging.getLogger(__name__)
+
+StartupResult = collections.namedtuple('StartupResult', ['backend', 'ready', 'elapsed'])
+StartupResult.__doc__ = '''The outcome of connecting a device in :class:`DeviceStartup`
+
+Attributes:
+    backend: The backend instance
+    ready (bool): ``True`` if the device connected and its prelude was parsed
+    elapsed (float): Seconds from the start of startup until the device was
+        ready (or gave up)
+'''
+
+class DeviceStartup(Dispatcher):
+    '''Connects a group of devices concurrently
+
+    At most ``max_concurrent`` devices are connected at once, and each is
+    given ``connect_timeout`` seconds to become ready. Devices that are not
+    ready by then are left reconnecting in the background if their backend
+    supports it (see :meth:`retry_device`).
+
+    Args:
+        loop: The event loop
+        max_concurrent (int, optional): Defaults to :attr:`MAX_CONCURRENT`
+        connect_timeout (float, optional): Defaults to :attr:`CONNECT_TIMEOUT`
+
+    Attributes:
+        results (dict): A :class:`StartupResult` for each backend, added as
+            each device finishes
+        ready_event (asyncio.Event): Set once all devices have been attempted
+
+    :Events:
+        .. function:: on_device_ready(result)
+
+            Fired as each device finishes connecting (or fails to)
+    '''
+    MAX_CONCURRENT = 16
+    CONNECT_TIMEOUT = 10.
+    ready = Property(False)
+    _events_ = ['on_device_ready']
+    def __init__(self, **kwargs):
+        self.loop = kwargs.get('loop')
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.max_concurrent = kwargs.get('max_concurrent')
+        if self.max_concurrent is None:
+            self.max_concurrent = self.MAX_CONCURRENT
+        self.connect_timeout = kwargs.get('connect_timeout')
+        if self.connect_timeout is None:
+            self.connect_timeout = self.CONNECT_TIMEOUT
+        self.results = {}
+        self.ready_event = asyncio.Event()
+        self._semaphore = None
+        self._start_time = None
+    async def start(self, backends):
+        '''Connect all of the given backends and wait for them to finish
+
+        Returns:
+            dict: The :attr:`results`
+        '''
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._start_time = self.loop.time()
+        backends = list(backends)
+        try:
+            if len(backends):
+                await asyncio.gather(*[self.connect_device(backend) for backend in backends])
+            num_ready = len([r for r in self.results.values() if r.ready])
+            logger.info('{} of {} devices ready in {:.3f}s'.format(
+                num_ready, len(backends), self.loop.time() - self._start_time,
+            ))
+        finally:
+            self.ready = True
+            self.ready_event.set()
+        return self.results
+    async def connect_device(self, backend):
+        async with self._semaphore:
+            fut = backend.connect_fut
+            if isinstance(fut, asyncio.Task) or fut.done():
+                # Already connecting on its own
+                coro = asyncio.shield(fut)
+            else:
+                coro = backend.connect()
+            try:
+                r = await asyncio.wait_for(coro, self.connect_timeout)
+            except asyncio.TimeoutError:
+                logger.warning('Timed out connecting to {}'.format(
+                    backend.device_name or backend.device_id))
+                r = False
+            except Exception:
+                logger.exception('Error connecting to {}'.format(
+                    backend.device_name or backend.device_id))
+                r = False
+        ready = r is not False and backend.connected and backend.prelude_parsed
+        if not ready:
+            self.retry_device(backend)
+        elapsed = self.loop.time() - self._start_time
+        result = StartupResult(backend, ready, elapsed)
+        self.results[backend] = result
+        if ready:
+            logger.info('{} ready in {:.3f}s'.format(backend.device_name, elapsed))
+        self.emit('on_device_ready', result)
+        return result
+    def retry_device(self, backend):
+        '''Start the backend's reconnect loop (if it has one) for a device
+        that did not become ready during startup
+        '''
+        if not getattr(backend, 'auto_reconnect', False):
+            return
+        backend.start_reconnect()
+
+ShutdownResult = collections.namedtuple('ShutdownResult', ['backend', 'clean', 'elapsed'])
+ShutdownResult.__doc__ = '''The outcome of disconnecting a device in :class:`DeviceShutdown`
+
+Attributes:
+    backend: The backend instance
+    clean (bool): ``False`` if the deadline passed and the connection was
+        aborted
+    elapsed (float): Seconds from the start of shutdown until the device was
+        disconnected (or aborted)
+'''
+
+class DeviceShutdown(object):
+    '''Disconnects a group of devices concurrently
+
+    At most ``max_concurrent`` devices are disconnected at once. Any that have
+    not finished within ``timeout`` seconds of the start are aborted with
+    :meth:`~vidhubcontrol.backends.base.BackendBase.abort`.
+
+    Args:
+        loop: The event loop
+        max_concurrent (int, optional): Defaults to :attr:`MAX_CONCURRENT`
+        timeout (float, optional): Defaults to :attr:`TIMEOUT`
+
+    Attributes:
+        results (dict): A :class:`ShutdownResult` for each backend
+    '''
+    MAX_CONCURRENT = 16
+    TIMEOUT = 5.
+    def __init__(self, **kwargs):
+        self.loop = kwargs.get('loop')
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.max_concurrent = kwargs.get('max_concurrent')
+        if self.max_concurrent is None:
+            self.max_concurrent = self.MAX_CONCURRENT
+        self.timeout = kwargs.get('timeout')
+        if self.timeout is None:
+            self.timeout = self.TIMEOUT
+        self.results = {}
+        self._semaphore = None
+        self._start_time = None
+    async def stop(self, backends):
+        '''Disconnect all of the given backends
+
+        Returns:
+            dict: The :attr:`results`
+        '''
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._start_time = self.loop.time()
+        backends = list(backends)
+        tasks = {
+            asyncio.ensure_future(self.disconnect_device(backend), loop=self.loop):backend
+            for backend in backends
+        }
+        if len(tasks):
+            done, pending = await asyncio.wait(tasks.keys(), timeout=self.timeout)
+            for t in pending:
+                t.cancel()
+            if len(pending):
+                await asyncio.wait(pending)
+            for t in pending:
+                self.abort_device(tasks[t])
+        num_clean = len([r for r in self.results.values() if r.clean])
+        logger.info('{} of {} devices disconnected in {:.3f}s'.format(
+            num_clean, len(backends), self.loop.time() - self._start_time,
+        ))
+        return self.results
+    async def disconnect_device(self, backend):
+        async with self._semaphore:
+            try:
+                await backend.disconnect()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Error disconnecting {}'.format(backend.device_name))
+                self.abort_device(backend)
+                return
+        elapsed = self.loop.time() - self._start_time
+        self.results[backend] = ShutdownResult(backend, True, elapsed)
+        logger.debug('{} disconnected in {:.3f}s'.format(backend.device_name, elapsed))
+    def abort_device(self, backend):
+        backend.abort()
+        elapsed = self.loop.time() - self._start_time
+        self.results[backend] = ShutdownResult(backend, False, elapsed)
+        logger.warning('Aborted connection to {} after {:.3f}s'.format(
+            backend.device_name or backend.device_id, elapsed,
+        ))
@@ -0,0 +1,619 @@
+import os
+import asyncio
+import logging
+import tempfile
+import threading
+import sqlite3
+import json
+
+import jsonfactory
+
+logger = logging.getLogger(__name__)
+
+def copy_data(data):
+    '''Copy nested ``dict`` and ``list`` containers into plain objects
+
+    Used to take a snapshot of the configuration on the event loop so it can
+    be serialized in another thread
+    '''
+    if isinstance(data, dict):
+        return {key:copy_data(val) for key, val in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [copy_data(val) for val in data]
+    return data
+
+class StorageBase(object):
+    '''Base class for :class:`~vidhubcontrol.config.Config` persistence
+
+    Saves requested by :meth:`schedule_save` are delayed by ``save_delay`` so
+    that bursts of changes are written together. Writes are done in an
+    executor, and any saves requested while a write is in progress are
+    collapsed into a single write after it finishes. Writes made by
+    :meth:`save` are serialized with those in the executor, so older data
+    never replaces newer data.
+
+    Args:
+        filename (str): The file to read from and write to
+        loop: The event loop
+        save_delay (float, optional): Seconds to wait after the first change
+            before writing. Defaults to :attr:`SAVE_DELAY`
+    '''
+    SAVE_DELAY = .5
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.loop = kwargs.get('loop')
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.save_delay = kwargs.get('save_delay')
+        if self.save_delay is None:
+            self.save_delay = self.SAVE_DELAY
+        self._get_data = None
+        self._save_handle = None
+        self._save_task = None
+        self._save_pending = False
+        self._write_lock = threading.RLock()
+        self._write_id = 0
+        self._last_write_id = 0
+    @property
+    def path(self):
+        return os.path.expanduser(self.filename)
+    def read(self):
+        '''Read the stored configuration
+
+        Returns:
+            dict: The configuration data (empty if nothing has been stored)
+        '''
+        raise NotImplementedError()
+    def write(self, data):
+        '''Write the configuration data (called from an executor)
+        '''
+        raise NotImplementedError()
+    def save(self, data):
+        '''Write the data immediately, cancelling any scheduled save
+
+        If a write is in progress in the executor, this blocks until it has
+        finished. Writes gathered before this call that have not started yet
+        are discarded
+        '''
+        self._cancel_handle()
+        self._run_write(self._next_write_id(), self.write, data)
+    def schedule_save(self, get_data):
+        '''Schedule the configuration to be written
+
+        Args:
+            get_data: A callable returning the data to write. It is called
+                on the event loop just before each write and must return
+                objects that are safe to use from another thread
+                (see :func:`copy_data`)
+        '''
+        self._schedule(get_data)
+    def record_change(self, get_data, path, value=None, delete=False):
+        '''Schedule a write for a single change
+
+        Storage types that can write individual changes (such as
+        :class:`JournalStorage`) do so. Others write the full configuration
+        as in :meth:`schedule_save`.
+
+        Args:
+            get_data: The callable described in :meth:`schedule_save`
+            path (list): Keys leading to the changed item, starting from the
+                top level of the configuration data
+            value: The new value
+            delete (bool): If ``True``, the item was removed
+        '''
+        self.schedule_save(get_data)
+    def close(self):
+        pass
+    def read_presets(self, device_id):
+        '''Read the presets for a single device
+
+        Only used by storage types that do not include presets in the data
+        from :meth:`read`
+        '''
+        return []
+    def find_presets(self, name=None, output=None, device_id=None):
+        '''Search stored presets
+
+        Returns ``None`` if not supported by the storage type. Otherwise a
+        list of ``(device_id, preset_index)`` tuples
+        '''
+        return None
+    def prepare_write(self):
+        '''Called on the event loop to gather what is needed for
+        :meth:`write_prepared`
+        '''
+        return self._get_data()
+    def write_prepared(self, prepared):
+        '''Called from an executor with the result of :meth:`prepare_write`
+        '''
+        self.write(prepared)
+    def _schedule(self, get_data):
+        self._get_data = get_data
+        if self._save_task is not None:
+            self._save_pending = True
+            return
+        if self._save_handle is not None:
+            return
+        self._save_handle = self.loop.call_later(self.save_delay, self._start_save)
+    async def flush(self):
+        '''Write any scheduled changes now and wait for them to complete
+        '''
+        if self._save_handle is not None:
+            self._cancel_handle()
+            self._start_save()
+        while self._save_task is not None:
+            await asyncio.wait([self._save_task])
+    def _cancel_handle(self):
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+    def _next_write_id(self):
+        # Called on the event loop when the data for a write is gathered
+        self._write_id += 1
+        return self._write_id
+    def _run_write(self, write_id, func, *args):
+        with self._write_lock:
+            if write_id < self._last_write_id:
+                logger.debug('Discarding outdated write to {}'.format(self.path))
+                return
+            self._last_write_id = write_id
+            func(*args)
+    def _start_save(self):
+        self._save_handle = None
+        self._save_task = asyncio.ensure_future(self._do_save(), loop=self.loop)
+    async def _do_save(self):
+        try:
+            while True:
+                self._save_pending = False
+                write_id = self._next_write_id()
+                prepared = self.prepare_write()
+                try:
+                    await self.loop.run_in_executor(
+                        None, self._run_write, write_id, self.write_prepared, prepared,
+                    )
+                except Exception:
+                    logger.exception('Error writing {}'.format(self.path))
+                if not self._save_pending:
+                    break
+        finally:
+            self._save_task = None
+
+class JsonStorage(StorageBase):
+    '''Stores the configuration as a single json file
+
+    The file is replaced atomically on each write
+    '''
+    indent = 4
+    def read(self):
+        filename = self.path
+        if not os.path.exists(filename):
+            return {}
+        with open(filename, 'r') as f:
+            s = f.read()
+        return jsonfactory.loads(s)
+    def write(self, data):
+        s = jsonfactory.dumps(data, indent=self.indent)
+        atomic_write(self.path, s)
+
+class JournalStorage(JsonStorage):
+    '''Stores the configuration as a json snapshot plus a journal of changes
+
+    Each change is appended to ``<filename>.journal`` as a single line, so
+    the cost of saving depends on the size of the change rather than of the
+    whole configuration. Once :attr:`compact_threshold` records have been
+    written, the journal is merged into the snapshot (in the executor).
+
+    Every record has a sequence number, and the snapshot stores the last
+    sequence number it includes, so records that are already part of the
+    snapshot are skipped when reading.
+
+    Args:
+        compact_threshold (int, optional): Defaults to
+            :attr:`COMPACT_THRESHOLD`
+    '''
+    COMPACT_THRESHOLD = 1000
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.compact_threshold = kwargs.get('compact_threshold', self.COMPACT_THRESHOLD)
+        self.seq = 0
+        self.num_journal_records = 0
+        self._changes = []
+        self._snapshot_needed = False
+    @property
+    def journal_path(self):
+        return '{}.journal'.format(self.path)
+    def read(self):
+        data, seq, num_records = self._read()
+        self.seq = seq
+        self.num_journal_records = num_records
+        return data
+    def _read(self):
+        data = super().read()
+        seq = data.pop('_journal_seq', 0)
+        num_records = 0
+        filename = self.journal_path
+        if not os.path.exists(filename):
+            return data, seq, num_records
+        offset = 0
+        with open(filename, 'rb+') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError()
+                    record = jsonfactory.loads(line.decode('UTF-8'))
+                except ValueError:
+                    # An incomplete record from an interrupted write. Remove
+                    # it so that new records start on a new line
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                num_records += 1
+                if record['seq'] <= seq:
+                    continue
+                apply_record(data, record)
+                seq = record['seq']
+        return data, seq, num_records
+    def schedule_save(self, get_data):
+        self._snapshot_needed = True
+        super().schedule_save(get_data)
+    def record_change(self, get_data, path, value=None, delete=False):
+        self.seq += 1
+        record = {'seq':self.seq, 'path':list(path)}
+        if delete:
+            record['op'] = 'del'
+        else:
+            record['op'] = 'set'
+            record['value'] = copy_data(value)
+        self._changes.append(record)
+        self._schedule(get_data)
+    def save(self, data):
+        self._cancel_handle()
+        self._changes = []
+        self._snapshot_needed = False
+        self._run_write(self._next_write_id(), self.write, data, self.seq)
+    def prepare_write(self):
+        if self._snapshot_needed:
+            self._snapshot_needed = False
+            self._changes = []
+            return ('snapshot', self._get_data(), self.seq)
+        changes = self._changes
+        self._changes = []
+        self.num_journal_records += len(changes)
+        compact = self.num_journal_records >= self.compact_threshold
+        if compact:
+            self.num_journal_records = 0
+        return ('journal', changes, compact)
+    def write_prepared(self, prepared):
+        if prepared[0] == 'snapshot':
+            self.write(*prepared[1:])
+            return
+        changes, compact = prepared[1:]
+        if len(changes):
+            lines = [jsonfactory.dumps(record) for record in changes]
+            with open(self.journal_path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        if compact:
+            self.compact()
+    def write(self, data, seq=None):
+        if seq is None:
+            seq = self.seq
+        data = data.copy()
+        data['_journal_seq'] = seq
+        super().write(data)
+        with open(self.journal_path, 'w'):
+            pass
+    def compact(self):
+        '''Merge the journal into the snapshot
+        '''
+        data, seq, num_records = self._read()
+        self.write(data, seq)
+
+def apply_record(data, record):
+    '''Apply a journal record to configuration data
+    '''
+    path = record['path']
+    container = data
+    for key in path[:-1]:
+        if isinstance(container, list):
+            container = container[key]
+        else:
+            container = container.setdefault(key, {})
+    key = path[-1]
+    if record['op'] == 'del':
+        container.pop(key, None)
+    elif isinstance(container, list):
+        while len(container) <= key:
+            container.append(None)
+        container[key] = record['value']
+    else:
+        container[key] = record['value']
+
+class SqliteStorage(StorageBase):
+    '''Stores the configuration in an SQLite database
+
+    Devices, presets and preset crosspoints are kept in separate tables
+    indexed by device id, preset name and output. Changes are written in
+    batched transactions (in the executor) with the database in WAL mode,
+    and the presets for each device are only read once it is used (see
+    :meth:`vidhubcontrol.backends.base.VidhubBackendBase.load_presets`).
+    '''
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS devices (
+            prop TEXT NOT NULL,
+            device_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (prop, device_id)
+        );
+        CREATE INDEX IF NOT EXISTS devices_device_id ON devices (device_id);
+        CREATE TABLE IF NOT EXISTS presets (
+            device_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            name TEXT,
+            PRIMARY KEY (device_id, idx)
+        );
+        CREATE INDEX IF NOT EXISTS presets_name ON presets (name);
+        CREATE TABLE IF NOT EXISTS preset_crosspoints (
+            device_id TEXT NOT NULL,
+            preset_idx INTEGER NOT NULL,
+            out_idx INTEGER NOT NULL,
+            in_idx INTEGER NOT NULL,
+            PRIMARY KEY (device_id, preset_idx, out_idx)
+        );
+        CREATE INDEX IF NOT EXISTS preset_crosspoints_output
+            ON preset_crosspoints (device_id, out_idx, in_idx);
+    '''
+    DEVICE_PROPS = ['vidhubs', 'smartviews', 'smartscopes']
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._changes = []
+        self._snapshot_needed = False
+        self._conn = None
+        self._read_conn = None
+    def _connect(self, **kwargs):
+        filename = self.path
+        dirname = os.path.dirname(filename)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        conn = sqlite3.connect(filename, **kwargs)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+        return conn
+    @property
+    def conn(self):
+        '''Connection used for writes (from the executor)
+        '''
+        if self._conn is None:
+            self._conn = self._connect(check_same_thread=False)
+        return self._conn
+    @property
+    def read_conn(self):
+        '''Connection used for reads on the event loop
+
+        Since the database is in WAL mode, reads are not blocked by writes
+        in progress
+        '''
+        if self._read_conn is None:
+            self._read_conn = self._connect()
+        return self._read_conn
+    def close(self):
+        with self._write_lock:
+            for conn in [self._conn, self._read_conn]:
+                if conn is not None:
+                    conn.close()
+            self._conn = None
+            self._read_conn = None
+    def read(self):
+        data = {prop:{} for prop in self.DEVICE_PROPS}
+        rows = self.read_conn.execute('SELECT prop, device_id, data FROM devices').fetchall()
+        for prop, device_id, ddata in rows:
+            data.setdefault(prop, {})[device_id] = json.loads(ddata)
+        return data
+    def read_presets(self, device_id):
+        conn = self.read_conn
+        rows = conn.execute(
+            'SELECT idx, name FROM presets WHERE device_id = ? ORDER BY idx',
+            (device_id,),
+        ).fetchall()
+        xpt_rows = conn.execute(
+            'SELECT preset_idx, out_idx, in_idx FROM preset_crosspoints '
+            'WHERE device_id = ?',
+            (device_id,),
+        ).fetchall()
+        presets = [
+            {'index':idx, 'name':name, 'crosspoints':{}} for idx, name in rows
+        ]
+        by_index = {pdata['index']:pdata for pdata in presets}
+        for preset_idx, out_idx, in_idx in xpt_rows:
+            by_index[preset_idx]['crosspoints'][out_idx] = in_idx
+        return presets
+    def find_presets(self, name=None, output=None, device_id=None):
+        '''Search stored presets using the database indexes
+
+        Changes that have not been written yet are not included.
+
+        Args:
+            name (str, optional): Preset name to match
+            output (int, optional): Only presets that store this output
+            device_id (str, optional): Only presets for this device
+
+        Returns:
+            A list of ``(device_id, preset_index)`` tuples
+        '''
+        query = ['SELECT DISTINCT p.device_id, p.idx FROM presets p']
+        where = []
+        args = []
+        if output is not None:
+            query.append(
+                'JOIN preset_crosspoints x ON '
+                'x.device_id = p.device_id AND x.preset_idx = p.idx'
+            )
+            where.append('x.out_idx = ?')
+            args.append(output)
+        if name is not None:
+            where.append('p.name = ?')
+            args.append(name)
+        if device_id is not None:
+            where.append('p.device_id = ?')
+            args.append(device_id)
+        if len(where):
+            query.append('WHERE ' + ' AND '.join(where))
+        query.append('ORDER BY p.device_id, p.idx')
+        rows = self.read_conn.execute(' '.join(query), args).fetchall()
+        return [tuple(row) for row in rows]
+    def schedule_save(self, get_data):
+        self._snapshot_needed = True
+        super().schedule_save(get_data)
+    def record_change(self, get_data, path, value=None, delete=False):
+        self._changes.append((list(path), copy_data(value), delete))
+        self._schedule(get_data)
+    def save(self, data):
+        self._cancel_handle()
+        self._changes = []
+        self._snapshot_needed = False
+        self._run_write(self._next_write_id(), self.write, data)
+    def prepare_write(self):
+        if self._snapshot_needed:
+            self._snapshot_needed = False
+            self._changes = []
+            return ('snapshot', self._get_data())
+        changes = self._changes
+        self._changes = []
+        return ('changes', changes)
+    def write_prepared(self, prepared):
+        if prepared[0] == 'snapshot':
+            self.write(prepared[1])
+            return
+        with self._write_lock:
+            conn = self.conn
+            with conn:
+                for path, value, delete in prepared[1]:
+                    self._apply_change(conn, path, value, delete)
+    def write(self, data):
+        with self._write_lock:
+            conn = self.conn
+            with conn:
+                conn.execute('DELETE FROM devices')
+                # Devices without a "presets" key have not loaded them, so
+                # only the presets of removed devices are deleted here
+                vidhub_ids = set(data.get('vidhubs', {}).keys())
+                rows = conn.execute('SELECT DISTINCT device_id FROM presets').fetchall()
+                for (device_id,) in rows:
+                    if device_id not in vidhub_ids:
+                        self._delete_presets(conn, device_id)
+                for prop in self.DEVICE_PROPS:
+                    for device_id, ddata in data.get(prop, {}).items():
+                        self._set_device(conn, prop, device_id, ddata)
+    def _apply_change(self, conn, path, value, delete):
+        prop, device_id = path[:2]
+        if len(path) == 2:
+            if delete:
+                conn.execute(
+                    'DELETE FROM devices WHERE prop = ? AND device_id = ?',
+                    (prop, device_id),
+                )
+                if prop == 'vidhubs':
+                    self._delete_presets(conn, device_id)
+            else:
+                self._set_device(conn, prop, device_id, value)
+        elif path[2] != 'presets':
+            row = conn.execute(
+                'SELECT data FROM devices WHERE prop = ? AND device_id = ?',
+                (prop, device_id),
+            ).fetchone()
+            if row is None:
+                return
+            ddata = json.loads(row[0])
+            ddata[path[2]] = value
+            conn.execute(
+                'UPDATE devices SET data = ? WHERE prop = ? AND device_id = ?',
+                (json.dumps(ddata), prop, device_id),
+            )
+        elif len(path) == 4:
+            self._set_preset(conn, device_id, path[3], value)
+        elif path[4] == 'name':
+            conn.execute(
+                'UPDATE presets SET name = ? WHERE device_id = ? AND idx = ?',
+                (value, device_id, path[3]),
+            )
+        elif path[4] == 'crosspoints':
+            self._set_preset_crosspoints(conn, device_id, path[3], value)
+    def _set_device(self, conn, prop, device_id, ddata):
+        ddata = ddata.copy()
+        presets = ddata.pop('presets', None)
+        conn.execute(
+            'INSERT OR REPLACE INTO devices (prop, device_id, data) VALUES (?, ?, ?)',
+            (prop, device_id, json.dumps(ddata)),
+        )
+        if presets is None:
+            return
+        self._delete_presets(conn, device_id)
+        for pdata in presets:
+            if pdata is None:
+                continue
+            self._set_preset(conn, device_id, pdata['index'], pdata)
+    def _delete_presets(self, conn, device_id):
+        conn.execute('DELETE FROM presets WHERE device_id = ?', (device_id,))
+        conn.execute('DELETE FROM preset_crosspoints WHERE device_id = ?', (device_id,))
+    def _set_preset(self, conn, device_id, idx, pdata):
+        conn.execute(
+            'INSERT OR REPLACE INTO presets (device_id, idx, name) VALUES (?, ?, ?)',
+            (device_id, idx, pdata.get('name')),
+        )
+        self._set_preset_crosspoints(conn, device_id, idx, pdata.get('crosspoints', {}))
+    def _set_preset_crosspoints(self, conn, device_id, idx, crosspoints):
+        conn.execute(
+            'DELETE FROM preset_crosspoints WHERE device_id = ? AND preset_idx = ?',
+            (device_id, idx),
+        )
+        conn.executemany(
+            'INSERT INTO preset_crosspoints (device_id, preset_idx, out_idx, in_idx) '
+            'VALUES (?, ?, ?, ?)',
+            ((device_id, idx, int(out_idx), in_idx) for out_idx, in_idx in crosspoints.items()),
+        )
+
+class StateCache(JsonStorage):
+    '''Stores the last known state of each device (routing, labels, etc)
+    so it can be shown before the devices have connected
+
+    Written in compact json, keyed by device id
+    '''
+    SAVE_DELAY = 2.
+    indent = None
+    def read(self):
+        try:
+            return super().read()
+        except ValueError:
+            logger.exception('Could not read {}'.format(self.path))
+            return {}
+
+STORAGE_TYPES = {
+    'json':JsonStorage,
+    'journal':JournalStorage,
+    'sqlite':SqliteStorage,
+}
+
+def atomic_write(filename, s):
+    '''Write a string to a temporary file and rename it to ``filename``
+    '''
+    dirname = os.path.dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=dirname, prefix='.{}.'.format(os.path.basename(filename)), suffix='.tmp',
+    )
+    try:
+        if os.path.exists(filename):
+            os.chmod(tmp_filename, os.stat(filename).st_mode & 0o777)
+        else:
+            os.chmod(tmp_filename, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            f.write(s)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+    except Exception:
+        os.unlink(tmp_filename)
+        raise